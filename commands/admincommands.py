@@ -1,16 +1,18 @@
 from discord.ext import commands
-from data.botsettings import ChannelType, GuildTextChannelMismatch, GuildRoleMismatch, InvalidChannelType , InvalidGuild, InvalidRole, RegisteredRoleUnitialized, InvalidStratIndex
+from data.botsettings import ChannelType, GuildTextChannelMismatch, GuildRoleMismatch, InvalidChannelType , InvalidGuild, InvalidRole, RegisteredRoleUnitialized, InvalidStratIndex, EmptyName
 from data.playerdata import UserNotRegistered, UserAlreadyRegistered
-from data.matchhistorydata import MatchHistoryData, InvalidMatchResult, MatchIDNotFound, MatchResultIdentical, MatchResult
+from data.matchhistorydata import MatchHistoryData, InvalidMatchResult, MatchIDNotFound, MatchResultIdentical, MatchResult, FormatCreationTime
+from data.playerstatsdata import PlayerStatsData
 from data.mmrrole import MMRRoleExists, MMRRoleRangeConflict, InvalidMMRRole, NoMMRRoles
 from data.siegemap import MapExists, InvalidMap, CantRerollMap
 from data.mappool import CantForceMapPool, MapPoolExists, InvalidMapPool, MapPoolType, InvalidMapPoolType, InvalidMapPoolMap, MapPoolMapExists, PoolIsEmpty
 from data.stratroulettedata import InvalidStratRouletteTeam, InvalidStratRouletteTeamType, StratRouletteTeam, StratRouletteTeamType, NoStratRouletteStrats
-from services.matchservice import TeamResult, PlayerNotQueuedOrInGame, PlayersNotSwapable
+from services.matchservice import TeamResult, PlayerNotQueuedOrInGame, PlayersNotSwapable, InvalidMatchID
 from services.stratrouletteservice import CantStartStratRoulette, CantModifyStratRoulette
-from utils.botutils import IsAdmin, IsValidChannel, AddRoles, RemoveRoles, GuildCommand
+from utils.botutils import IsAdmin, IsValidChannel, AddRoles, RemoveRoles, GuildCommand, GetRankRoles, ReconcileMemberRoles, ReconcileRoles
 from utils.errorutils import HandleAppError, HandleError
 from utils.chatutils import SendMessage, SendChannelMessage, SendMessageEdit
+from utils.matchmakingutils import MatchmakingWindow
 from globals import *
 from mongoengine import disconnect
 from discord import app_commands
@@ -18,7 +20,6 @@ from discord.app_commands import Choice
 import discord
 import math
 import random
-import asyncio
 
 class AdminCommands(commands.Cog):
     def __init__(self, bot):
@@ -36,6 +37,12 @@ class AdminCommands(commands.Cog):
         # populates an array of Choices for all the maps that contain the same string as the user's input
         return [ app_commands.Choice(name=pool.name, value=pool.name) for pool in pools if current.lower() in pool.name.lower() ]
 
+    async def LobbyNameAutoComplete(self, interaction:discord.Interaction, current:str):
+        lobbies = matchService.GetSortedLobbies()
+
+        # populates an array of Choices for all the lobbies that contain the same string as the user's input
+        return [ app_commands.Choice(name=lobby.name, value=lobby.name) for lobby in lobbies if current.lower() in lobby.name.lower() ]
+
     @GuildCommand(name='quit')
     @IsValidChannel(ChannelType.ADMIN)
     @IsAdmin()
@@ -44,6 +51,8 @@ class AdminCommands(commands.Cog):
         goodbye = ['au revoir', 'goodbye', 'cya', 'à la prochaine']
         await interaction.response.send_message(random.choice(goodbye))
         print('User {} has requested a quit. Closing bot.'.format(interaction.user))
+        await persistenceService.Flush() # make sure queued writes aren't lost
+        persistenceService.Shutdown()
         disconnect() # disconect our MongoDB instance
         await self.bot.close() # close our bot instance
 
@@ -86,14 +95,97 @@ class AdminCommands(commands.Cog):
         except discord.HTTPException:
             await SendMessage(interaction, description='Registration failed. Please try again.', color=discord.Color.red())
 
+    @GuildCommand(name='addlobby')
+    @IsValidChannel(ChannelType.LOBBY)
+    @IsAdmin()
+    @app_commands.describe(name='The name of the new lobby.', size='How many players fill the lobby before a match starts.')
+    async def OnAddLobby(self, interaction:discord.Interaction, name:str, size:app_commands.Range[int, 2, 10] = 10):
+        """Adds a lobby
+           Each lobby has its own queue, so several matches can fill up and run at the same time.
+
+           **string:** <name>
+           The name of the new lobby. This is not case sensitive.
+
+           **int:** <size> (Optional)
+           How many players fill the lobby before a match starts. Defaults to 10, which is also the most match history can store.
+        """
+        print('Adding lobby {} with size {}'.format(name, size))
+
+        if (name.strip() == ''):
+            raise EmptyName()
+
+        lobby = matchService.AddLobby(name.strip(), size)
+
+        await SendMessage(interaction, description='Lobby `{}` has been added for {} players.'.format(lobby.name, lobby.size), color=discord.Color.blue())
+
+    @GuildCommand(name='removelobby')
+    @IsValidChannel(ChannelType.LOBBY)
+    @IsAdmin()
+    @app_commands.describe(name='The lobby you want to remove.')
+    @app_commands.autocomplete(name=LobbyNameAutoComplete)
+    async def OnRemoveLobby(self, interaction:discord.Interaction, name:str):
+        """Removes a lobby
+           The lobby has to be empty and the default lobby can't be removed.
+
+           **string:** <name>
+           The lobby you want to remove. This is not case sensitive.
+        """
+        print('Removing lobby {}'.format(name))
+
+        matchService.RemoveLobby(name)
+
+        await SendMessage(interaction, description='Lobby `{}` has been removed.'.format(name), color=discord.Color.blue())
+
+    @GuildCommand(name='setmatchmaking')
+    @IsValidChannel(ChannelType.LOBBY)
+    @IsAdmin()
+    @app_commands.describe(enabled='Whether matches are made from the closest MMRs instead of the first players to join.', lobby='The lobby to change. Uses the default lobby if not given.', base_window='The largest MMR spread allowed in a match straight away.', widen_per_minute='How much the allowed MMR spread grows every minute a player waits.', max_window='The allowed MMR spread never grows past this.')
+    @app_commands.autocomplete(lobby=LobbyNameAutoComplete)
+    async def OnSetMatchmaking(self, interaction:discord.Interaction, enabled:bool, lobby:str = None, base_window:app_commands.Range[int, 0, 5000] = 200, widen_per_minute:app_commands.Range[int, 0, 1000] = 50, max_window:app_commands.Range[int, 0, 10000] = 1000):
+        """Sets how a lobby makes matches
+           With matchmaking enabled the lobby can hold more players than a match needs. A match starts as soon as enough players are within the allowed MMR spread of each other, and the spread widens the longer players wait.
+
+           **bool:** <enabled>
+           Whether matches are made from the closest MMRs instead of the first players to join.
+
+           **string:** <lobby> (Optional)
+           The lobby to change. Uses the default lobby if not given.
+
+           **int:** <base_window> (Optional)
+           The largest MMR spread allowed in a match straight away. Defaults to 200.
+
+           **int:** <widen_per_minute> (Optional)
+           How much the allowed MMR spread grows every minute a player waits. Defaults to 50.
+
+           **int:** <max_window> (Optional)
+           The allowed MMR spread never grows past this. Defaults to 1000.
+        """
+        print('Setting matchmaking for lobby {} to {}'.format(lobby, enabled))
+
+        window = MatchmakingWindow(base_window, widen_per_minute, max(base_window, max_window)) if enabled else None
+        updatedLobby = matchService.SetLobbyMatchmaking(lobby, window)
+
+        if (enabled):
+            description = 'Lobby `{}` now matches players within {} MMR, widening by {} a minute up to {}.'.format(updatedLobby.name, window.baseWindow, window.widenPerMinute, window.maxWindow)
+        else:
+            description = 'Lobby `{}` now starts a match with the first {} players to join.'.format(updatedLobby.name, updatedLobby.size)
+
+        await SendMessage(interaction, description=description, color=discord.Color.blue())
+
     @GuildCommand(name='clearqueue')
     @IsValidChannel(ChannelType.LOBBY)
     @IsAdmin()
-    async def OnClearQueue(self, interaction:discord.Interaction):
-        """Clears the matchmaking queue"""
-        print('Clearing queue')
+    @app_commands.describe(lobby='The lobby you want to clear. Uses the default lobby if not given.')
+    @app_commands.autocomplete(lobby=LobbyNameAutoComplete)
+    async def OnClearQueue(self, interaction:discord.Interaction, lobby:str = None):
+        """Clears the matchmaking queue
 
-        matchService.ClearQueue()
+           **string:** <lobby> (Optional)
+           The lobby you want to clear. Uses the default lobby if not given.
+        """
+        print('Clearing queue {}'.format(lobby))
+
+        matchService.ClearQueue(lobby)
 
         extraMessage = ''
         if (stratRouletteService.IsMatchQueued() and not stratRouletteService.IsMatchInProgress()):
@@ -126,46 +218,26 @@ class AdminCommands(commands.Cog):
     @IsValidChannel(ChannelType.LOBBY)
     @IsAdmin()
     @app_commands.rename(fill_with_fake_players='debug')
-    @app_commands.describe(fill_with_fake_players='DEBUG ONLY: Fills the lobby with fake players.')
-    async def OnForceStartMatch(self, interaction:discord.Interaction, fill_with_fake_players:bool = False):
+    @app_commands.describe(fill_with_fake_players='DEBUG ONLY: Fills the lobby with fake players.', lobby='The lobby you want to start. Uses the default lobby if not given.')
+    @app_commands.autocomplete(lobby=LobbyNameAutoComplete)
+    async def OnForceStartMatch(self, interaction:discord.Interaction, fill_with_fake_players:bool = False, lobby:str = None):
         """Starts the match
         
            **bool:** <fill_with_fake_players>
            Fills the lobby with fake players. This is useful for testing bot functionality without having 10 players. **DO NOT USE IN A REAL MATCH**
+
+           **string:** <lobby> (Optional)
+           The lobby you want to start. Uses the default lobby if not given.
         """
         print('{} is force starting the match {}'.format(interaction.user, 'and filling with fake users' if fill_with_fake_players else ''))
 
-        await SendMessage(interaction, description='{0.mention} is force starting the match!'.format(interaction.user), color=discord.Color.blue())
+        # Look the lobby up first so a bad name doesn't get announced
+        matchService.GetLobby(lobby)
 
-        id = matchService.PrepareMatch(fill_with_fake_players, stratRouletteService.forcedPool)
-
-        # Early out for the simple case where we only have to start a match
-        if (not stratRouletteService.IsMatchQueued()):
-            result = await matchService.StartMatch(id)
-
-            # If a strat roulette match was started afterwards, we should make sure to stop it
-            if (stratRouletteService.IsMatchInProgress()):
-                await stratRouletteService.StopMatch(id, result)
-            return
-
-        # If we need to start a match and a strat roulette match, do some task scheduling
-        matchServiceTask = asyncio.create_task(
-            matchService.StartMatch(id)
-        )
-
-        stratRouletteServiceTask = asyncio.create_task(
-            stratRouletteService.TryStartQueuedMatch(matchService.GetTeam1Players(id), matchService.GetTeam2Players(id))
-        )
-
-        await matchServiceTask
-        lastMatchResult = matchService.GetLastMatchResult()
-        matchResult = MatchResult.INVALID
-
-        if (lastMatchResult is not None and lastMatchResult[0] == id):
-            matchResult = lastMatchResult[1]
+        await SendMessage(interaction, description='{0.mention} is force starting the match!'.format(interaction.user), color=discord.Color.blue())
 
-        await stratRouletteService.StopMatch(id, matchResult)
-        await stratRouletteServiceTask 
+        id = await matchService.PrepareMatch(fill_with_fake_players, stratRouletteService.forcedPool, lobby)
+        await matchService.RunMatch(id)
 
 
     @GuildCommand(name='clearchannel')
@@ -455,7 +527,7 @@ class AdminCommands(commands.Cog):
         if (not botSettings.IsValidMMRRole(role)):
             raise InvalidMMRRole(role)
 
-        if (not botSettings.IsMMRRoleRangeValid(mmr_min, mmr_max)):
+        if (not botSettings.IsMMRRoleRangeValid(mmr_min, mmr_max, ignoreRole=role)):
             raise MMRRoleRangeConflict()
 
         botSettings.UpdateMMRRole(role, mmr_min, mmr_max, mmr_delta)
@@ -493,12 +565,9 @@ class AdminCommands(commands.Cog):
         mmrMax = botSettings.mmrRoles[role.id].mmrMax
         mmrDelta = botSettings.mmrRoles[role.id].mmrDelta
 
-        for player in botSettings.registeredPlayers.values():
-            if player.user is None:
-                continue
-
-            member = botSettings.guild.get_member(player.user.id)
-            if member is not None and role in member.roles:
+        # Only members who have the role need it taken away, no need to go through every registered player
+        for member in list(role.members):
+            if (botSettings.IsUserRegistered(member)):
                 await RemoveRoles(interaction, member, role, errorMessage='Failed to remove rank. Please try again.')
 
         botSettings.RemoveMMRRole(role)
@@ -528,6 +597,7 @@ class AdminCommands(commands.Cog):
         if (not botSettings.IsUserRegistered(member)):
             raise UserNotRegistered(member)
 
+        await botSettings.LoadPlayers([member.id])
         previousMMR = botSettings.SetMMR(member, mmr)
 
         previousRole, newRole = botSettings.GetMMRRole(member, previousMMR)
@@ -581,11 +651,10 @@ class AdminCommands(commands.Cog):
         if (len(mmrRoles) == 0):
             raise NoMMRRoles()
 
-        previousRole, newRole = botSettings.GetMMRRole(member)
-
-        # Remove all their previous mmr roles and readd the correct one
-        await RemoveRoles(interaction, member, *mmrRoles, errorMessage='Failed to remove previous rank from {0.mention}. Please try again.'.format(member))
-        await AddRoles(interaction, member, newRole.role, botSettings.registeredRole, errorMessage='Failed to add current rank to {0.mention}. Please try again.'.format(member))
+        try:
+            await ReconcileMemberRoles(member, mmrRoles, GetRankRoles(member.id), reason='User {0.user} is updating roles for {1}'.format(interaction, member))
+        except discord.HTTPException:
+            await SendChannelMessage(interaction.channel, description='Failed to update the rank of {0.mention}. Please try again.'.format(member), color=discord.Color.red())
     
         await SendMessage(interaction, description='Ranks have been updated on {0.mention}'.format(member), color=discord.Color.blue())
 
@@ -607,23 +676,32 @@ class AdminCommands(commands.Cog):
         # Acknowledge the request immediately since it can take a lot of time to perform the action
         await interaction.response.defer(thinking=True)
 
-        for player in botSettings.registeredPlayers.values():
-            if player.user is None:
+        entries = []
+        # Ranks only depend on mmr, which the leaderboard already has for everyone, so this never has to load player data
+        for member in botSettings.guild.members:
+            # Just ignore guild members who aren't registered
+            if (not botSettings.IsUserRegistered(member)):
                 continue
 
-            previousRole, newRole = botSettings.GetMMRRole(player.user)
+            entries.append((member, GetRankRoles(member.id)))
 
-            member = botSettings.guild.get_member(player.user.id)
+        async def OnProgress(result):
+            await SendMessageEdit(interaction, description='Updating ranks... {}/{} players checked, {} updated.'.format(result.processed, result.total, result.updated), color=discord.Color.blue())
 
-            # Just ignore users who aren't in the guild
-            if (member is None):
-                continue
+        result = await ReconcileRoles(entries, mmrRoles, reason='User {0.user} is refreshing roles for all users'.format(interaction), onProgress=OnProgress)
+
+        description = 'Ranks have been updated on all registered players. {} of {} players needed changes.'.format(result.updated, result.total)
+        color = discord.Color.blue()
 
-            # Remove all their previous mmr roles and readd the correct one
-            await RemoveRoles(interaction, member, *mmrRoles, errorMessage='Failed to remove previous rank from {0.mention}. Please try again.'.format(member))
-            await AddRoles(interaction, member, newRole.role, botSettings.registeredRole, errorMessage='Failed to add current rank to {0.mention}. Please try again.'.format(member))
+        if (len(result.failed) > 0):
+            description += '\nFailed to update the rank of {}. Please try again.'.format(', '.join(member.mention for member in result.failed))
+            color = discord.Color.red()
 
-        await SendMessageEdit(interaction, description='Ranks have been updated on all registered players.', color=discord.Color.blue())
+        try:
+            await SendMessageEdit(interaction, description=description, color=color)
+        except discord.HTTPException:
+            # The interaction can expire on large servers, so fall back to posting in the channel
+            await SendChannelMessage(interaction.channel, description=description, color=color)
 
     @GuildCommand(name='addmap')
     @IsValidChannel(ChannelType.ADMIN)
@@ -688,6 +766,32 @@ class AdminCommands(commands.Cog):
         botSettings.SetMapThumbnail(name, thumbnail_url)
         await SendMessage(interaction, description='`{}` has been set as the thumbnail for map {}.'.format(thumbnail_url, name), color=discord.Color.blue())	
 
+    @GuildCommand(name='setmapweighting')
+    @IsValidChannel(ChannelType.ADMIN)
+    @IsAdmin()
+    @app_commands.describe(play_count_weight='How strongly less played maps are favoured. 0 ignores how often maps have been played.',
+        recency_decay='How much less likely a map is right after being played. 0 turns this off.',
+        cooldown='How many of the most recently played maps can\'t be picked.')
+    async def OnSetMapWeighting(self, interaction:discord.Interaction, play_count_weight:app_commands.Range[float, 0.0, 5.0] = 1.0, recency_decay:app_commands.Range[float, 0.0, 0.99] = 0.0, cooldown:app_commands.Range[int, 0, 10] = 0):
+        """Changes how maps are picked for matches
+
+           **float:** <play_count_weight>
+           **Default value:** 1.0
+           How strongly less played maps are favoured. 0 ignores how often maps have been played.
+
+           **float:** <recency_decay>
+           **Default value:** 0.0
+           How much less likely a map is right after being played. The penalty wears off a little more with every match. 0 turns this off.
+
+           **int:** <cooldown>
+           **Default value:** 0
+           How many of the most recently played maps can't be picked.
+        """
+        print('Setting map weighting to play count weight: {} recency decay: {} cooldown: {}'.format(play_count_weight, recency_decay, cooldown))
+
+        botSettings.SetMapWeighting(play_count_weight, recency_decay, cooldown)
+        await SendMessage(interaction, description='Maps will now be picked with a play count weight of `{}`, a recency decay of `{}` and a cooldown of `{}` matches.'.format(play_count_weight, recency_decay, cooldown), color=discord.Color.blue())
+
     @GuildCommand(name='addpool')
     @IsValidChannel(ChannelType.ADMIN)
     @IsAdmin()
@@ -781,7 +885,7 @@ class AdminCommands(commands.Cog):
         if (not botSettings.DoesMapPoolExist(name)):
             raise InvalidMapPool(name)
 
-        botSettings.pools[name.lower()].SetType(type.value)
+        botSettings.SetMapPoolType(name, type.value)
         await SendMessage(interaction, description='`{}` has changed Map Pool type to `{}`'.format(name, type.name), color=discord.Color.blue())
 
     @GuildCommand(name='addpoolmap')
@@ -858,9 +962,8 @@ class AdminCommands(commands.Cog):
         """
         print('Showing leaderboards')
 
-        players = botSettings.GetSortedRegisteredPlayers()
         description = ''
-        numPlayers = len(players)
+        numPlayers = len(botSettings.leaderboard)
         maxPlayersPerPage = 20 # We can only display so many names on a single message
         numPages = math.ceil(numPlayers / maxPlayersPerPage)
         title = '{} Leaderboard'.format(botSettings.guild.name)
@@ -883,7 +986,7 @@ class AdminCommands(commands.Cog):
         if (endIndex > numPlayers):
             endIndex = numPlayers
 
-        playersOnPage = players[startIndex:endIndex]
+        playersOnPage = await botSettings.GetSortedRegisteredPlayers(startIndex, endIndex - startIndex)
         rank = startIndex + 1
         isFirst = True
 
@@ -949,6 +1052,8 @@ class AdminCommands(commands.Cog):
 
         await SendMessage(interaction, description='Recalling match {} with a new result: {}'.format(match_id, new_result_type.name), color=discord.Color.blue())
 
+        await botSettings.LoadPlayers([player._id for player in match._team1 + match._team2])
+
         def GetTeamField(teamName:str, teamResult:TeamResult):
             teamField = {}
             teamField['name'] = '{}: Team {}'.format('Winner' if teamResult == TeamResult.WIN else 'Loser', teamName)
@@ -1022,10 +1127,20 @@ class AdminCommands(commands.Cog):
 
             isFirst = AddToField(team2Field, isFirst, player._id, sign, oldMMR, delta, newMMR, oldRole, newRole)
 
-        match._result = new_result.value
-        match.save()
+        team1IDs = [player._id for player in match._team1]
+        team2IDs = [player._id for player in match._team2]
+
+        with persistenceService.Batch():
+            # Take the old result out of everyone's stats before adding the new one
+            PlayerStatsData.RecordMatch(team1IDs, team2IDs, MatchResult(match._result), match._map, direction=-1)
+            PlayerStatsData.RecordMatch(team1IDs, team2IDs, new_result, match._map)
+
+            match._result = new_result.value
+            persistenceService.Save(match)
+
+        await persistenceService.Flush()
 
-        description = '**Creation Time:** {}\n**Map:** {}\n**Map Pool:** {}'.format(match._creationTime, match._map, match._pool)
+        description = '**Creation Time:** {}\n**Map:** {}\n**Map Pool:** {}'.format(FormatCreationTime(match._creationTime), match._map, match._pool)
 
         if (new_result == MatchResult.TEAM1VICTORY):
             await SendChannelMessage(botSettings.resultsChannel, title=title, description=description, fields=[team1Field, team2Field], footer=footer, color=discord.Color.blue())
@@ -1041,6 +1156,7 @@ class AdminCommands(commands.Cog):
         if (len(mmrRoles) == 0):
             raise NoMMRRoles()
 
+        entries = []
         for player in players:
             # FakeUser detected
             if (player < 0):
@@ -1052,32 +1168,39 @@ class AdminCommands(commands.Cog):
             if (member is None):
                 continue
 
-            previousRole, newRole = botSettings.GetMMRRoleByID(player)
+            entries.append((member, GetRankRoles(player)))
 
-            # Remove all their previous mmr roles and readd the correct one
-            await RemoveRoles(interaction, member, *mmrRoles, errorMessage='Failed to remove previous rank from {0.mention}. Please try again.'.format(member))
-            await AddRoles(interaction, member, newRole.role, botSettings.registeredRole, errorMessage='Failed to add current rank to {0.mention}. Please try again.'.format(member))
+        result = await ReconcileRoles(entries, mmrRoles, reason='User {0.user} is recalling match #{1}'.format(interaction, match._matchUniqueID))
+
+        if (len(result.failed) > 0):
+            await SendChannelMessage(interaction.channel, description='Failed to update the rank of {}. Please try again.'.format(', '.join(member.mention for member in result.failed)), color=discord.Color.red())
 
         await SendChannelMessage(botSettings.adminChannel, description='The ranks of all players in match #{} have been updated.'.format(match._matchUniqueID), color=discord.Color.blue())
 
     @GuildCommand(name='forcemap')
     @IsValidChannel(ChannelType.LOBBY)
     @IsAdmin()
-    @app_commands.describe(map='The map you want to force as the next map (or current map if the match has already started).')
-    @app_commands.autocomplete(map=MapNameAutoComplete)
-    async def OnForceMap(self, interaction:discord.Interaction, map:str):
+    @app_commands.describe(map='The map you want to force as the next map (or current map if the match has already started).', match_id='The match to change. Only needed if there is more than one match running.', lobby='Forces the next map of this lobby instead of a running match.')
+    @app_commands.autocomplete(map=MapNameAutoComplete, lobby=LobbyNameAutoComplete)
+    async def OnForceMap(self, interaction:discord.Interaction, map:str, match_id:int = None, lobby:str = None):
         """Forces the next/current map
            If there is nobody in queue and there is no match currently being played, this command is ignored. Priority is given to changing the current map if possible and changing the next map second if not.
 
            **string:** <map>
            The map you want to force as the next map (or current map if the match has already started). This is not case sensitive. No quotes needed.
+
+           **int:** <match_id> (Optional)
+           The match to change. Only needed if there is more than one match running.
+
+           **string:** <lobby> (Optional)
+           Forces the next map of this lobby instead of a running match.
         """
         print('Forcing map to {}'.format(map))
 
         if (not botSettings.DoesMapExist(map)):
             raise InvalidMap(map)
 
-        await matchService.ForceMap(interaction, botSettings.GetMapProperName(map))
+        await matchService.ForceMap(interaction, botSettings.GetMapProperName(map), match_id, lobby)
 
     @GuildCommand(name='setpool')
     @IsValidChannel(ChannelType.LOBBY)
@@ -1105,14 +1228,17 @@ class AdminCommands(commands.Cog):
     @GuildCommand(name='forcepool')
     @IsValidChannel(ChannelType.LOBBY)
     @IsAdmin()
-    @app_commands.describe(pool_name='The map pool you want to force for the matchmaking.')
+    @app_commands.describe(pool_name='The map pool you want to force for the matchmaking.', match_id='The match to change. Only needed if there is more than one match running.')
     @app_commands.autocomplete(pool_name=PoolNameAutoComplete)
-    async def OnForceMapPool(self, interaction:discord.Interaction, pool_name:str):
+    async def OnForceMapPool(self, interaction:discord.Interaction, pool_name:str, match_id:int = None):
         """Forces the current Map Pool
            Sets the map pool to use for matchmaking. This will also override the existing map pool if a match has already started, including rerolling the map if the map is not in the new map pool.
 
            **string:** <pool_name>
            The map pool you want to force for the matchmaking. This is not case sensitive. No quotes needed.
+
+           **int:** <match_id> (Optional)
+           The match to change. Only needed if there is more than one match running.
         """
         print('Setting map pool to {}'.format(pool_name))
 
@@ -1125,21 +1251,29 @@ class AdminCommands(commands.Cog):
         if (not matchService.IsMatchInProgress()):
             raise CantForceMapPool()
 
+        if (match_id is not None and not matchService.IsMatchInProgress(match_id)):
+            raise InvalidMatchID(match_id)
+
         botSettings.SetCurrentMapPool(pool_name)
         await SendChannelMessage(interaction.channel, description='`{}` has been set as the current map pool.'.format(pool_name), color=discord.Color.blue())
-        await matchService.ForceMapPool(interaction, botSettings.GetMapPoolProperName(pool_name))
+        await matchService.ForceMapPool(interaction, botSettings.GetMapPoolProperName(pool_name), id=match_id)
 
     @GuildCommand(name='rerollmap')
     @IsValidChannel(ChannelType.LOBBY)
     @IsAdmin()
-    async def OnRerollMap(self, interaction:discord.Interaction):
-        """Rerolls the current map for the match"""
+    @app_commands.describe(match_id='The match to reroll. Only needed if there is more than one match running.')
+    async def OnRerollMap(self, interaction:discord.Interaction, match_id:int = None):
+        """Rerolls the current map for the match
+
+           **int:** <match_id> (Optional)
+           The match to reroll. Only needed if there is more than one match running.
+        """
         print('Rerolling the map')
 
         if (not matchService.IsMatchInProgress()):
             raise CantRerollMap()
 
-        await matchService.RerollMap(interaction, useInteraction=True)
+        await matchService.RerollMap(interaction, useInteraction=True, id=match_id)
 
     @GuildCommand(name='swap')
     @IsValidChannel(ChannelType.LOBBY)
@@ -1171,10 +1305,10 @@ class AdminCommands(commands.Cog):
             raise PlayersNotSwapable(player1, player2)
 
         # Now try to swap
-        await matchService.SwapPlayers(interaction, player1, player2)
+        matchID = await matchService.SwapPlayers(interaction, player1, player2)
 
         if (stratRouletteService.IsMatchInProgress()):
-            await stratRouletteService.UpdateTeams(matchService.GetTeam1Players(), matchService.GetTeam2Players())
+            await stratRouletteService.UpdateTeams(matchService.GetTeam1Players(matchID), matchService.GetTeam2Players(matchID))
  
     @GuildCommand(name='removestrat')
     @IsValidChannel(ChannelType.ADMIN)
@@ -1205,13 +1339,16 @@ class AdminCommands(commands.Cog):
     @GuildCommand(name='startroulette')
     @IsValidChannel(ChannelType.LOBBY)
     @IsAdmin()
-    @app_commands.describe(force_pool='Forces the match to use the specified map pool.')
+    @app_commands.describe(force_pool='Forces the match to use the specified map pool.', match_id='The match to play Strat Roulette in. Only needed if there is more than one match running.')
     @app_commands.autocomplete(force_pool=PoolNameAutoComplete)
-    async def OnStartStratRouletteMatch(self, interaction:discord.Interaction, force_pool:str = ""):
+    async def OnStartStratRouletteMatch(self, interaction:discord.Interaction, force_pool:str = "", match_id:int = None):
         """Starts the Strat Roulette Match
         
            **str:** <force_pool> (Optional)
            Forces the match to use the specified map pool.
+
+           **int:** <match_id> (Optional)
+           The match to play Strat Roulette in. Only needed if there is more than one match running.
         """
         print('Starting Strat Roulette! Force Pool: {}'.format('None' if force_pool == '' else force_pool))
 
@@ -1230,13 +1367,16 @@ class AdminCommands(commands.Cog):
             else:
                 raise CantStartStratRoulette()
 
-        await stratRouletteService.StartMatch(matchService.GetTeam1Players(), matchService.GetTeam2Players())
+        if (match_id is not None and not matchService.IsMatchInProgress(match_id)):
+            raise InvalidMatchID(match_id)
+
+        await stratRouletteService.StartMatch(matchService.GetTeam1Players(match_id), matchService.GetTeam2Players(match_id))
 
         await SendMessage(interaction, description='_loads revolver_ Let the fun begin!', color=discord.Color.blue())
 
         # Change the map pool second so we don't accidently invalidate the interaction
         if (force_pool != ''):
-            await matchService.ForceMapPool(interaction, botSettings.GetMapPoolProperName(force_pool), useInteraction=False)
+            await matchService.ForceMapPool(interaction, botSettings.GetMapPoolProperName(force_pool), useInteraction=False, id=match_id)
 
     @OnStartStratRouletteMatch.error
     @OnRecallMatch.error
@@ -1246,6 +1386,7 @@ class AdminCommands(commands.Cog):
     @OnSetMapPoolType.error
     @OnRemoveMapPool.error
     @OnAddMapPool.error
+    @OnSetMapWeighting.error
     @OnSetMapThumbnail.error
     @OnRemoveMap.error
     @OnAddMap.error
@@ -1263,6 +1404,9 @@ class AdminCommands(commands.Cog):
     @OnForceRegisterPlayer.error
     @OnQuit.error
     @OnClearQueue.error
+    @OnAddLobby.error
+    @OnSetMatchmaking.error
+    @OnRemoveLobby.error
     @OnForceStartMatch.error
     @OnKickPlayerFromQueue.error
     @OnSetMMR.error
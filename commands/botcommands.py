@@ -1,7 +1,6 @@
-from __future__ import barry_as_FLUFL
 from data.botsettings import ChannelType, RegisteredRoleUnitialized, InvalidGuild
 from data.playerdata import UserNotRegistered, UserAlreadyRegistered
-from data.matchhistorydata import MatchHistoryData, MatchResult
+from data.playerstatsdata import PlayerStatsData
 from data.quipdata import QuipType
 from data.mappool import MapPoolType
 from data.stratroulettedata import StratRouletteMatchData, StratRouletteTeamType, NoStratRouletteStrats, InvalidStratRouletteTeamType
@@ -21,11 +20,38 @@ import asyncio
 class BotCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Matches started by the matchmaking loop, held so they don't get garbage collected while running
+        self.matchTasks = set()
+
+    async def LobbyNameAutoComplete(self, interaction:discord.Interaction, current:str):
+        lobbies = matchService.GetSortedLobbies()
+
+        # populates an array of Choices for all the lobbies that contain the same string as the user's input
+        return [ app_commands.Choice(name=lobby.name, value=lobby.name) for lobby in lobbies if current.lower() in lobby.name.lower() ]
 
     def cog_unload(self):
         self.OnUpdateStatus.cancel()
+        self.OnMatchmakingTick.cancel()
         return super().cog_unload()
 
+    @tasks.loop(seconds=15)
+    async def OnMatchmakingTick(self):
+        # The MMR window of waiting players widens over time, so a matchmaking lobby can become ready without anyone joining
+        try:
+            for lobby in matchService.GetReadyLobbies():
+                id = await matchService.PrepareMatch(False, stratRouletteService.forcedPool, lobby.name)
+
+                task = asyncio.create_task(matchService.RunMatch(id))
+                self.matchTasks.add(task)
+                task.add_done_callback(self.matchTasks.discard)
+        except Exception as error:
+            # An exception escaping the loop would stop matchmaking for good, log it and try again next tick
+            await self.OnMatchmakingTickError(error)
+
+    @OnMatchmakingTick.error
+    async def OnMatchmakingTickError(self, error):
+        print('Error: Matchmaking tick failed: {}'.format(error))
+
     @tasks.loop(minutes=30)
     async def OnUpdateStatus(self):
         print('Changing status!')
@@ -90,7 +116,9 @@ class BotCommands(commands.Cog):
     async def on_ready(self):
         print('We have logged in as {0.user}'.format(self.bot))
         await botSettings.InitSettings(self.bot)
+        await matchService.RestoreState()
         self.OnUpdateStatus.start()
+        self.OnMatchmakingTick.start()
 
     @GuildCommand(name='jpp')
     async def OnJPP(self, interaction:discord.Interaction):
@@ -149,15 +177,22 @@ class BotCommands(commands.Cog):
         if (not botSettings.IsUserRegistered(interaction.user)):
             raise UserNotRegistered(interaction.user)
 
+        await botSettings.LoadPlayers([interaction.user.id])
         botSettings.ChangeName(interaction.user, name)
 
         await SendMessage(interaction, description='Your name has been changed to `{}`'.format(name), color=discord.Color.blue())
 
     @GuildCommand(name='join')
     @IsValidChannel(ChannelType.LOBBY)
-    async def OnJoinQueue(self, interaction:discord.Interaction):
-        """Join the matchmaking queue"""
-        print('User {0.user} is joining queue.'.format(interaction))
+    @app_commands.describe(lobby='The lobby you want to queue in. Uses the default lobby if not given.')
+    @app_commands.autocomplete(lobby=LobbyNameAutoComplete)
+    async def OnJoinQueue(self, interaction:discord.Interaction, lobby:str = None):
+        """Join the matchmaking queue
+
+           **string:** <lobby> (Optional)
+           The lobby you want to queue in. Uses the default lobby if not given.
+        """
+        print('User {0.user} is joining queue {1}.'.format(interaction, lobby))
 
         if (not botSettings.IsUserRegistered(interaction.user)):
             raise UserNotRegistered(interaction.user)
@@ -165,41 +200,14 @@ class BotCommands(commands.Cog):
         if (matchService.IsPlayerQueued(interaction.user)):
             raise PlayerAlreadyQueued(interaction.user)
 
-        await matchService.JoinQueue(interaction, interaction.user)
+        await matchService.JoinQueue(interaction, interaction.user, lobby)
 
         # Early exit if we don't need to start a match
-        if (not matchService.IsQueueFull()):
-            return
-
-        id = matchService.PrepareMatch(False, stratRouletteService.forcedPool)
-
-        # Early out for the simple case where we only have to start a match
-        if (not stratRouletteService.IsMatchQueued()):
-            result = await matchService.StartMatch(id)
-
-            # If a strat roulette match was started afterwards, we should make sure to stop it
-            if (stratRouletteService.IsMatchInProgress()):
-                await stratRouletteService.StopMatch(id, result)
+        if (not matchService.IsQueueFull(lobby)):
             return
 
-        # If we need to start a match and a strat roulette match, do some task scheduling
-        matchServiceTask = asyncio.create_task(
-            matchService.StartMatch(id)
-        )
-
-        stratRouletteServiceTask = asyncio.create_task(
-            stratRouletteService.TryStartQueuedMatch(matchService.GetTeam1Players(id), matchService.GetTeam2Players(id))
-        )
-
-        await matchServiceTask
-        lastMatchResult = matchService.GetLastMatchResult()
-        matchResult = MatchResult.INVALID
-
-        if (lastMatchResult is not None and lastMatchResult[0] == id):
-            matchResult = lastMatchResult[1]
-
-        await stratRouletteService.StopMatch(id, matchResult)
-        await stratRouletteServiceTask 
+        id = await matchService.PrepareMatch(False, stratRouletteService.forcedPool, lobby)
+        await matchService.RunMatch(id)
 
     @GuildCommand(name='leave')
     @IsValidChannel(ChannelType.LOBBY)
@@ -217,18 +225,36 @@ class BotCommands(commands.Cog):
         if (stratRouletteService.IsMatchQueued() and not stratRouletteService.IsMatchInProgress()):
             extraClearMessage = '\nStrat Roulette Match Cancelled.'
 
+        lobby = matchService.GetPlayerLobby(interaction.user)
+
         await matchService.LeaveQueue(interaction, interaction.user, extraClearMessage)
 
-        if (matchService.IsQueueEmpty() and extraClearMessage != ''):
+        if (lobby.IsEmpty() and extraClearMessage != ''):
             stratRouletteService.ClearQueuedMatch()
 
     @GuildCommand(name='queue')
     @IsValidChannel(ChannelType.LOBBY)
-    async def OnShowQueue(self, interaction:discord.Interaction):
-        """Show the matchmaking queue"""
-        print('Showing queue')
+    @app_commands.describe(lobby='The lobby you want to see. Uses the default lobby if not given.')
+    @app_commands.autocomplete(lobby=LobbyNameAutoComplete)
+    async def OnShowQueue(self, interaction:discord.Interaction, lobby:str = None):
+        """Show the matchmaking queue
+
+           **string:** <lobby> (Optional)
+           The lobby you want to see. Uses the default lobby if not given.
+        """
+        print('Showing queue {}'.format(lobby))
+
+        await matchService.ShowQueue(interaction, lobby)
+
+    @GuildCommand(name='lobbies')
+    @IsValidChannel(ChannelType.LOBBY)
+    async def OnShowLobbies(self, interaction:discord.Interaction):
+        """Shows every lobby and how full it is"""
+        print('Showing lobbies')
+
+        description = '\n'.join(matchService.GetLobbyTitle(lobby) for lobby in matchService.GetSortedLobbies())
 
-        await matchService.ShowQueue(interaction)
+        await SendMessage(interaction, title='Lobbies', description=description, color=discord.Color.blue())
 
     @GuildCommand(name='missing')
     @IsValidChannel(ChannelType.LOBBY)
@@ -480,81 +506,23 @@ class BotCommands(commands.Cog):
         if (not botSettings.IsUserRegistered(interaction.user)):
             raise UserNotRegistered(interaction.user)
 
+        await botSettings.LoadPlayers([interaction.user.id])
         player = botSettings.GetRegisteredPlayerByID(interaction.user.id)
         prevRole, currentRole = botSettings.GetMMRRole(interaction.user)
 
-        class DummyObject(object) : pass
+        # Read on a worker thread so a slow query doesn't hold up everyone else. Stats are written as soon as a match is
+        # called, so at worst they're a moment behind a match that was called right before this
+        query = PlayerStatsData.objects(_user=interaction.user.id)
+        stats = await asyncio.get_running_loop().run_in_executor(None, query.first)
 
-        results = {}
+        # Type: Array<MapStats>
+        results = [] if stats is None else stats.GetMapStats()
+        # Type: Dictionary<key=int, value=TeammateStats>
         players = {}
 
-        def AddMapWin(map:str):
-            if (map not in results):
-                dummy = DummyObject()
-                dummy.wins = 1
-                dummy.loses = 0
-                dummy.name = map
-                results[map] = dummy
-            else:
-                results[map].wins += 1
-
-        def AddMapLoss(map:str):
-            if (map not in results):
-                dummy = DummyObject()
-                dummy.wins = 0
-                dummy.loses = 1
-                dummy.name = map
-                results[map] = dummy
-            else:
-                results[map].loses += 1
-
-        def RegisterPlayer(player:int):
-            if (player not in players):
-                dummy = DummyObject()
-                dummy.winsWith = 0
-                dummy.lossesWith = 0
-                dummy.winsAgainst = 0
-                dummy.lossesAgainst = 0
-                dummy.id = player
-                players[player] = dummy
-
-        def AddPlayerStats(myTeam, enemyTeam, isWin):
-            for player in myTeam:
-                RegisterPlayer(player._id)
-
-                if isWin:
-                    players[player._id].winsWith += 1
-                else:
-                    players[player._id].lossesWith += 1
-
-            for player in enemyTeam:
-                RegisterPlayer(player._id)
-
-                if isWin:
-                    players[player._id].winsAgainst += 1
-                else:
-                    players[player._id].lossesAgainst += 1
-
-        team1Matches = MatchHistoryData.objects(_team1__match={'_id':interaction.user.id}) 
-        team2Matches = MatchHistoryData.objects(_team2__match={'_id':interaction.user.id})
-
-        def CheckResults(matches, winResult, loseResult):
-            for data in matches:
-                if (data._result == MatchResult.CANCELLED.value):
-                    continue
-
-                if (winResult == MatchResult.TEAM1VICTORY.value):
-                    AddPlayerStats(data._team1, data._team2, (data._result == winResult))
-                elif (winResult == MatchResult.TEAM2VICTORY.value):
-                    AddPlayerStats(data._team2, data._team1, (data._result == winResult))
-
-                if (data._result == winResult):
-                    AddMapWin(data._map)
-                elif (data._result == loseResult):
-                    AddMapLoss(data._map)
-
-        CheckResults(team1Matches, MatchResult.TEAM1VICTORY.value, MatchResult.TEAM2VICTORY.value)
-        CheckResults(team2Matches, MatchResult.TEAM2VICTORY.value, MatchResult.TEAM1VICTORY.value)	
+        if (stats is not None):
+            for teammate in stats.GetTeammateStats():
+                players[teammate.id] = teammate
 
         title = 'Stats for {}'.format(player.name)
 
@@ -564,6 +532,7 @@ class BotCommands(commands.Cog):
 
         mmrField['value'] = '**Rank:** {0.mention}\n'.format(currentRole.role)
         mmrField['value'] += '**MMR:** {}\n'.format(player.mmr)
+        mmrField['value'] += '**Leaderboard:** {}\n'.format(botSettings.GetLeaderboardDescription(interaction.user))
         mmrField['value'] += '**Highest MMR:** {}\n'.format(player.highestMMR)
         mmrField['value'] += '**Lowest MMR:** {}\n'.format(player.lowestMMR)
 
@@ -584,9 +553,9 @@ class BotCommands(commands.Cog):
         matchField['value'] += '**Best Win Streak:** {}\n'.format(player.highestWinStreak)
         matchField['value'] += '**Worst Lose Streak:** {}\n'.format(player.highestLoseStreak)
 
-        bestMaps = sorted(results.values(), key=lambda map : map.wins, reverse=True)
-        worstMaps = sorted(results.values(), key=lambda map : map.loses, reverse=True)
-        mostPlayedMaps = sorted(results.values(), key=lambda map : map.wins + map.loses, reverse=True)
+        bestMaps = sorted(results, key=lambda map : map.wins, reverse=True)
+        worstMaps = sorted(results, key=lambda map : map.loses, reverse=True)
+        mostPlayedMaps = sorted(results, key=lambda map : map.wins + map.loses, reverse=True)
 
         bestMap = bestMaps[0] if len(bestMaps) > 0 else None
         worstMap = worstMaps[0] if len(worstMaps) > 0 else None
@@ -635,6 +604,9 @@ class BotCommands(commands.Cog):
         worstPlayer = worstPlayers[0] if len(worstPlayers) > 0 else None
         rivalPlayer = rivalPlayers[0] if len(rivalPlayers) > 0 else None
 
+        # Their names come from their player data
+        await botSettings.LoadPlayers([player.id for player in [mostPlayedPlayer, leastPlayedPlayer, bestPlayer, worstPlayer, rivalPlayer] if player is not None])
+
         playerField = {}
         playerField['name'] = 'Player History'
         playerField['value'] = ''
@@ -727,6 +699,7 @@ class BotCommands(commands.Cog):
     @OnJoinQueue.error
     @OnLeaveQueue.error
     @OnShowQueue.error
+    @OnShowLobbies.error
     @OnSetName.error
     @OnRegisterPlayer.error
     @OnJPP.error
@@ -1,4 +1,5 @@
 from mongoengine import Document, IntField, StringField
+from services.persistenceservice import persistenceService
 from enum import Enum
 from discord.ext import commands
 
@@ -72,19 +73,19 @@ class ActivityData(Document):
         self._name = name
         self._type = type
         self._useCount = 0
-        self.save()
+        persistenceService.Save(self)
 
     def SetName(self, name:str):
         self.name  = name
         self._name = name
-        self.save()
+        persistenceService.Save(self)
 
     def SetType(self, type:int):
         self.type = type
         self._type = type
-        self.save()
+        persistenceService.Save(self)
 
     def IncrementUse(self):
         self.useCount += 1
         self._useCount += 1
-        self.save()
+        persistenceService.IncrementCounter(self, '_useCount')
@@ -1,19 +1,32 @@
-from data.matchhistorydata import MatchResult
-from data.playerdata import PlayerData
+from data.matchhistorydata import MatchResult, MatchHistoryData
+from data.playerdata import PlayerData, Player
+from data.playerstatsdata import PlayerStatsData
+from data.counterdata import CounterData
 from data.mmrrole import MMRRole 
-from data.mappool import MapPool, MapPoolType
+from data.mappool import MapPool
 from services.matchservice import TeamResult, FakeUser
+from services.persistenceservice import persistenceService
 from data.siegemap import SiegeMap
 from data.activitydata import ActivityData
 from data.quipdata import QuipData, QuipType
 from data.stratroulettedata import StratRouletteData, StratRouletteGlobalMatchData, StratRouletteTeamType
+from utils.leaderboardutils import Leaderboard
+from utils.mapselectionutils import MapSelector, MapWeighting
+from utils.cacheutils import LRUCache
 from enum import Enum
 from discord.ext import commands
-from mongoengine import Document, IntField, StringField
+from mongoengine import Document, IntField, StringField, BooleanField, FloatField
 from discord import app_commands
 import discord
 import random
 import math
+import time
+import asyncio
+from bisect import bisect_right
+from collections import deque
+
+# Name of the counter match ids are handed out from
+matchIDCounter = 'matchID'
 
 class ChannelTypeInvalid(commands.BadArgument):
     def __init__(self, argument):
@@ -147,8 +160,16 @@ class BotSettings(Document):
     _orangeTeamChannel = IntField(default=-1)
     _registeredRole = IntField(default=-1)
     _adminRole = IntField(default=-1)
+    # Only used to seed the match id counter for databases from before match ids had a counter of their own
     _nextUniqueMatchID = IntField(default=0)
     _currentPool = StringField(default='')
+    _playerStatsBuilt = BooleanField(default=False)
+    _creationTimesMigrated = BooleanField(default=False)
+    _mapPlayCountExponent = FloatField(default=1.0)
+    _mapRecencyDecay = FloatField(default=0.0)
+    _mapCooldown = IntField(default=0)
+    # Hash of the app commands last synced to discord
+    _commandTreeHash = StringField(default='')
 
     # Settings
     guild = None # discord.Guild
@@ -162,15 +183,29 @@ class BotSettings(Document):
     registeredRole = None # discord.Role
     adminRole = None # discord.Role
 
-    registeredPlayers = {}
+    playerCacheSize = 500
+    playerCache = None # LRUCache
+    isPlayerPinned = None # Function taking a user id, returns True if the player has to stay cached
+    bot = None # commands.Bot
+    leaderboard = Leaderboard()
     mmrRoles = {}
+    mmrRoleIndex = []
+    mmrRoleStarts = []
+    mmrRoleReach = []
     maps = {}
     pools = {}
+    mapSelector = None
     currentPool = None
     activities = []
     quips = []
     strats = []
     globalStratData = None
+    readyEvent = None # asyncio.Event
+    # Match ids are reserved from the counter a few at a time so starting a match never waits on the database.
+    # Whatever is left of the block when the bot stops is skipped
+    matchIDBlockSize = 5
+    reservedMatchIDs = deque()
+    matchIDRefill = None # asyncio.Future
 
     def _GetGuild(self, id, bot):
         if (len(bot.guilds) == 0):
@@ -192,7 +227,80 @@ class BotSettings(Document):
 
         return self.guild.get_role(id)
 
+    def _LoadPlayerDocuments(self, ids):
+        return list(PlayerData.LoadMany(ids))
+
+    async def LoadPlayers(self, ids):
+        """Loads any of the registered players that aren't cached yet, without blocking the event loop.
+           Call this before anything that needs their full player data, players are never read from the database on demand.
+           Returns Dictionary<key=int id, value=Player> for every registered player in ids.
+        """
+        players = {id : self.playerCache.Get(id) for id in ids if id in self.playerCache}
+        missing = [id for id in ids if id in self.leaderboard and id not in players]
+
+        if (len(missing) == 0):
+            return players
+
+        # One query for everyone, run on the write worker so it sees every write queued for them
+        for data in await persistenceService.Read(self._LoadPlayerDocuments, missing):
+            id = data['_user']
+
+            # Someone else may have loaded them while we waited, keep that copy since it could already be newer
+            if (id not in self.playerCache):
+                self.playerCache.Put(id, Player(data, self.bot.get_user(id)))
+
+            players[id] = self.playerCache.Get(id)
+
+        return players
+
+    def _IsPlayerPinned(self, id:int):
+        return self.isPlayerPinned is not None and self.isPlayerPinned(id)
+
+    def SetPlayerPinnedCheck(self, isPlayerPinned):
+        """isPlayerPinned(id) should return True for players that are queued or in a match, they are never dropped from the cache"""
+        self.isPlayerPinned = isPlayerPinned
+
+    def _LoadCollection(self, name:str, query):
+        # Runs on a worker thread so the event loop keeps serving while we wait on the database
+        start = time.perf_counter()
+        documents = list(query)
+        print('Loaded {} {} in {:.0f}ms'.format(len(documents), name, (time.perf_counter() - start) * 1000))
+        return documents
+
+    def _PrepareDatabase(self):
+        # Match creation times used to be stored as strings, convert them before anything reads them
+        if (not self._creationTimesMigrated):
+            print('Converted the creation time of {} matches'.format(MatchHistoryData.MigrateCreationTimes()))
+            self._creationTimesMigrated = True
+            persistenceService.Save(self)
+
+        persistenceService.EnsureIndexes([PlayerData, PlayerStatsData, MatchHistoryData, CounterData])
+
+        CounterData.Seed(matchIDCounter, self._nextUniqueMatchID)
+        self.reservedMatchIDs = deque(self._ReserveMatchIDs())
+
+    def _GetReadyEvent(self):
+        # Created on first use so it belongs to the bot's event loop
+        if (self.readyEvent is None):
+            self.readyEvent = asyncio.Event()
+        return self.readyEvent
+
+    def IsReady(self):
+        return self.readyEvent is not None and self.readyEvent.is_set()
+
+    async def WaitUntilReady(self, timeout:float = None):
+        """Waits for InitSettings to finish. Returns False if it didn't finish within the timeout"""
+        try:
+            await asyncio.wait_for(self._GetReadyEvent().wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
     async def InitSettings(self, bot):
+        initStart = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        self.bot = bot
+
         # Channels used for various bot functionality
         # Type: discord.TextChannel
         self.guild = self._GetGuild(self._guild, bot)
@@ -203,31 +311,59 @@ class BotSettings(Document):
         self.reportChannel = self._GetChannel(self._reportChannel)
         self.blueTeamChannel = self._GetChannel(self._blueTeamChannel)
         self.orangeTeamChannel = self._GetChannel(self._orangeTeamChannel)
-
-        # Player data
-        # Type: Dictionary<key=discord.User, value=PlayerData>
-        self.registeredPlayers = {}
-        
-        for player in PlayerData.objects:
-            await player.Init(bot)
-            self.registeredPlayers[player.GetID()] = player
-
         self.registeredRole = self._GetRole(self._registeredRole)
         self.adminRole = self._GetRole(self._adminRole)
 
+        await loop.run_in_executor(None, self._PrepareDatabase)
+
+        # Picks maps for matches, weighted towards the ones that haven't been played much or recently
+        # Type: MapSelector
+        self.mapSelector = MapSelector(self._GetPoolMaps, self.GetMapWeighting())
+
+        # Every collection is independent, so load them all at once. Players and recent matches are projected down,
+        # everything else is cached as full documents because they get saved back whole
+        queries = [
+            ('players', PlayerData.objects.only('_user', '_mmr').as_pymongo()),
+            ('ranks', MMRRole.objects),
+            ('maps', SiegeMap.objects),
+            ('map pools', MapPool.objects),
+            ('activities', ActivityData.objects),
+            ('quips', QuipData.objects),
+            ('strats', StratRouletteData.objects),
+            ('strat roulette stats', StratRouletteGlobalMatchData.objects.limit(1)),
+            ('recent matches', MatchHistoryData.GetLastMatches(self.mapSelector.recentMaps.maxlen).filter(_result__ne=MatchResult.CANCELLED.value).only('_map')),
+        ]
+
+        players, roles, maps, pools, activities, quips, strats, globalStratData, recentMatches = await asyncio.gather(
+            *[loop.run_in_executor(None, self._LoadCollection, name, query) for name, query in queries]
+        )
+
+        # Player data is loaded with LoadPlayers before it's needed and the least recently used players are dropped again,
+        # so memory doesn't grow with the number of registered players
+        # Type: LRUCache<key=int user id, value=Player>
+        self.playerCache = LRUCache(self.playerCacheSize, isPinned=self._IsPlayerPinned)
+
+        # Every registered player sorted by mmr, kept up to date whenever someone's mmr changes. This is also the
+        # registry of who is registered, so those checks never have to load player data
+        # Type: Leaderboard
+        self.leaderboard = Leaderboard()
+        self.leaderboard.Rebuild((player['_user'], player.get('_mmr', 0)) for player in players)
+
         # MMR Rank definition
         # Type: Dictionary<key=discord.Role, value=MMRRole>
         self.mmrRoles = {}
 
-        for role in MMRRole.objects:
+        for role in roles:
             role.Init(self.guild)
             self.mmrRoles[role.role.id] = role 
 
+        self._RebuildMMRRoleIndex()
+
         # Maps
         # Type: Dictionary<key=string, value=SiegeMap>
         self.maps = {}
 
-        for _map in SiegeMap.objects:
+        for _map in maps:
             _map.Init()
             self.maps[_map.name.lower()] = _map
 
@@ -235,10 +371,12 @@ class BotSettings(Document):
         # Type: Dictionary<key=string, value=MapPool>
         self.pools = {}
 
-        for pool in MapPool.objects:
+        for pool in pools:
             pool.Init()
             self.pools[pool.name.lower()] = pool
 
+        self.mapSelector.SetRecentMaps(reversed([match._map for match in recentMatches]))
+
         self.currentPool = self._currentPool
         if (not self.DoesMapPoolExist(self.currentPool)):
             self.currentPool = None
@@ -247,7 +385,7 @@ class BotSettings(Document):
         # Type: Array<ActivityData>
         self.activities = []
 
-        for activity in ActivityData.objects:
+        for activity in activities:
             activity.Init()
             self.activities.append(activity)
 
@@ -255,7 +393,7 @@ class BotSettings(Document):
         # Type: Array<QuipData>
         self.quips = []
 
-        for quip in QuipData.objects:
+        for quip in quips:
             quip.Init(bot)
             self.quips.append(quip)
 
@@ -263,7 +401,7 @@ class BotSettings(Document):
         # Type: Array<StratRouletteData>
         self.strats = []
 
-        for strat in StratRouletteData.objects:
+        for strat in strats:
             strat.Init()
             self.strats.append(strat)
 
@@ -271,23 +409,31 @@ class BotSettings(Document):
 
         # Strat Roulette Global Match Data
         # Load or create one. There should only ever be one!
-        if (len(StratRouletteGlobalMatchData.objects) > 0):
-            self.globalStratData = StratRouletteGlobalMatchData.objects.first()
+        if (len(globalStratData) > 0):
+            self.globalStratData = globalStratData[0]
         else:
             self.globalStratData = StratRouletteGlobalMatchData()
 
-        print('Settings Loaded')
+        # Player stats used to be worked out from the match history on every /stats. Build them once for existing history
+        if (not self._playerStatsBuilt):
+            print('Building player stats from match history')
+            await loop.run_in_executor(None, PlayerStatsData.RebuildAll)
+            self._playerStatsBuilt = True
+            persistenceService.Save(self)
+
+        self._GetReadyEvent().set()
+        print('Settings Loaded in {:.0f}ms'.format((time.perf_counter() - initStart) * 1000))
 
     # channel: Union[None, discord.Guild]
     def SetGuild(self, guild):
         if (guild is None):
             self.guild = None
             self._guild = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(guild, discord.Guild)):
             self.guild = guild 
             self._guild = guild.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [guild] is not None or a valid Discord Guild')
 
@@ -296,11 +442,11 @@ class BotSettings(Document):
         if (channel is None):
             self.lobbyChannel = None
             self._lobbyChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.lobbyChannel = channel
             self._lobbyChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -309,11 +455,11 @@ class BotSettings(Document):
         if (channel is None):
             self.resultsChannel = None
             self._resultsChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.resultsChannel = channel
             self._resultsChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -322,11 +468,11 @@ class BotSettings(Document):
         if (channel is None):
             self.adminChannel = None
             self._adminChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.adminChannel = channel
             self._adminChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -335,11 +481,11 @@ class BotSettings(Document):
         if (channel is None):
             self.registerChannel = None
             self._registerChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.registerChannel = channel
             self._registerChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -348,11 +494,11 @@ class BotSettings(Document):
         if (channel is None):
             self.reportChannel = None
             self._reportChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.reportChannel = channel
             self._reportChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -361,11 +507,11 @@ class BotSettings(Document):
         if (channel is None):
             self.blueTeamChannel = None
             self._blueTeamChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.blueTeamChannel = channel
             self._blueTeamChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -374,11 +520,11 @@ class BotSettings(Document):
         if (channel is None):
             self.orangeTeamChannel = None
             self._orangeTeamChannel = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(channel, discord.TextChannel)):
             self.orangeTeamChannel = channel
             self._orangeTeamChannel = channel.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [channel] is not None or a valid Discord TextChannel')
 
@@ -387,11 +533,11 @@ class BotSettings(Document):
         if (role is None):
             self.registeredRole = None
             self._registeredRole = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(role, discord.Role)):
             self.registeredRole = role 
             self._registeredRole = role.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [role] is not None or a valid Discord Role')
 
@@ -400,47 +546,53 @@ class BotSettings(Document):
         if (role is None):
             self.adminRole = None
             self._adminRole = -1
-            self.save()
+            persistenceService.Save(self)
         elif (isinstance(role, discord.Role)):
             self.adminRole = role 
             self._adminRole = role.id
-            self.save()
+            persistenceService.Save(self)
         else:
             raise commands.BadArgument('Argument [role] is not None or a valid Discord Role')
 
     def RegisterUser(self, user:discord.User, name:str):
-        newPlayer = PlayerData()
-        newPlayer.SetUser(user, name)
-        self.registeredPlayers[user.id] = newPlayer
+        player = PlayerData.Create(user, name)
+        self.playerCache.Put(user.id, player)
+        self._UpdateLeaderboard(player)
 
     def ChangeName(self, user:discord.User, name:str):
-        self.registeredPlayers[user.id].SetName(name)
+        self.GetRegisteredPlayerByID(user.id).SetName(name)
 
     def AddMMRRole(self, role:discord.Role, mmrMin:int, mmrMax:int, mmrDelta:int):
         newRole = MMRRole()
         newRole.SetData(role, mmrMin, mmrMax, mmrDelta)
         self.mmrRoles[role.id] = newRole 
+        self._RebuildMMRRoleIndex()
 
     def UpdateMMRRole(self, role:discord.Role, mmrMin:int, mmrMax:int, mmrDelta:int):
         self.mmrRoles[role.id].UpdateData(mmrMin, mmrMax, mmrDelta)
+        self._RebuildMMRRoleIndex()
 
     def RemoveMMRRole(self, role:discord.Role):
-        self.mmrRoles[role.id].delete() # remove entry from database
+        persistenceService.Delete(self.mmrRoles[role.id]) # remove entry from database
         del self.mmrRoles[role.id]
+        self._RebuildMMRRoleIndex()
 
     def AddMap(self, name:str, thumbnailURL:str):
         _map = SiegeMap()
         _map.SetName(name, thumbnailURL)
         self.maps[name.lower()] = _map
+        self._InvalidateMapPools()
     
     def RemoveMap(self, name:str):
         properName = self.GetMapProperName(name)
-        self.maps[name.lower()].delete() # remove entry from database
+        persistenceService.Delete(self.maps[name.lower()]) # remove entry from database
         del self.maps[name.lower()]
 
         for pool in self.pools.values():
             pool.RemoveMap(properName)
 
+        self._InvalidateMapPools()
+
     def SetMapThumbnail(self, name:str, thumbnailURL:str):
         self.maps[name.lower()].SetThumbnail(thumbnailURL)
 
@@ -457,16 +609,49 @@ class BotSettings(Document):
         pool = MapPool()
         pool.SetData(name, type)
         self.pools[name.lower()] = pool
+        self.mapSelector.Invalidate()
 
     def RemoveMapPool(self, name:str):
-        self.pools[name.lower()].delete() # remove entry from database
+        persistenceService.Delete(self.pools[name.lower()]) # remove entry from database
         del self.pools[name.lower()]
+        self.mapSelector.Invalidate()
+
+    def SetMapPoolType(self, name:str, type:int):
+        self.pools[name.lower()].SetType(type)
+        self.mapSelector.Invalidate()
 
     def AddMapPoolMap(self, poolName:str, mapName:str):
         self.pools[poolName.lower()].AddMap(mapName)
+        self.mapSelector.Invalidate()
 
     def RemoveMapPoolMap(self, poolName:str, mapName:str):
         self.pools[poolName.lower()].RemoveMap(mapName)
+        self.mapSelector.Invalidate()
+
+    def _InvalidateMapPools(self):
+        # The set of maps changed, so every pool needs to work out its maps again
+        for pool in self.pools.values():
+            pool.InvalidateResolvedMaps()
+
+        self.mapSelector.Invalidate()
+
+    def GetMapWeighting(self):
+        return MapWeighting(self._mapPlayCountExponent, self._mapRecencyDecay, self._mapCooldown)
+
+    def IsCommandTreeSynced(self, treeHash:str):
+        return self._commandTreeHash == treeHash
+
+    def SetCommandTreeHash(self, treeHash:str):
+        self._commandTreeHash = treeHash
+        persistenceService.Save(self)
+
+    def SetMapWeighting(self, playCountExponent:float, recencyDecay:float, cooldown:int):
+        self._mapPlayCountExponent = playCountExponent
+        self._mapRecencyDecay = recencyDecay
+        self._mapCooldown = cooldown
+        persistenceService.Save(self)
+
+        self.mapSelector.SetWeighting(self.GetMapWeighting())
 
     def AddStratRouletteStrat(self, type:int, title:str, strat:str):
         newStrat = StratRouletteData()
@@ -475,36 +660,59 @@ class BotSettings(Document):
         self.strats.sort(key=lambda _strat : _strat.type)
 
     def RemoveStratRouletteStrat(self, index:int):
-        self.strats[index].delete() # remove entry from database
+        persistenceService.Delete(self.strats[index]) # remove entry from database
         self.strats.pop(index)
 
     def SetMMR(self, user:discord.User, mmr:int):
         return self.SetMMRByID(user.id, mmr)
 
     def SetMMRByID(self, id:int, mmr:int):
-        previousMMR = self.registeredPlayers[id].mmr
-        self.registeredPlayers[id].SetMMR(mmr)
+        player = self.GetRegisteredPlayerByID(id)
+        previousMMR = player.mmr
+        player.SetMMR(mmr)
+        self._UpdateLeaderboard(player)
         return previousMMR
 
     def GetMMR(self, user:discord.User):
         return self.GetMMRByID(user.id)
 
     def GetMMRByID(self, id:int):
-        return self.registeredPlayers[id].mmr
+        return self.leaderboard.GetMMR(id)
 
     def GetMMRRole(self, user:discord.User, previousMMR:int = -1):
         return self.GetMMRRoleByID(user.id, previousMMR)
 
-    def GetMMRRoleByID(self, id:int, previousMMR:int = -1):
-        mmr = self.registeredPlayers[id].mmr
-        previousRole = None
-        newRole = None
+    def _RebuildMMRRoleIndex(self):
+        # MMR roles sorted by their minimum so we can bisect for the role an mmr falls in
+        # Type: Array<MMRRole>
+        self.mmrRoleIndex = sorted(self.mmrRoles.values(), key=lambda role : role.mmrMin)
+        # Type: Array<int>
+        self.mmrRoleStarts = [role.mmrMin for role in self.mmrRoleIndex]
+        # The highest mmrMax of every role up to and including this one. Lets lookups stop as soon as nothing earlier can reach the mmr
+        # Type: Array<int>
+        self.mmrRoleReach = []
+
+        reach = None
+        for role in self.mmrRoleIndex:
+            reach = role.mmrMax if reach is None else max(reach, role.mmrMax)
+            self.mmrRoleReach.append(reach)
+
+    def _FindMMRRoles(self, mmrMin:int, mmrMax:int):
+        # Yields every role whose range overlaps [mmrMin, mmrMax], starting with the highest
+        # Ranges shouldn't overlap, so in practice this only ever looks at one role
+        index = bisect_right(self.mmrRoleStarts, mmrMax) - 1
+
+        while (index >= 0 and self.mmrRoleReach[index] >= mmrMin):
+            if (self.mmrRoleIndex[index].mmrMax >= mmrMin):
+                yield self.mmrRoleIndex[index]
+            index -= 1
+
+    def GetMMRRoleByMMR(self, mmr:int):
+        return next(self._FindMMRRoles(mmr, mmr), None)
 
-        for role in self.mmrRoles.values():
-            if (role.mmrMin <= mmr <= role.mmrMax):
-                newRole = role
-            if (role.mmrMin <= previousMMR <= role.mmrMax):
-                previousRole = role
+    def GetMMRRoleByID(self, id:int, previousMMR:int = -1):
+        previousRole = self.GetMMRRoleByMMR(previousMMR)
+        newRole = self.GetMMRRoleByMMR(self.GetMMRByID(id))
 
         return previousRole, newRole
 
@@ -514,18 +722,52 @@ class BotSettings(Document):
             roles.append(role.role)
         return roles
 
-    def IsMMRRoleRangeValid(self, mmrMin, mmrMax):
-        for role in self.mmrRoles.values():
-            if ((role.mmrMin <= mmrMin <= role.mmrMax) or (role.mmrMin <= mmrMax <= role.mmrMax)):
+    def IsMMRRoleRangeValid(self, mmrMin, mmrMax, ignoreRole:discord.Role = None):
+        # ignoreRole lets a role being updated overlap its own current range
+        for role in self._FindMMRRoles(mmrMin, mmrMax):
+            if (ignoreRole is None or role.role is None or role.role.id != ignoreRole.id):
                 return False
 
         return True
 
-    def GetSortedRegisteredPlayers(self):
-        return sorted(self.registeredPlayers.values(), key=lambda player : player.mmr, reverse=True)
+    def _UpdateLeaderboard(self, player:Player):
+        self.leaderboard.Update(player.id, player.mmr)
+
+    async def GetSortedRegisteredPlayers(self, start:int = 0, count:int = None):
+        if (count is None):
+            count = len(self.leaderboard) - start
+
+        ids = self.leaderboard.GetPage(start, count)
+        players = await self.LoadPlayers(ids)
+
+        return [players[id] for id in ids]
+
+    def GetLeaderboardRankByID(self, id:int):
+        # 1 is the highest mmr
+        return self.leaderboard.GetIndex(id) + 1
+
+    def GetLeaderboardPercentileByID(self, id:int):
+        # How far up the leaderboard the player is as a "top x%", rounded up so the top player is never top 0%
+        return max(1, math.ceil(self.GetLeaderboardRankByID(id) * 100 / len(self.leaderboard)))
+
+    # Union[discord.User, FakeUser] user
+    def GetLeaderboardDescription(self, user):
+        if (isinstance(user, FakeUser) or user.id not in self.leaderboard):
+            return 'Unranked'
+
+        return '#{:,} of {:,} (top {}%)'.format(self.GetLeaderboardRankByID(user.id), len(self.leaderboard), self.GetLeaderboardPercentileByID(user.id))
 
     def GetRegisteredPlayerByID(self, id:int):
-        return self.registeredPlayers[id]
+        if (id not in self.leaderboard):
+            raise KeyError(id)
+
+        player = self.playerCache.Get(id)
+
+        # Reading them here would block the event loop, whoever needs them has to await LoadPlayers first
+        if (player is None):
+            raise RuntimeError('Player {} was used without being loaded'.format(id))
+
+        return player
 
     def GetTestPlayers(self, num:int):
         testPlayers = []
@@ -562,13 +804,13 @@ class BotSettings(Document):
         if (id < 0):
             return self.GetUserName(FakeUser(id))
 
-        return self.registeredPlayers[id].name
+        return self.GetRegisteredPlayerByID(id).name
 
     def IsUserRegistered(self, user:discord.User):
         return self.IsUserRegisteredByID(user.id)
 
     def IsUserRegisteredByID(self, id:int):
-        return id in self.registeredPlayers
+        return id in self.leaderboard
 
     def IsUserAdmin(self, user:discord.User):
         if (isinstance(user, discord.Member)):
@@ -589,7 +831,7 @@ class BotSettings(Document):
         return name.lower() in self.pools
     
     def DoesMapPoolMapExist(self, poolName:str, mapName:str):
-        return mapName in self.pools[poolName.lower()].maps
+        return self.pools[poolName.lower()].HasMap(mapName)
 
     def IsValidMapPoolMap(self, poolName:str, mapName:str):
         return self.pools[poolName.lower()].IsValidMap(mapName)
@@ -612,65 +854,73 @@ class BotSettings(Document):
 
         return returnType 
 
-    def GetNextUniqueMatchID(self):
-        id = self._nextUniqueMatchID
-        self._nextUniqueMatchID += 1
-        self.save()
-        return id
+    def _ReserveMatchIDs(self):
+        # A single $inc on the counter instead of saving all of the settings, and it can't hand out the same id twice
+        start = CounterData.Reserve(matchIDCounter, self.matchIDBlockSize)
+        return range(start, start + self.matchIDBlockSize)
 
-    def GetRandomMap(self, selectedPool, enablePMCCOverride = False):
-        # sort by times played. Less played maps towards the beginning and more played maps towards the end
-        sortedMaps = sorted(self.maps.values(), key=lambda _map : _map.timesPlayed)
+    def _AddReservedMatchIDs(self, ids):
+        # Blocks can come back out of order if one had to be fetched while a refill was still running
+        self.reservedMatchIDs = deque(sorted(list(self.reservedMatchIDs) + list(ids)))
 
-        # Remove all maps that aren't in the pool
-        if (selectedPool is not None and self.DoesMapPoolExist(selectedPool)):
-            pool = self.pools[selectedPool.lower()]
+    def _OnMatchIDRefillDone(self, future):
+        self.matchIDRefill = None
 
-            # Do nothing, we want all maps
-            if (pool.type == MapPoolType.ALL.value):
-                pass
-            else:
-                tempMaps = []
-                for _map in sortedMaps:
-                    if (pool.IsValidMap(_map.name)):
-                        tempMaps.append(_map)
-                sortedMaps = tempMaps
+        if (future.exception() is not None):
+            print('Error: Failed to reserve match ids: {}'.format(future.exception()))
+            return
 
-        # random amongst the least played maps (numMaps / 2)
-        numMapsToKeep = int(math.ceil(len(sortedMaps) / 2))
+        self._AddReservedMatchIDs(future.result())
 
-        leastPlayedMaps = sortedMaps[:numMapsToKeep]
+    def _RefillMatchIDs(self):
+        if (self.matchIDRefill is not None):
+            return
 
-        if ('villa' in self.maps and enablePMCCOverride):
-            if (self.maps['villa'] not in leastPlayedMaps):
-                leastPlayedMaps.append(self.maps['villa'])
+        self.matchIDRefill = asyncio.ensure_future(persistenceService.Read(self._ReserveMatchIDs))
+        self.matchIDRefill.add_done_callback(self._OnMatchIDRefillDone)
 
-        if (len(leastPlayedMaps) == 0):
-            return None
+    async def GetNextUniqueMatchID(self):
+        while (len(self.reservedMatchIDs) == 0):
+            # Only happens if matches start faster than a refill can come back, wait on it rather than blocking the loop
+            self._RefillMatchIDs()
+            await asyncio.shield(self.matchIDRefill)
 
-        return random.choice(leastPlayedMaps)
+        id = self.reservedMatchIDs.popleft()
 
-    def IsPoolEmpty(self, selectedPool):
-        if (selectedPool is not None and self.DoesMapPoolExist(selectedPool)):
-            pool = self.pools[selectedPool.lower()]
+        # Top up in the background well before we run out
+        if (len(self.reservedMatchIDs) <= self.matchIDBlockSize // 2):
+            self._RefillMatchIDs()
 
-            maps = []
+        return id
 
-            # Do nothing, we want all maps
-            if (pool.type == MapPoolType.ALL.value):
-                maps = self.maps.values()
-            else:
-                for _map in self.maps.values():
-                    if (pool.IsValidMap(_map.name)):
-                        maps.append(_map)
+    def _GetPoolMaps(self, selectedPool):
+        # Every map the pool allows, or all maps if there isn't a valid pool
+        if (selectedPool is None or not self.DoesMapPoolExist(selectedPool)):
+            return list(self.maps.values())
 
-            return len(maps) == 0
+        resolvedMaps = self.pools[selectedPool.lower()].GetResolvedMaps(self.maps.keys())
+        return [_map for name, _map in self.maps.items() if name in resolvedMaps]
+
+    def GetRandomMap(self, selectedPool, enablePMCCOverride = False):
+        extraMap = None
+
+        if ('villa' in self.maps and enablePMCCOverride):
+            extraMap = self.maps['villa']
+
+        return self.mapSelector.Select(selectedPool, extraMap)
+
+    def IsPoolEmpty(self, selectedPool):
+        if (selectedPool is not None and self.DoesMapPoolExist(selectedPool)):
+            return len(self.pools[selectedPool.lower()].GetResolvedMaps(self.maps.keys())) == 0
 
         return True
 
     def DeclareMapPlayed(self, mapName:str, poolName):
         if (self.DoesMapExist(mapName)):
-            self.maps[mapName.lower()].IncrementTimesPlayed()
+            _map = self.maps[mapName.lower()]
+            previousTimesPlayed = _map.timesPlayed
+            _map.IncrementTimesPlayed()
+            self.mapSelector.OnMapPlayed(_map, previousTimesPlayed)
 
         if (poolName is not None and self.DoesMapPoolExist(poolName)):
             self.pools[poolName.lower()].IncrementTimesPlayed()
@@ -690,7 +940,7 @@ class BotSettings(Document):
             rerolls = rerollPlayers.count(member.id) 
             calledOvertime = overtimeCaller == member
             madeOvertimeMistake = overtimeFixer is not None
-            self.registeredPlayers[member.id].IncrementStratRoulette(shouldIncrementGame, rerolls, calledOvertime, madeOvertimeMistake)
+            self.GetRegisteredPlayerByID(member.id).IncrementStratRoulette(shouldIncrementGame, rerolls, calledOvertime, madeOvertimeMistake)
 
     # Union[discord.User, FakeUser] user
     def DeclareWinner(self, user, mmrDelta=None):
@@ -709,7 +959,9 @@ class BotSettings(Document):
             if (newRole is not None):
                 mmrDelta = newRole.mmrDelta
 
-        self.registeredPlayers[id].UpdateData(mmrDelta, True)
+        player = self.GetRegisteredPlayerByID(id)
+        player.UpdateData(mmrDelta, True)
+        self._UpdateLeaderboard(player)
 
         newMMR = self.GetMMRByID(id)
         oldRole, newRole = self.GetMMRRoleByID(id, oldMMR)
@@ -738,7 +990,9 @@ class BotSettings(Document):
             if (newRole is not None):
                 mmrDelta = newRole.mmrDelta
 
-        self.registeredPlayers[id].UpdateData(mmrDelta, False)
+        player = self.GetRegisteredPlayerByID(id)
+        player.UpdateData(mmrDelta, False)
+        self._UpdateLeaderboard(player)
 
         newMMR = self.GetMMRByID(id)
         oldRole, newRole = self.GetMMRRoleByID(id, oldMMR)
@@ -784,7 +1038,9 @@ class BotSettings(Document):
 
         oldMMR = self.GetMMRByID(id)
 
-        self.registeredPlayers[id].RedoData(oldDelta, mmrDelta, prevResult, newResult)
+        player = self.GetRegisteredPlayerByID(id)
+        player.RedoData(oldDelta, mmrDelta, prevResult, newResult)
+        self._UpdateLeaderboard(player)
 
         newMMR = self.GetMMRByID(id)
         oldRole, newRole = self.GetMMRRoleByID(id, oldMMR)
@@ -808,7 +1064,7 @@ class BotSettings(Document):
         self.activities.append(activity)
 
     def RemoveActivity(self, index:int):
-        self.activities[index].delete() # remove entry from database
+        persistenceService.Delete(self.activities[index]) # remove entry from database
         self.activities.pop(index)
 
     def GetRandomQuip(self, requestor:discord.User):
@@ -841,13 +1097,13 @@ class BotSettings(Document):
         self.quips.append(newQuip)
 
     def RemoveQuip(self, index:int):
-        self.quips[index].delete() # remove entry from database
+        persistenceService.Delete(self.quips[index]) # remove entry from database
         self.quips.pop(index)
         
     def SetCurrentMapPool(self, poolName:str):
         self.currentPool = self.GetMapPoolProperName(poolName)
         self._currentPool = self.currentPool
-        self.save()
+        persistenceService.Save(self)
 
     def GetRandomStrat(self, type:StratRouletteTeamType, previousStrat = None):
         possibleStrats = []
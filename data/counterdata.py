@@ -0,0 +1,26 @@
+from mongoengine import Document, IntField, StringField
+from pymongo import ReturnDocument
+
+class CounterData(Document):
+    # Named counters handed out with a single atomic update, so two callers can never get the same value
+    # Database fields.  Dont modify or access directly, use the non underscore versions
+    _name = StringField(default='')
+    # The next value the counter will hand out
+    _value = IntField(default=0)
+
+    meta = {
+        'indexes': [
+            { 'fields': ['_name'], 'unique': True },
+        ]
+    }
+
+    @staticmethod
+    def Seed(name:str, value:int):
+        """Makes sure the counter exists and won't hand out anything below value"""
+        CounterData._get_collection().update_one({ '_name': name }, { '$max': { '_value': value } }, upsert=True)
+
+    @staticmethod
+    def Reserve(name:str, count:int = 1):
+        """Moves the counter on by count and returns the first of the values reserved"""
+        counter = CounterData._get_collection().find_one_and_update({ '_name': name }, { '$inc': { '_value': count } }, upsert=True, return_document=ReturnDocument.AFTER)
+        return counter['_value'] - count
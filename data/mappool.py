@@ -1,4 +1,5 @@
 from mongoengine import Document, StringField, ListField, IntField
+from services.persistenceservice import persistenceService
 from discord.ext import commands
 from enum import Enum
 
@@ -86,7 +87,9 @@ class MapPool(Document):
     name = ''
     timesPlayed = 0
     maps = []
+    mapSet = set() # Lower case names in maps for quick lookups
     type = 0
+    resolvedMaps = None # Cached lower case names of every map this pool allows, see GetResolvedMaps
 
     def __eq__(self, other):
         return self.name.lower == other.name.lower
@@ -95,49 +98,67 @@ class MapPool(Document):
         self.name = self._name
         self.timesPlayed = self._timesPlayed
         self.maps = []
+        self.mapSet = set()
         self.type = self._type
+        self.resolvedMaps = None
 
         for map in self._maps:
             self.maps.append(map)
+            self.mapSet.add(map.lower())
 
     def SetData(self, name:str, type:int):
         self.name = name
         self.type = type
         self.timesPlayed = 0
         self.maps = []
+        self.mapSet = set()
+        self.resolvedMaps = None
 
         self._name = name
         self._type = type
         self._timesPlayed = 0
         self._maps = []
-        self.save()
+        persistenceService.Save(self)
 
     def SetName(self, name:str):
         self.name = name
         self._name = name
-        self.save()
+        persistenceService.Save(self)
 
     def SetType(self, type:int):
         self.type = type
         self._type = type
-        self.save()
+        self.resolvedMaps = None
+        persistenceService.Save(self)
 
     def IncrementTimesPlayed(self):
         self.timesPlayed += 1
         self._timesPlayed = self.timesPlayed
-        self.save()
+        persistenceService.Save(self)
 
     def AddMap(self, map:str):
+        if (self.HasMap(map)):
+            return
+
         self.maps.append(map)
         self._maps.append(map)
-        self.save()
+        self.mapSet.add(map.lower())
+        self.resolvedMaps = None
+        persistenceService.Save(self)
 
     def RemoveMap(self, map:str):
-        if (map in self.maps):
-            self.maps.remove(map)
-        if (map in self._maps):
-            self._maps.remove(map)
-        self.save()
+        if (not self.HasMap(map)):
+            return
+
+        self.maps = [_map for _map in self.maps if _map.lower() != map.lower()]
+        self._maps = list(self.maps)
+        self.mapSet.discard(map.lower())
+        self.resolvedMaps = None
+        persistenceService.Save(self)
+
+    def HasMap(self, map:str):
+        # Whether the map is in this pool's list, regardless of the pool type
+        return map.lower() in self.mapSet
 
     def GetMapNames(self):
         if (self.type == MapPoolType.ALL.value):
@@ -154,8 +175,27 @@ class MapPool(Document):
 
     def IsValidMap(self, map:str):
         if (self.type == MapPoolType.CUSTOM.value):
-            return map in self.maps
+            return self.HasMap(map)
         elif (self.type == MapPoolType.EXCLUDE.value):
-            return map not in self.maps
+            return not self.HasMap(map)
+
+        return True
+
+    def InvalidateResolvedMaps(self):
+        # Needs to be called whenever a map is added or removed from the bot
+        self.resolvedMaps = None
+
+    def GetResolvedMaps(self, allMaps):
+        """Returns the lower case names of every map this pool allows
+
+           allMaps: Iterable of lower case names for every map. Only used when the cached set needs rebuilding
+        """
+        if (self.resolvedMaps is None):
+            if (self.type == MapPoolType.CUSTOM.value):
+                self.resolvedMaps = frozenset(name for name in allMaps if name in self.mapSet)
+            elif (self.type == MapPoolType.EXCLUDE.value):
+                self.resolvedMaps = frozenset(name for name in allMaps if name not in self.mapSet)
+            else:
+                self.resolvedMaps = frozenset(allMaps)
 
-        return True 
+        return self.resolvedMaps
@@ -1,6 +1,17 @@
-from mongoengine import Document, EmbeddedDocument, ListField, IntField, StringField, EmbeddedDocumentField
+from mongoengine import Document, EmbeddedDocument, ListField, IntField, StringField, EmbeddedDocumentField, DateTimeField
+from services.persistenceservice import persistenceService
 from enum import Enum
 from discord.ext import commands
+from datetime import datetime
+from pymongo import UpdateOne
+
+# How match creation times were stored before they were saved as dates, and how we still show them
+creationTimeFormat = '%d %b %Y %H:%M'
+
+def FormatCreationTime(creationTime):
+    if (isinstance(creationTime, datetime)):
+        return creationTime.strftime(creationTimeFormat)
+    return '' if creationTime is None else str(creationTime)
 
 class InvalidMatchResult(commands.BadArgument):
     def __init__(self, argument):
@@ -69,10 +80,56 @@ class MatchHistoryData(Document):
     _result = IntField(default=MatchResult.INVALID.value)
     _map = StringField(default='')
     _pool = StringField(default='None')
-    _creationTime = StringField(default='')
+    _creationTime = DateTimeField(default=None)
     _matchUniqueID = IntField(default=0)
 
-    def StoreData(self, team1, team2, result:MatchResult, selectedMap:str, pool, creationTime:str, id:int):
+    meta = {
+        'indexes': [
+            # /recallmatch looks matches up by id
+            { 'fields': ['_matchUniqueID'], 'unique': True },
+            # Multikey indexes for finding every match a player was in
+            '_team1._id',
+            '_team2._id',
+            # Time ranges and most recent matches
+            '-_creationTime',
+        ]
+    }
+
+    @classmethod
+    def GetMatchesBetween(cls, start:datetime, end:datetime):
+        """Matches created from start up to (but not including) end, oldest first. Served by the -_creationTime index"""
+        return cls.objects(_creationTime__gte=start, _creationTime__lt=end).order_by('_creationTime')
+
+    @classmethod
+    def GetLastMatches(cls, count:int):
+        """The most recent count matches, newest first"""
+        # limit(0) means no limit at all, which would read the whole history
+        if (count <= 0):
+            return cls.objects.none()
+
+        return cls.objects(_creationTime__ne=None).order_by('-_creationTime').limit(count)
+
+    @classmethod
+    def MigrateCreationTimes(cls):
+        """Converts creation times stored as formatted strings into dates. Returns how many matches were converted"""
+        collection = cls._get_collection()
+        operations = []
+
+        for data in collection.find({ '_creationTime': { '$type': 'string' } }, { '_creationTime': 1 }):
+            try:
+                creationTime = datetime.strptime(data['_creationTime'], creationTimeFormat)
+            except ValueError:
+                # Nothing sensible to convert it to, leave the match out of time based queries
+                creationTime = None
+
+            operations.append(UpdateOne({ '_id': data['_id'] }, { '$set': { '_creationTime': creationTime } }))
+
+        if (len(operations) > 0):
+            collection.bulk_write(operations, ordered=False)
+
+        return len(operations)
+
+    def StoreData(self, team1, team2, result:MatchResult, selectedMap:str, pool, creationTime:datetime, id:int):
         self._team1 = team1 
         self._team2 = team2 
         self._result = result.value
@@ -80,4 +137,4 @@ class MatchHistoryData(Document):
         self._pool = 'None' if pool is None else pool
         self._creationTime = creationTime
         self._matchUniqueID = id
-        self.save()
+        persistenceService.Save(self)
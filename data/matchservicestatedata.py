@@ -0,0 +1,22 @@
+from mongoengine import Document, ListField, DictField
+from services.persistenceservice import persistenceService
+from pymongo import ReplaceOne
+
+class MatchServiceStateData(Document):
+    # A snapshot of every lobby queue and running match so they survive the bot restarting. There is only ever one of these
+    # Database fields.  Dont modify or access directly, use the non underscore versions
+    # Type: Array<Dictionary{name, size, forcedMap, matchmaking, players: Array<Dictionary{id, mmr, queueTime}>}>
+    _lobbies = ListField(DictField())
+    # Type: Array<Dictionary{id, map, pool, creationTime, team1, team2, matchMessage, adminMessage}>
+    _matches = ListField(DictField())
+
+    @staticmethod
+    def Load():
+        """Returns the stored snapshot, or None if there isn't one"""
+        return MatchServiceStateData.objects.first()
+
+    @staticmethod
+    def Store(lobbies, matches):
+        # Replace the whole snapshot in one write. It's only a handful of small documents, and it can never be half updated
+        data = { '_lobbies': lobbies, '_matches': matches }
+        persistenceService.QueueOperation(MatchServiceStateData, ReplaceOne({}, data, upsert=True))
@@ -1,4 +1,5 @@
 from mongoengine import Document, IntField 
+from services.persistenceservice import persistenceService
 import discord
 from discord.ext import commands
 
@@ -49,7 +50,7 @@ class MMRRole(Document):
         self._mmrMax = mmrMax
         self._mmrDelta = mmrDelta
         self._role = role.id
-        self.save()
+        persistenceService.Save(self)
 
     def UpdateData(self, mmrMin:int, mmrMax:int, mmrDelta:int):
         self.mmrMin = mmrMin
@@ -59,4 +60,4 @@ class MMRRole(Document):
         self._mmrMin = mmrMin
         self._mmrMax = mmrMax
         self._mmrDelta = mmrDelta
-        self.save()
+        persistenceService.Save(self)
@@ -1,4 +1,6 @@
 from mongoengine import Document, IntField, StringField
+from pymongo import UpdateOne
+from services.persistenceservice import persistenceService
 from services.matchservice import TeamResult
 import discord
 from discord import app_commands
@@ -32,41 +34,52 @@ class PlayerData(Document):
     _stratRouletteOvertimesCalled = IntField(default=0)
     _stratRouletteOvertimeMistakes = IntField(default=0)
 
-    # Settings
-    mmr = 0
-    lowestMMR = -1
-    highestMMR = -1
-    matchesPlayed = 0
-    wins = 0
-    loses = 0
-    winStreak = 0
-    loseStreak = 0
-    highestWinStreak = 0
-    highestLoseStreak = 0
-    name = '' # The name choosen by the user when registering
-    user = None # discord.User
-    stratRouletteMatchesPlayed = 0
-    stratRouletteTotalRerolls = 0
-    stratRouletteOvertimesCalled = 0
-    stratRouletteOvertimeMistakes = 0
-
-    async def Init(self, bot):
-        self.mmr = self._mmr
-        self.lowestMMR = self._lowestMMR
-        self.highestMMR = self._highestMMR
-        self.winStreak = self._winStreak
-        self.loseStreak = self._loseStreak
-        self.highestWinStreak = self._highestWinStreak
-        self.highestLoseStreak = self._highestLoseStreak
-        self.matchesPlayed = self._matchesPlayed
-        self.wins = self._wins
-        self.loses = self._loses
-        self.name = self._name
-        self.user = bot.get_user(self._user)
-        self.stratRouletteMatchesPlayed = self._stratRouletteMatchesPlayed
-        self.stratRouletteTotalRerolls = self._stratRouletteTotalRerolls
-        self.stratRouletteOvertimesCalled = self._stratRouletteOvertimesCalled
-        self.stratRouletteOvertimeMistakes = self._stratRouletteOvertimeMistakes
+    meta = {
+        'indexes': [
+            '_user',
+        ]
+    }
+
+    @staticmethod
+    def Create(user:discord.User, name:str):
+        """Queues the new player's document and returns their runtime record"""
+        data = PlayerData(_user=user.id, _name=name)
+        persistenceService.Save(data)
+        return Player(data.to_mongo().to_dict(), user)
+
+    @staticmethod
+    def LoadMany(ids):
+        return PlayerData.objects(_user__in=list(ids)).as_pymongo()
+
+class Player(object):
+    """The runtime state of a registered player. The services only ever work with these, PlayerData is just how it's stored"""
+    __slots__ = ('id', 'user', 'name', 'mmr', 'lowestMMR', 'highestMMR', 'matchesPlayed', 'wins', 'loses', 'winStreak', 'loseStreak',
+                 'highestWinStreak', 'highestLoseStreak', 'stratRouletteMatchesPlayed', 'stratRouletteTotalRerolls',
+                 'stratRouletteOvertimesCalled', 'stratRouletteOvertimeMistakes')
+
+    def __init__(self, data:dict, user:discord.User = None):
+        """data is a raw PlayerData document. Missing fields get the same defaults as PlayerData"""
+        self.id = data.get('_user', -1)
+        self.user = user # discord.User
+        self.name = data.get('_name', '') # The name choosen by the user when registering
+        self.mmr = data.get('_mmr', 0)
+        self.lowestMMR = data.get('_lowestMMR', -1)
+        self.highestMMR = data.get('_highestMMR', -1)
+        self.matchesPlayed = data.get('_matchesPlayed', 0)
+        self.wins = data.get('_wins', 0)
+        self.loses = data.get('_loses', 0)
+        self.winStreak = data.get('_winStreak', 0)
+        self.loseStreak = data.get('_loseStreak', 0)
+        self.highestWinStreak = data.get('_highestWinStreak', 0)
+        self.highestLoseStreak = data.get('_highestLoseStreak', 0)
+        self.stratRouletteMatchesPlayed = data.get('_stratRouletteMatchesPlayed', 0)
+        self.stratRouletteTotalRerolls = data.get('_stratRouletteTotalRerolls', 0)
+        self.stratRouletteOvertimesCalled = data.get('_stratRouletteOvertimesCalled', 0)
+        self.stratRouletteOvertimeMistakes = data.get('_stratRouletteOvertimeMistakes', 0)
+
+    def _Update(self, update):
+        # _user is indexed and unique per player, and the single write worker keeps this behind the insert from Create
+        persistenceService.QueueOperation(PlayerData, UpdateOne({ '_user': self.id }, update))
 
     def RedoData(self, oldDelta:int, mmrDelta:int, prevResult:TeamResult, newResult:TeamResult):
         # undo the previous match
@@ -103,14 +116,15 @@ class PlayerData(Document):
         self.lowestMMR = min(self.lowestMMR, self.mmr)
         self.highestMMR = max(self.highestMMR, self.mmr)
 
-        # Update database
-        self._mmr = self.mmr
-        self._lowestMMR = self.lowestMMR
-        self._highestMMR = self.highestMMR
-        self._wins = self.wins
-        self._loses = self.loses
-        self._matchesPlayed = self.matchesPlayed
-        self.save()
+        # The counters move by however much the redo changed them, the mmr itself depends on the clamping above
+        winsDelta = (1 if newResult == TeamResult.WIN else 0) - (1 if prevResult == TeamResult.WIN else 0)
+        losesDelta = (1 if newResult == TeamResult.LOSE else 0) - (1 if prevResult == TeamResult.LOSE else 0)
+
+        self._Update({
+            '$inc': { '_wins': winsDelta, '_loses': losesDelta, '_matchesPlayed': winsDelta + losesDelta },
+            '$set': { '_mmr': self.mmr, '_lowestMMR': self.lowestMMR },
+            '$max': { '_highestMMR': self.highestMMR },
+        })
 
     def UpdateData(self, mmrDelta:int, isWin:bool):
         # Update cache
@@ -144,48 +158,34 @@ class PlayerData(Document):
 
         self.matchesPlayed += 1
 
-        # Update database
-        self._mmr = self.mmr
-        self._lowestMMR = self.lowestMMR
-        self._highestMMR = self.highestMMR
-        self._wins = self.wins
-        self._loses = self.loses
-        self._winStreak = self.winStreak
-        self._loseStreak = self.loseStreak
-        self._highestWinStreak = self.highestWinStreak
-        self._highestLoseStreak = self.highestLoseStreak
-        self._matchesPlayed = self.matchesPlayed
-        self.save()
+        self._Update({
+            '$inc': { '_wins' if isWin else '_loses': 1, '_matchesPlayed': 1 },
+            '$set': { '_mmr': self.mmr, '_lowestMMR': self.lowestMMR, '_winStreak': self.winStreak, '_loseStreak': self.loseStreak },
+            '$max': { '_highestMMR': self.highestMMR, '_highestWinStreak': self.highestWinStreak, '_highestLoseStreak': self.highestLoseStreak },
+        })
 
     def IncrementStratRoulette(self, shouldIncrementGame:bool, rerolls:int, calledOvertime:bool, madeOvertimeMistake:bool):
         if (shouldIncrementGame):
-            self._stratRouletteMatchesPlayed += 1
             self.stratRouletteMatchesPlayed += 1
 
-        self._stratRouletteTotalRerolls += rerolls
         self.stratRouletteTotalRerolls += rerolls
 
         if (calledOvertime):
-            self._stratRouletteOvertimesCalled += 1 
             self.stratRouletteOvertimesCalled += 1 
 
         if (madeOvertimeMistake):
-            self._stratRouletteOvertimeMistakes += 1 
             self.stratRouletteOvertimeMistakes += 1 
 
-        self.save()
+        self._Update({ '$inc': {
+            '_stratRouletteMatchesPlayed': 1 if shouldIncrementGame else 0,
+            '_stratRouletteTotalRerolls': rerolls,
+            '_stratRouletteOvertimesCalled': 1 if calledOvertime else 0,
+            '_stratRouletteOvertimeMistakes': 1 if madeOvertimeMistake else 0,
+        } })
     
-    def SetUser(self, user:discord.User, name:str):
-        self.user = user
-        self._user = user.id
-        self.name = name
-        self._name = name
-        self.save()
-
     def SetName(self, name:str):
         self.name = name
-        self._name = name
-        self.save()
+        self._Update({ '$set': { '_name': name } })
 
     def SetMMR(self, mmr:int):
         self.mmr = mmr
@@ -199,10 +199,7 @@ class PlayerData(Document):
         self.lowestMMR = min(self.lowestMMR, self.mmr)
         self.highestMMR = max(self.highestMMR, self.mmr)
 
-        self._mmr = mmr
-        self._lowestMMR = self.lowestMMR
-        self._highestMMR = self.highestMMR
-        self.save()
+        self._Update({ '$set': { '_mmr': self.mmr, '_lowestMMR': self.lowestMMR, '_highestMMR': self.highestMMR } })
 
     def GetStreak(self):
         if (self.winStreak > self.loseStreak):
@@ -213,9 +210,4 @@ class PlayerData(Document):
         return 'None', ''
 
     def GetID(self):
-        if (self.user is None):
-            return self._user
-
-        return self.user.id
-
-
+        return self.id
@@ -0,0 +1,133 @@
+from mongoengine import Document, IntField, DictField
+from services.persistenceservice import persistenceService
+from data.matchhistorydata import MatchHistoryData, MatchResult
+from pymongo import UpdateOne, InsertOne
+
+def _EscapeKey(key:str):
+    # Mongo doesn't allow '.' or a leading '$' in keys, swap them for their full width versions
+    return key.replace('.', '．').replace('$', '＄')
+
+class MapStats(object):
+    def __init__(self, name, wins, loses):
+        self.name = name
+        self.wins = wins
+        self.loses = loses
+
+class TeammateStats(object):
+    def __init__(self, id, winsWith, lossesWith, winsAgainst, lossesAgainst):
+        self.id = id
+        self.winsWith = winsWith
+        self.lossesWith = lossesWith
+        self.winsAgainst = winsAgainst
+        self.lossesAgainst = lossesAgainst
+
+class PlayerStatsData(Document):
+    # Running totals for a player, kept up to date as matches are called so /stats doesn't have to walk the match history
+    # Database fields.  Dont modify or access directly, use the non underscore versions
+    _user = IntField(default=-1)
+    # Type: Dictionary<key=escaped map name, value=Dictionary{name, wins, loses}>
+    _maps = DictField()
+    # Type: Dictionary<key=str(player id), value=Dictionary{winsWith, lossesWith, winsAgainst, lossesAgainst}>
+    _players = DictField()
+
+    meta = {
+        'indexes': [
+            { 'fields': ['_user'], 'unique': True },
+        ]
+    }
+
+    def GetMapStats(self):
+        stats = []
+        for map in self._maps.values():
+            # Recalled matches can leave a map at 0/0
+            if (map.get('wins', 0) + map.get('loses', 0) > 0):
+                stats.append(MapStats(map.get('name', ''), map.get('wins', 0), map.get('loses', 0)))
+        return stats
+
+    def GetTeammateStats(self):
+        stats = []
+        for id, player in self._players.items():
+            counts = [player.get('winsWith', 0), player.get('lossesWith', 0), player.get('winsAgainst', 0), player.get('lossesAgainst', 0)]
+            if (sum(counts) > 0):
+                stats.append(TeammateStats(int(id), *counts))
+        return stats
+
+    @staticmethod
+    def _GetIncrements(team, enemyTeam, map:str, isWin:bool, direction:int):
+        # Returns Dictionary<key=player id, value=Dictionary<key=field path, value=increment>>
+        increments = {}
+        mapKey = '_maps.{}'.format(_EscapeKey(map))
+
+        for id in team:
+            inc = {}
+            inc['{}.{}'.format(mapKey, 'wins' if isWin else 'loses')] = direction
+
+            for teammate in team:
+                if (teammate != id):
+                    inc['_players.{}.{}'.format(teammate, 'winsWith' if isWin else 'lossesWith')] = direction
+
+            for enemy in enemyTeam:
+                inc['_players.{}.{}'.format(enemy, 'winsAgainst' if isWin else 'lossesAgainst')] = direction
+
+            increments[id] = inc
+
+        return increments
+
+    @staticmethod
+    def RecordMatch(team1, team2, result:MatchResult, map:str, direction:int = 1):
+        """Adds a match to the stats of everyone who played it. Use a direction of -1 to take it back out again.
+
+           team1, team2: Array<int> of player ids
+        """
+        if (result != MatchResult.TEAM1VICTORY and result != MatchResult.TEAM2VICTORY):
+            return
+
+        winners, losers = (team1, team2) if result == MatchResult.TEAM1VICTORY else (team2, team1)
+        increments = PlayerStatsData._GetIncrements(winners, losers, map, True, direction)
+        increments.update(PlayerStatsData._GetIncrements(losers, winners, map, False, direction))
+
+        mapKey = '_maps.{}'.format(_EscapeKey(map))
+
+        for id, inc in increments.items():
+            # Fake users don't get stats of their own
+            if (id < 0):
+                continue
+
+            update = { '$inc': inc, '$set': { '{}.name'.format(mapKey): map } }
+            persistenceService.QueueOperation(PlayerStatsData, UpdateOne({ '_user': id }, update, upsert=True))
+
+    @staticmethod
+    def RebuildAll():
+        """Rebuilds every player's stats from the match history. Only needed for history recorded before stats were tracked"""
+        # Type: Dictionary<key=player id, value=PlayerStatsData document as a dictionary>
+        stats = {}
+
+        def Apply(team, enemyTeam, map, isWin):
+            for id, inc in PlayerStatsData._GetIncrements(team, enemyTeam, map, isWin, 1).items():
+                if (id < 0):
+                    continue
+
+                if (id not in stats):
+                    stats[id] = { '_user': id, '_maps': {}, '_players': {} }
+
+                for path, value in inc.items():
+                    field, key, counter = path.split('.')
+                    entry = stats[id][field].setdefault(key, {})
+                    entry[counter] = entry.get(counter, 0) + value
+
+                    if (field == '_maps'):
+                        entry['name'] = map
+
+        for match in MatchHistoryData.objects(_result__in=[MatchResult.TEAM1VICTORY.value, MatchResult.TEAM2VICTORY.value]):
+            team1 = [player._id for player in match._team1]
+            team2 = [player._id for player in match._team2]
+            winners, losers = (team1, team2) if match._result == MatchResult.TEAM1VICTORY.value else (team2, team1)
+
+            Apply(winners, losers, match._map, True)
+            Apply(losers, winners, match._map, False)
+
+        collection = PlayerStatsData._get_collection()
+        collection.delete_many({})
+
+        if (len(stats) > 0):
+            collection.bulk_write([InsertOne(data) for data in stats.values()], ordered=False)
@@ -1,4 +1,5 @@
 from mongoengine import Document, IntField, StringField
+from services.persistenceservice import persistenceService
 from enum import Enum
 from discord.ext import commands
 import discord
@@ -76,25 +77,25 @@ class QuipData(Document):
         self._type = type 
         self._user = user.id if user is not None else None
         self._useCount = 0
-        self.save()
+        persistenceService.Save(self)
 
     def SetQuip(self, quip:str):
         self.quip = quip 
         self._quip = quip 
-        self.save()
+        persistenceService.Save(self)
 
     def SetType(self, type:int):
         self.type = type  
         self._type = type 
-        self.save()
+        persistenceService.Save(self)
 
     def SetUser(self, user:discord.User):
         self.user = user
         self._user = user.id
-        self.save()
+        persistenceService.Save(self)
 
     def IncrementUse(self):
         self.useCount += 1
         self._useCount += 1
-        self.save()
+        persistenceService.IncrementCounter(self, '_useCount')
 
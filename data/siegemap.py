@@ -1,4 +1,5 @@
 from mongoengine import Document, IntField, StringField
+from services.persistenceservice import persistenceService
 from discord.ext import commands
 
 class MapExists(commands.BadArgument):
@@ -39,14 +40,14 @@ class SiegeMap(Document):
         self._name = name
         self.thumbnailURL = url 
         self._thumbnailURL = url 
-        self.save()
+        persistenceService.Save(self)
 
     def SetThumbnail(self, url:str):
         self.thumbnailURL = url 
         self._thumbnailURL = url 
-        self.save()
+        persistenceService.Save(self)
 
     def IncrementTimesPlayed(self):
         self.timesPlayed += 1
         self._timesPlayed = self.timesPlayed
-        self.save()
+        persistenceService.Update(self, { '$inc': { '_timesPlayed': 1 } })
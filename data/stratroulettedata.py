@@ -1,4 +1,5 @@
 from mongoengine import Document, IntField, StringField, ListField
+from services.persistenceservice import persistenceService
 from enum import Enum
 from discord.ext import commands
 
@@ -108,32 +109,32 @@ class StratRouletteData(Document):
         self._title = title
         self._strat = strat
         self._type = type
-        self.save()
+        persistenceService.Save(self)
 
     def SetStrat(self, strat:str):
         self.strat = strat
         self._strat = strat
-        self.save()
+        persistenceService.Save(self)
 
     def SetTitle(self, title:str):
         self.title = title 
         self._title = title 
-        self.save()
+        persistenceService.Save(self)
 
     def SetType(self, type:int):
         self.type = type
         self._type = type
-        self.save()
+        persistenceService.Save(self)
 
     def IncrementTimesPlayed(self):
         self.timesPlayed += 1
         self._timesPlayed += 1
-        self.save()
+        persistenceService.IncrementCounter(self, '_timesPlayed')
 
     def IncrementTimesRerolled(self):
         self.timesRerolled += 1
         self._timesRerolled += 1
-        self.save()
+        persistenceService.IncrementCounter(self, '_timesRerolled')
 
 class StratRouletteGlobalMatchData(Document):
     # Database fields.  Dont modify or access directly, use the non underscore versions
@@ -169,7 +170,12 @@ class StratRouletteGlobalMatchData(Document):
             self.totalOvertimeMistakes += 1
             self._totalOvertimeMistakes += 1
 
-        self.save()
+        persistenceService.Update(self, { '$inc': {
+            '_totalGames': 1 if shouldIncrementGame else 0,
+            '_totalRerolls': totalRerolls,
+            '_totalOvertimes': 1 if overtimeCaller is not None else 0,
+            '_totalOvertimeMistakes': 1 if overtimeFixer is not None else 0,
+        } })
 
 
 class StratRouletteMatchData(Document):
@@ -191,4 +197,4 @@ class StratRouletteMatchData(Document):
         self._overtimeCaller = overtimeCaller.id if overtimeCaller is not None else -1
         self._overtimeFixer = overtimeFixer.id if overtimeFixer is not None else -1
 
-        self.save()
+        persistenceService.Save(self)
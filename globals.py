@@ -1,6 +1,7 @@
 from data.botsettings import BotSettings
 from services.matchservice import MatchService
 from services.stratrouletteservice import StratRouletteService 
+from services.persistenceservice import persistenceService
 
 # Load (or create) our settings
 if (len(BotSettings.objects) > 0):
@@ -4,7 +4,7 @@ import getopt
 
 # Get our commandline args if any
 try:
-    cmdOptions, cmdArgs = getopt.getopt(sys.argv[1:], 'i:p:t:', ['ip=', 'port=', 'token='])
+    cmdOptions, cmdArgs = getopt.getopt(sys.argv[1:], 'i:p:t:f', ['ip=', 'port=', 'token=', 'force-sync'])
 except getopt.GetoptError:
     print('Invalid arg usage')
     sys.exit(2)
@@ -12,6 +12,7 @@ except getopt.GetoptError:
 ip = 'localhost'
 port = '27017'
 token = ''
+forceSync = False
 
 for option, arg in cmdOptions:
     if (option in ('-i', '--ip')):
@@ -20,21 +21,38 @@ for option, arg in cmdOptions:
         port = arg
     elif (option in ('-t', '--token')):
         token = arg
+    elif (option in ('-f', '--force-sync')):
+        forceSync = True
 
 # Connect to our MongoDB
 print('Trying to connect to DB')
 connect(db="jppbot", host=ip, port=int(port))
 
 from globals import *
-from commands.admincommands import AdminCommands
-from commands.botcommands import BotCommands 
-from commands.ownercommands import OwnerCommands 
-from commands.helpcommand import HelpCommand 
 from discord.ext import commands
+from discord import app_commands
 import discord
 
+class JPPCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction:discord.Interaction) -> bool:
+        # Commands that come in while settings are still loading would see empty caches. Wait a little, but we
+        # have to answer the interaction within 3 seconds
+        if (await botSettings.WaitUntilReady(timeout=2.0)):
+            return True
+
+        if (interaction.type == discord.InteractionType.application_command):
+            await interaction.response.send_message('JPP Bot is still starting up, please try again in a moment.', ephemeral=True)
+        return False
+
 class JPPBot(commands.Bot):
     async def setup_hook(self) -> None:
+        # The cogs pull in every command and the helpers they use, so they're only imported once we're about to need them
+        from commands.admincommands import AdminCommands
+        from commands.botcommands import BotCommands
+        from commands.ownercommands import OwnerCommands
+        from commands.helpcommand import HelpCommand
+        from utils.botutils import GetCommandTreeHash
+
         await self.add_cog(AdminCommands(self))
         await self.add_cog(BotCommands(self))
         await self.add_cog(OwnerCommands(self))
@@ -47,11 +65,20 @@ class JPPBot(commands.Bot):
         # followed by syncing to the testing guild.
         #await self.tree.sync(guild=guild)
 
-        # sync the global commands
-        await self.tree.sync()
+        # sync the global commands. Syncing is slow and heavily rate limited, so skip it unless a command changed
+        treeHash = GetCommandTreeHash(self.tree, self.application_id)
+
+        if (forceSync or not botSettings.IsCommandTreeSynced(treeHash)):
+            print('Syncing commands')
+            await self.tree.sync()
+            botSettings.SetCommandTreeHash(treeHash)
+        else:
+            print('Commands are unchanged, skipping sync')
 
     # Override the default error handling to try and handle non-command errors
     async def on_command_error(self, ctx, error):
+        from utils.errorutils import HandleError
+
         command = ctx.command
         if command and command.has_error_handler():
             return
@@ -63,20 +90,23 @@ intents.members = True
 intents.voice_states = True
 intents.guilds = True
 intents.message_content = True
-bot = JPPBot(command_prefix='!', description='A bot to host the weekly JPP sessions.\nFor Slash Command help, just start typing / and see what JPP Bot provides!', intents=intents)
+bot = JPPBot(command_prefix='!', description='A bot to host the weekly JPP sessions.\nFor Slash Command help, just start typing / and see what JPP Bot provides!', intents=intents, tree_cls=JPPCommandTree)
 
 # We dont want people dming the bot to run commands
-from utils.errorutils import HandleError, NoPrivateMessages
-
 @bot.check
 async def block_dms(ctx):
     if (botSettings.IsUserOwner(ctx.author)):
         return True 
     if (ctx.guild is None):
+        from utils.errorutils import NoPrivateMessages
         raise NoPrivateMessages()
     return ctx.guild is not None
 
-matchService.Init(bot, botSettings)
+persistenceService.Init()
+matchService.Init(bot, botSettings, stratRouletteService)
 stratRouletteService.Init(bot, botSettings)
 
 bot.run(token)
+
+# Write out anything still buffered if the bot stopped without /quit
+persistenceService.Shutdown()
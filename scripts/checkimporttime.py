@@ -0,0 +1,76 @@
+import subprocess
+import sys
+import os
+import getopt
+
+# Everything jppbot.py imports before logging in, minus globals which needs a database connection
+defaultModules = ['discord', 'mongoengine', 'data.botsettings', 'services.matchservice', 'services.stratrouletteservice', 'services.persistenceservice']
+# Modules that have no business being loaded by the bot at all
+bannedModules = ['tkinter']
+# Total import time allowed in milliseconds
+defaultBudget = 1500
+
+def MeasureImports(modules):
+    """Returns (package, self ms, cumulative ms, depth) for every module imported, in the order python finished them"""
+    rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = 'import {}'.format(', '.join(modules)) if len(modules) > 0 else 'pass'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=rootDir, capture_output=True, text=True)
+
+    if (result.returncode != 0):
+        print(result.stderr)
+        sys.exit(2)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if (not line.startswith('import time:') or '[us]' in line):
+            continue
+
+        selfTime, cumulative, package = line[len('import time:'):].split('|')
+        depth = (len(package) - len(package.lstrip())) // 2
+        imports.append((package.strip(), int(selfTime) / 1000, int(cumulative) / 1000, depth))
+
+    return imports
+
+def main():
+    try:
+        cmdOptions, cmdArgs = getopt.getopt(sys.argv[1:], 'b:', ['budget='])
+    except getopt.GetoptError:
+        print('Usage: checkimporttime.py [--budget=ms] [module ...]')
+        sys.exit(2)
+
+    budget = defaultBudget
+    modules = cmdArgs if len(cmdArgs) > 0 else defaultModules
+
+    for option, arg in cmdOptions:
+        if (option in ('-b', '--budget')):
+            budget = float(arg)
+
+    # The interpreter imports a few modules of its own on startup (site, encodings...), those aren't ours to budget
+    startup = set(package for package, _, _, _ in MeasureImports([]))
+    imports = [entry for entry in MeasureImports(modules) if entry[0] not in startup]
+
+    # Only the outermost imports, their cumulative times cover everything under them
+    total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+
+    print('Slowest imports:')
+    for package, selfTime, cumulative, _ in sorted(imports, key=lambda entry : entry[1], reverse=True)[:15]:
+        print('  {:>8.1f}ms self {:>8.1f}ms cumulative  {}'.format(selfTime, cumulative, package))
+
+    print('Total import time: {:.0f}ms (budget {:.0f}ms)'.format(total, budget))
+
+    failed = False
+    banned = [package for package, _, _, _ in imports if package.split('.')[0] in bannedModules]
+
+    if (len(banned) > 0):
+        print('Error: Banned modules were imported: {}'.format(', '.join(banned)))
+        failed = True
+
+    if (total > budget):
+        print('Error: Import time is over budget by {:.0f}ms'.format(total - budget))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
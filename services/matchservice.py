@@ -2,9 +2,15 @@ import discord
 from discord.ext import commands
 from utils.chatutils import EditMessage, SendMessage, SendChannelMessage
 from datetime import datetime
-from data.matchhistorydata import MatchResult, MatchHistoryData, MatchHistoryPlayerData
+from data.matchhistorydata import MatchResult, MatchHistoryData, MatchHistoryPlayerData, FormatCreationTime
+from data.playerstatsdata import PlayerStatsData
+from data.matchservicestatedata import MatchServiceStateData
+from services.persistenceservice import persistenceService
+from utils.balanceutils import TeamBalancer, teamBalancer
+from utils.matchmakingutils import MatchmakingQueue, MatchmakingWindow
 from enum import Enum
-import random
+import contextvars
+import asyncio
 
 class PlayerAlreadyQueued(commands.BadArgument):
     def __init__(self, argument):
@@ -38,14 +44,37 @@ class PlayerSwapFailed(commands.BadArgument):
         self.arg2 = arg2
         super().__init__('Failed to find both Player {0.mention} and Player {1.mention} the queue/start matches.'.format(arg1, arg2))
 
+class InvalidLobby(commands.BadArgument):
+    def __init__(self, argument):
+        self.argument = argument
+        super().__init__('Lobby `{}` does not exist.'.format(argument))
+
+class LobbyExists(commands.BadArgument):
+    def __init__(self, argument):
+        self.argument = argument
+        super().__init__('Lobby `{}` already exists.'.format(argument))
+
+class LobbyNotEmpty(commands.BadArgument):
+    def __init__(self, argument):
+        self.argument = argument
+        super().__init__('Lobby `{}` still has players in it.'.format(argument))
+
+class CantRemoveDefaultLobby(commands.BadArgument):
+    def __init__(self):
+        super().__init__('The default lobby can\'t be removed.')
+
+class MatchIDRequired(commands.BadArgument):
+    def __init__(self):
+        super().__init__('There is more than one match running, please specify a match id.')
+
 
 class QueuedPlayer(object):
-    user = None
-    mmr = 0
+    __slots__ = ('user', 'mmr', 'queueTime')
 
     def __init__(self, user, mmr):
         self.user = user
         self.mmr = mmr
+        self.queueTime = datetime.now() # datetime
 
     def __eq__(self, other):
         if (other == None):
@@ -53,31 +82,29 @@ class QueuedPlayer(object):
         return self.user.id == other.id
 
 class FakeUser(object):
-    id = 0
-    mention = ''
+    __slots__ = ('id', 'mention')
 
     def __init__(self, id):
         self.id = id
         self.mention = '<Fake User: {}>'.format(id)
 
 class Match(object):
-    team1 = []
-    team2 = []
-    players = []
-    map = ''
-    pool = ''
-    creationTime = ''
-    uniqueID = 0
-    matchMessage = None
-    adminMessage = None
-    resultsView = None
+    __slots__ = ('uniqueID', 'map', 'pool', 'creationTime', 'players', 'team1', 'team2', 'matchMessage', 'adminMessage', 'resultsView')
 
     def __init__(self, id, players, map, pool, creationTime):
         self.uniqueID = id
         self.map = map
         self.pool = pool
-        self.creationTime = creationTime
+        self.creationTime = creationTime # datetime
+        # Type: Array<QueuedPlayer>
         self.players = players.copy()
+        # Type: Array<QueuedPlayer>
+        self.team1 = []
+        # Type: Array<QueuedPlayer>
+        self.team2 = []
+        self.matchMessage = None # discord.Message
+        self.adminMessage = None # discord.Message
+        self.resultsView = None # MatchResultView
 
     def IsPlayerInMatch(self, user:discord.User):
         for player in self.players:
@@ -104,6 +131,8 @@ class Match(object):
         elif (result == MatchResult.TEAM2VICTORY):
             data.StoreData(loserTeamData, winnerTeamData, result, self.map, self.pool, self.creationTime, self.uniqueID)
 
+        PlayerStatsData.RecordMatch([player.user.id for player in self.team1], [player.user.id for player in self.team2], result, self.map)
+
     def RemovePlayer(self, user:discord.User):
         for i in range(len(self.team1)):
             if (self.team1[i] == user):
@@ -123,39 +152,11 @@ class Match(object):
     def AddPlayer(self, player):
         self.players.append(player)
 
-    def BalanceTeams(self):
-        team1 = []
-        team2 = []
+    def BalanceTeams(self, balancer:TeamBalancer = None):
+        if (balancer is None):
+            balancer = teamBalancer
 
-        numPlayers = len(self.players)
-        team1Size = int(numPlayers / 2)
-        team2Size = int(numPlayers - team1Size)
-        minDiff = 2147483647
-
-        def SumMMR(players):
-            sum = 0
-            for player in players:
-                sum += player.mmr
-            return sum
-
-        for i in range(10):
-            tempList = self.players.copy()
-            random.shuffle(tempList) 
-
-            tempT1 = tempList[:team1Size]
-            tempT2 = tempList[team1Size:]
-
-            team1Sum = SumMMR(tempT1)
-            team2Sum = SumMMR(tempT2)
-
-            diff = abs(team1Sum - team2Sum)
-            if (diff < minDiff):
-                team1 = tempT1
-                team2 = tempT2
-                minDiff = diff
-
-        self.team1 = team1
-        self.team2 = team2
+        self.team1, self.team2 = balancer.Balance(self.players)
 
 class InvalidTeamResult(commands.BadArgument):
     def __init__(self, argument):
@@ -185,14 +186,22 @@ class TeamResult(Enum):
             return returnType
 
 class MatchResultView(discord.ui.View):
-    def __init__(self, botSettings):
-        # 3 hour timeout by default
-        super().__init__(timeout=10800.0)
+    # 3 hour timeout by default
+    defaultTimeout = 10800.0
+
+    def __init__(self, botSettings, matchID:int, timeout:float = defaultTimeout):
+        # Views re-attached after a restart have to be persistent, which means no timeout
+        super().__init__(timeout=timeout)
         self.result = MatchResult.INVALID
         self.user = None
         self.message = None
         self.botSettings = botSettings
 
+        # Stable ids let the buttons on an existing message find this view again after a restart
+        self.CallForBlue.custom_id = 'match_result:{}:blue'.format(matchID)
+        self.CallForOrange.custom_id = 'match_result:{}:orange'.format(matchID)
+        self.CancelMatch.custom_id = 'match_result:{}:cancel'.format(matchID)
+
     async def UpdateView(self, interaction:discord.Interaction, button:discord.ui.Button):
         for child in self.children:
             if child is not button:
@@ -242,191 +251,583 @@ class MatchResultView(discord.ui.View):
         self.result = MatchResult.CANCELLED
         self.user = None
 
+class Lobby(object):
+    """A queue that fills up into its own matches. Every lobby's queue and forced map are independent of the others"""
+    __slots__ = ('name', 'size', 'queuedPlayers', 'queuedPlayersByID', 'forcedMap', 'matchmaking')
+
+    def __init__(self, name:str, size:int = 10):
+        self.name = name
+        self.size = size
+        # Type: Array<QueuedPlayer> in the order they joined
+        self.queuedPlayers = []
+        # Type: Dictionary<key=int user id, value=QueuedPlayer>
+        self.queuedPlayersByID = {}
+        self.forcedMap = None
+        # When set, matches are made from the closest MMRs in the queue instead of the first players to join
+        self.matchmaking = None # MatchmakingQueue
+
+    def __len__(self):
+        return len(self.queuedPlayers)
+
+    def IsMatchmaking(self):
+        return self.matchmaking is not None
+
+    def GetMatchPlayers(self, force:bool = False):
+        """Returns the players the next match would be made from, or None if there isn't a match ready yet.
+           Forcing ignores the MMR window and returns everyone queued if there aren't enough players.
+        """
+        if (self.matchmaking is None):
+            if (force or self.IsFull()):
+                return self.queuedPlayers[:self.size]
+            return None
+
+        ids = self.matchmaking.FindMatch(self.size, ignoreWindow=force)
+
+        if (ids is None):
+            return list(self.queuedPlayers) if force else None
+
+        return [self.queuedPlayersByID[id] for id in ids]
+
+    def IsFull(self):
+        if (self.matchmaking is None):
+            return len(self.queuedPlayers) >= self.size
+
+        return self.GetMatchPlayers() is not None
+
+    def FormatCount(self):
+        # Matchmaking lobbies can hold more players than a single match needs
+        if (self.matchmaking is not None):
+            return '{} queued'.format(len(self.queuedPlayers))
+
+        return '{}/{}'.format(len(self.queuedPlayers), self.size)
+
+    def IsEmpty(self):
+        return len(self.queuedPlayers) == 0
+
 class MatchService(object):
-    queuedPlayers = []
+    defaultLobbyName = 'default'
+    lobbies = {}
+    playerLobbies = {}
     matchesStarted = {}
+    playerMatchIDs = {}
     bot = None
     botSettings = None
-    forcedMap = None
+    stratRouletteService = None
     lastMatchResult = None
+    roleUpdateSemaphore = None
+    backgroundTasks = set()
+    stateDirty = False
+    stateRestored = False
 
-    def Init(self, bot, botSettings):
+    def Init(self, bot, botSettings, stratRouletteService):
         self.bot = bot
         self.botSettings = botSettings
+        self.stratRouletteService = stratRouletteService
+        self.botSettings.SetPlayerPinnedCheck(self.IsPlayerActive)
+        self.roleUpdateSemaphore = asyncio.Semaphore(5)
+        self.backgroundTasks = set()
+        self.stateDirty = False
+        self.stateRestored = False
+
+        # Type: Dictionary<key=string lower case lobby name, value=Lobby>
+        self.lobbies = {}
+        self.lobbies[self.defaultLobbyName] = Lobby(self.defaultLobbyName)
+        # Type: Dictionary<key=int user id, value=string lower case lobby name>
+        self.playerLobbies = {}
+        # Type: Dictionary<key=int match id, value=Match>
+        self.matchesStarted = {}
+        # Type: Dictionary<key=int user id, value=int match id>
+        self.playerMatchIDs = {}
+
+    def _MarkStateDirty(self):
+        """Queues a snapshot of the lobbies and matches. Changes made in the same step of the event loop share one write"""
+        if (self.stateDirty):
+            return
+
+        self.stateDirty = True
+
+        # Run outside of any write batch the caller is in, that batch will be gone by the time this runs
+        asyncio.get_running_loop().call_soon(self._SaveState, context=contextvars.Context())
+
+    def _SaveState(self):
+        self.stateDirty = False
+
+        lobbies = []
+        for lobby in self.lobbies.values():
+            matchmaking = None
+            if (lobby.matchmaking is not None):
+                window = lobby.matchmaking.window
+                matchmaking = { 'baseWindow': window.baseWindow, 'widenPerMinute': window.widenPerMinute, 'maxWindow': window.maxWindow }
+
+            players = [{ 'id': player.user.id, 'mmr': player.mmr, 'queueTime': player.queueTime } for player in lobby.queuedPlayers]
+            lobbies.append({ 'name': lobby.name, 'size': lobby.size, 'forcedMap': lobby.forcedMap, 'matchmaking': matchmaking, 'players': players })
+
+        def GetMessageData(message):
+            return None if message is None else { 'channel': message.channel.id, 'id': message.id }
+
+        matches = []
+        for match in self.matchesStarted.values():
+            matches.append({
+                'id': match.uniqueID,
+                'map': match.map,
+                'pool': match.pool,
+                'creationTime': match.creationTime,
+                'team1': [{ 'id': player.user.id, 'mmr': player.mmr } for player in match.team1],
+                'team2': [{ 'id': player.user.id, 'mmr': player.mmr } for player in match.team2],
+                'matchMessage': GetMessageData(match.matchMessage),
+                'adminMessage': GetMessageData(match.adminMessage),
+            })
+
+        MatchServiceStateData.Store(lobbies, matches)
+
+    async def _RestoreUser(self, id:int):
+        if (id < 0):
+            return FakeUser(id)
+
+        member = self.botSettings.guild.get_member(id)
+
+        if (member is None):
+            try:
+                member = await self.botSettings.guild.fetch_member(id)
+            except discord.HTTPException:
+                return None
+
+        return member
+
+    async def _RestoreMessage(self, data):
+        if (data is None):
+            return None
+
+        channel = self.bot.get_channel(data['channel'])
+
+        if (channel is None):
+            return None
+
+        try:
+            return await channel.fetch_message(data['id'])
+        except discord.HTTPException:
+            return None
+
+    def _GetRecordedMatchIDs(self, ids):
+        # Which of the matches already have their result in the match history
+        return set(match._matchUniqueID for match in MatchHistoryData.objects(_matchUniqueID__in=ids).only('_matchUniqueID'))
+
+    async def RestoreState(self):
+        """Brings back the queues and running matches from before the bot restarted. Call once the bot settings are ready"""
+        # on_ready fires again on reconnects, by then everything in memory is newer than the snapshot
+        if (self.stateRestored):
+            return
+
+        self.stateRestored = True
+        state = await persistenceService.Read(MatchServiceStateData.Load)
+
+        if (state is None or self.botSettings.guild is None):
+            return
+
+        for data in state._lobbies:
+            lobby = self.lobbies.get(data['name'].lower())
+            if (lobby is None):
+                lobby = self.AddLobby(data['name'], data['size'])
+
+            lobby.size = data['size']
+            lobby.forcedMap = data.get('forcedMap')
+
+            if (data.get('matchmaking') is not None):
+                self.SetLobbyMatchmaking(lobby.name, MatchmakingWindow(**data['matchmaking']))
+
+            for playerData in data['players']:
+                user = await self._RestoreUser(playerData['id'])
+
+                # People who left the server or are already back in a queue lose their spot
+                if (user is None or self.IsPlayerQueued(user) or user.id in self.playerMatchIDs):
+                    continue
+
+                player = QueuedPlayer(user, playerData['mmr'])
+                player.queueTime = playerData['queueTime']
+                self._AddQueuedPlayer(lobby, player)
+
+        restoredMatches = 0
+        recordedIDs = await persistenceService.Read(self._GetRecordedMatchIDs, [data['id'] for data in state._matches])
+
+        for data in state._matches:
+            id = data['id']
+
+            # The result was stored but the bot went down before the snapshot caught up
+            if (id in self.matchesStarted or id in recordedIDs):
+                continue
+
+            teams = []
+            for teamData in [data['team1'], data['team2']]:
+                team = []
+                for playerData in teamData:
+                    user = await self._RestoreUser(playerData['id'])
+                    if (user is not None):
+                        team.append(QueuedPlayer(user, playerData['mmr']))
+                teams.append(team)
+
+            match = Match(id, teams[0] + teams[1], data['map'], data['pool'], data['creationTime'])
+            match.team1, match.team2 = teams
+            match.matchMessage = await self._RestoreMessage(data['matchMessage'])
+            match.adminMessage = await self._RestoreMessage(data['adminMessage'])
+
+            self._AddMatch(match)
+
+            # Whatever was left of the original timeout still applies, it just can't be tracked by the view anymore
+            remaining = MatchResultView.defaultTimeout - (datetime.now() - match.creationTime).total_seconds()
+
+            match.resultsView = MatchResultView(self.botSettings, id, timeout=None)
+            match.resultsView.message = match.adminMessage
+
+            if (match.adminMessage is not None):
+                self.bot.add_view(match.resultsView, message_id=match.adminMessage.id)
+
+            task = asyncio.create_task(self.WaitForMatchResult(id, timeout=max(0.0, remaining)))
+            self.backgroundTasks.add(task)
+            task.add_done_callback(self.backgroundTasks.discard)
+
+            restoredMatches += 1
+
+        # Their results will need the full player data, load it now rather than in the middle of calling the match
+        await self.botSettings.LoadPlayers(list(self.playerLobbies.keys()) + list(self.playerMatchIDs.keys()))
+
+        print('Restored {} queued players and {} matches'.format(len(self.playerLobbies), restoredMatches))
+
+    def GetLobby(self, name:str = None):
+        """Returns the lobby with the given name, or the default lobby if no name is given"""
+        key = self.defaultLobbyName if name is None or name == '' else name.lower()
+
+        if (key not in self.lobbies):
+            raise InvalidLobby(name)
+
+        return self.lobbies[key]
+
+    def GetSortedLobbies(self):
+        return sorted(self.lobbies.values(), key=lambda lobby : lobby.name.lower())
+
+    def DoesLobbyExist(self, name:str):
+        return name.lower() in self.lobbies
+
+    def AddLobby(self, name:str, size:int = 10):
+        if (self.DoesLobbyExist(name)):
+            raise LobbyExists(name)
+
+        lobby = Lobby(name, size)
+        self.lobbies[name.lower()] = lobby
+        self._MarkStateDirty()
+        return lobby
+
+    def RemoveLobby(self, name:str):
+        lobby = self.GetLobby(name)
+
+        # There always needs to be somewhere to queue
+        if (lobby.name.lower() == self.defaultLobbyName):
+            raise CantRemoveDefaultLobby()
+
+        if (not lobby.IsEmpty()):
+            raise LobbyNotEmpty(lobby.name)
+
+        del self.lobbies[lobby.name.lower()]
+        self._MarkStateDirty()
+
+    def SetLobbyMatchmaking(self, name:str, window:MatchmakingWindow = None):
+        """Switches a lobby to MMR matchmaking with the given window, or back to first come first served if window is None"""
+        lobby = self.GetLobby(name)
+
+        lobby.matchmaking = None if window is None else MatchmakingQueue(window)
+
+        if (lobby.matchmaking is not None):
+            for player in lobby.queuedPlayers:
+                lobby.matchmaking.Add(player.user.id, player.mmr, player.queueTime)
+
+        self._MarkStateDirty()
+        return lobby
+
+    def GetReadyLobbies(self):
+        """Returns the lobbies that can start a match now. MMR windows widen as players wait, so this can change without anyone joining"""
+        return [lobby for lobby in self.lobbies.values() if lobby.IsFull()]
+
+    def GetPlayerLobby(self, user:discord.User):
+        """Returns the lobby the player is queued in, or None if they aren't queued"""
+        key = self.playerLobbies.get(user.id)
+        return None if key is None else self.lobbies[key]
+
+    def GetLobbyTitle(self, lobby:Lobby):
+        # Only call out the lobby by name once there's more than one to pick from
+        if (len(self.lobbies) > 1):
+            return 'Lobby {} [{}]'.format(lobby.name, lobby.FormatCount())
+
+        return 'Lobby [{}]'.format(lobby.FormatCount())
+
+    def _ResolveMatchID(self, id:int = None):
+        """Returns the id of the match to act on. Without an id this only works when exactly one match is running"""
+        if (id is not None):
+            if (id not in self.matchesStarted):
+                raise InvalidMatchID(id)
+
+            return id
+
+        if (len(self.matchesStarted) == 0):
+            return None
+
+        if (len(self.matchesStarted) > 1):
+            raise MatchIDRequired()
+
+        return next(iter(self.matchesStarted))
+
+    # The queue and match indexes must only be changed through these so they stay in sync
+
+    def _AddQueuedPlayer(self, lobby:Lobby, player:QueuedPlayer):
+        lobby.queuedPlayers.append(player)
+        lobby.queuedPlayersByID[player.user.id] = player
+        self.playerLobbies[player.user.id] = lobby.name.lower()
+
+        if (lobby.matchmaking is not None):
+            lobby.matchmaking.Add(player.user.id, player.mmr, player.queueTime)
+
+        self._MarkStateDirty()
+
+    def _RemoveQueuedPlayer(self, userID:int):
+        """Returns the removed QueuedPlayer and the lobby they were in, or (None, None) if they weren't queued"""
+        key = self.playerLobbies.pop(userID, None)
+
+        if (key is None):
+            return None, None
+
+        lobby = self.lobbies[key]
+        player = lobby.queuedPlayersByID.pop(userID)
+
+        if (lobby.matchmaking is not None):
+            lobby.matchmaking.Remove(userID)
+
+        # QueuedPlayer compares against users, so find it by identity
+        for i in range(len(lobby.queuedPlayers)):
+            if (lobby.queuedPlayers[i] is player):
+                lobby.queuedPlayers.pop(i)
+                break
+
+        self._MarkStateDirty()
+        return player, lobby
+
+    def _ClearQueuedPlayers(self, lobby:Lobby):
+        for player in lobby.queuedPlayers:
+            self.playerLobbies.pop(player.user.id, None)
+
+        lobby.queuedPlayers.clear()
+        lobby.queuedPlayersByID.clear()
+
+        if (lobby.matchmaking is not None):
+            lobby.matchmaking = MatchmakingQueue(lobby.matchmaking.window)
+
+        self._MarkStateDirty()
+
+    def _AddMatch(self, match:Match):
+        self.matchesStarted[match.uniqueID] = match
+
+        for player in match.players:
+            self.playerMatchIDs[player.user.id] = match.uniqueID
+
+        self._MarkStateDirty()
+
+    def _RemoveMatch(self, id:int):
+        match = self.matchesStarted.pop(id)
+
+        for player in match.players:
+            if (self.playerMatchIDs.get(player.user.id) == id):
+                del self.playerMatchIDs[player.user.id]
+
+        self._MarkStateDirty()
+        return match
 
     def GetNotInQueue(self, members):
         missing = []
 
         for memberID in members.keys():
-            found = False
-            for player in self.queuedPlayers:
-                if player.user.id == memberID:
-                    found = True
-
-            if (not found):
+            if (memberID not in self.playerLobbies):
                 missing.append(memberID)
 
         return missing
 
-    def IsQueueFull(self):
-        return len(self.queuedPlayers) == 10
+    def IsQueueFull(self, lobbyName:str = None):
+        return self.GetLobby(lobbyName).IsFull()
 
-    async def JoinQueue(self, interaction:discord.Interaction, user:discord.Member):
-        mmr = self.botSettings.GetMMR(user)
+    async def JoinQueue(self, interaction:discord.Interaction, user:discord.Member, lobbyName:str = None):
+        lobby = self.GetLobby(lobbyName)
 
-        self.queuedPlayers.append(QueuedPlayer(user, mmr))
+        # Queued players stay cached until their match is called, so the result never has to load them
+        await self.botSettings.LoadPlayers([user.id])
+        mmr = self.botSettings.GetMMR(user)
 
-        numPlayers = len(self.queuedPlayers)
+        self._AddQueuedPlayer(lobby, QueuedPlayer(user, mmr))
 
-        if (numPlayers == 10):
+        if (lobby.IsFull()):
             description = '{0.mention} [{1}] joined the queue.\nThe queue is now full, starting a match...'.format(user, mmr)
         else:
-            description = '**[{0}/10]** {1.mention} [{2}] joined the queue.'.format(numPlayers, user, mmr)
-        
+            description = '**[{0}]** {1.mention} [{2}] joined the queue.'.format(lobby.FormatCount(), user, mmr)
+
+        if (len(self.lobbies) > 1):
+            description = '**{}** {}'.format(lobby.name, description)
+
         await SendMessage(interaction, description=description, color=discord.Color.blue())
 
     async def LeaveQueue(self, interaction:discord.Interaction, user:discord.Member, extraClearMessage = ''):
-        mmr = 0
-        for i in range(len(self.queuedPlayers)):
-            if (self.queuedPlayers[i] == user):
-                mmr = self.queuedPlayers[i].mmr
-                self.queuedPlayers.pop(i)
-                break
+        player, lobby = self._RemoveQueuedPlayer(user.id)
 
-        numPlayers = len(self.queuedPlayers)
+        if (player is None):
+            raise PlayerNotQueued(user)
 
-        if (numPlayers == 0):
+        mmr = player.mmr
+
+        if (lobby.IsEmpty()):
             description = '{0.mention} [{1}] left the queue.\nThe queue is now empty.{2}'.format(user, mmr, extraClearMessage)
-            self.forcedMap = None
+            lobby.forcedMap = None
         else:
-            description = '**[{0}/10]** {1.mention} [{2}] left the queue.'.format(numPlayers, user, mmr)
+            description = '**[{0}]** {1.mention} [{2}] left the queue.'.format(lobby.FormatCount(), user, mmr)
+
+        if (len(self.lobbies) > 1):
+            description = '**{}** {}'.format(lobby.name, description)
 
         await SendMessage(interaction, description=description, color=discord.Color.blue())
 
-    async def ShowQueue(self, interaction:discord.Interaction):
-        numPlayers = len(self.queuedPlayers)
+    async def ShowQueue(self, interaction:discord.Interaction, lobbyName:str = None):
+        lobby = self.GetLobby(lobbyName)
 
-        if (numPlayers == 0):
+        if (lobby.IsEmpty()):
             description = 'The queue is empty.'
+            if (len(self.lobbies) > 1):
+                description = '**{}** {}'.format(lobby.name, description)
             await SendMessage(interaction, description=description, color=discord.Color.blue())
         else:
-            title = 'Lobby [{0}/10]'.format(numPlayers)
+            title = self.GetLobbyTitle(lobby)
             description = ''
             isFirst = True
 
-            for player in self.queuedPlayers:
+            for player in lobby.queuedPlayers:
                 if (isFirst):
                     isFirst = False
                 else:
                     description += '\n'
 
-                description += '[{1}] {0.mention}'.format(player.user, player.mmr)
+                description += '[{1}] {0.mention} {2}'.format(player.user, player.mmr, self.botSettings.GetLeaderboardDescription(player.user))
 
             await SendMessage(interaction, title=title, description=description, color=discord.Color.blue())
 
-    def ClearQueue(self):
-        self.queuedPlayers.clear()
-        self.forcedMap = None
+    def ClearQueue(self, lobbyName:str = None):
+        lobby = self.GetLobby(lobbyName)
+        self._ClearQueuedPlayers(lobby)
+        lobby.forcedMap = None
 
     async def KickFromQueue(self, interaction:discord.Interaction, user:discord.Member):
         mmr = 0
-        found = False
-        for i in range(len(self.queuedPlayers)):
-            if (self.queuedPlayers[i] == user):
-                mmr = self.queuedPlayers[i].mmr
-                self.queuedPlayers.pop(i)
-                found = True
-                break
+        player, lobby = self._RemoveQueuedPlayer(user.id)
+        found = player is not None
 
-        numPlayers = len(self.queuedPlayers)
+        if (found):
+            mmr = player.mmr
 
         if (found == False):
             description = '{0.mention} is not in the queue.'.format(user)
-        elif (numPlayers == 0):
+        elif (lobby.IsEmpty()):
             description = '{0.mention} [{1}] was removed from the queue by {2.mention}.\nThe queue is now empty.'.format(user, mmr, interaction.user)
-            self.forcedMap = None
+            lobby.forcedMap = None
         else:
-            description = '**[{0}/10]** {1.mention} [{2}] was removed from the queue by {3.mention}.'.format(numPlayers, user, mmr, interaction.user)
+            description = '**[{0}]** {1.mention} [{2}] was removed from the queue by {3.mention}.'.format(lobby.FormatCount(), user, mmr, interaction.user)
 
         await SendMessage(interaction, description=description, color=discord.Color.blue())
 
     async def SwapPlayers(self, interaction:discord.Interaction, user1, user2):
+        await self.botSettings.LoadPlayers([user1.id, user2.id])
+
         # Figure out who is in queue and who is in a match first
         queuedPlayer = None
         matchPlayer = None
         matchID = -1
 
         # Find the queued player
-        for player in self.queuedPlayers:
-            if (player == user1 or player == user2):
-                queuedPlayer = player
+        for user in [user1, user2]:
+            lobby = self.GetPlayerLobby(user)
+            if (lobby is not None):
+                queuedPlayer = lobby.queuedPlayersByID[user.id]
                 break
 
         # Find the match player
-        for match in self.matchesStarted.values():
-            if (match.IsPlayerInMatch(user1)):
-                matchPlayer = user1
-                matchID = match.uniqueID
-                break
-            elif (match.IsPlayerInMatch(user2)):
-                matchPlayer = user2
-                matchID = match.uniqueID
-                break
+        if (user1.id in self.playerMatchIDs):
+            matchPlayer = user1
+            matchID = self.playerMatchIDs[user1.id]
+        elif (user2.id in self.playerMatchIDs):
+            matchPlayer = user2
+            matchID = self.playerMatchIDs[user2.id]
 
         if (queuedPlayer == None or matchPlayer == None or matchID == -1):
             raise PlayerSwapFailed(user1, user2)
 
         # Remove the queued player
-        mmr = 0
-        for i in range(len(self.queuedPlayers)):
-            if (self.queuedPlayers[i] == queuedPlayer.user):
-                mmr = self.queuedPlayers[i].mmr
-                self.queuedPlayers.pop(i)
-                break
+        _, lobby = self._RemoveQueuedPlayer(queuedPlayer.user.id)
 
         # Remove the match player
         self.matchesStarted[matchID].RemovePlayer(matchPlayer)
+        del self.playerMatchIDs[matchPlayer.id]
 
-        # Add match player to queue
+        # Add match player to the queue the other player left
         tempMMR = self.botSettings.GetMMR(matchPlayer)
-        self.queuedPlayers.append(QueuedPlayer(matchPlayer, tempMMR))
+        self._AddQueuedPlayer(lobby, QueuedPlayer(matchPlayer, tempMMR))
 
         # Add queued player to match
         self.matchesStarted[matchID].AddPlayer(queuedPlayer)
+        self.playerMatchIDs[queuedPlayer.user.id] = matchID
 
         self.matchesStarted[matchID].BalanceTeams()
+        self._MarkStateDirty()
 
         await SendMessage(interaction, description='{0.mention} has been swapped with {1.mention}!'.format(queuedPlayer.user, matchPlayer), color=discord.Color.blue())
         await self.SendMatchMessages(self.matchesStarted[matchID])
 
+        return matchID
+
     def UpdateMMR(self, user:discord.Member, mmr:int):
-        for player in self.queuedPlayers:
-            if (player == user):
-                player.mmr = mmr
-                break;
+        lobby = self.GetPlayerLobby(user)
+        if (lobby is not None):
+            lobby.queuedPlayersByID[user.id].mmr = mmr
 
-    async def ForceMap(self, interaction:discord.Interaction, map):
-        if (len(self.matchesStarted) > 0):
-            key = list(self.matchesStarted.keys())[0]
+            if (lobby.matchmaking is not None):
+                lobby.matchmaking.Update(user.id, mmr)
+
+            self._MarkStateDirty()
+
+    async def ForceMap(self, interaction:discord.Interaction, map, id:int = None, lobbyName:str = None):
+        # Naming a lobby always means its next match, otherwise prefer the match that's already running
+        key = None
+        if (lobbyName is None):
+            key = self._ResolveMatchID(id)
+
+        if (key is not None):
             self.matchesStarted[key].map = map
+            self._MarkStateDirty()
 
             await SendMessage(interaction, description='The map for Game #{} has been changed to {}.'.format(key, map), color=discord.Color.blue())
 
             # Send an updated message
             await self.SendMatchMessages(self.matchesStarted[key])
+            return
+
+        lobby = self.GetLobby(lobbyName)
 
-        elif (len(self.queuedPlayers) > 0):
-            self.forcedMap = map
+        if (not lobby.IsEmpty()):
+            lobby.forcedMap = map
+            self._MarkStateDirty()
             await SendMessage(interaction, description='The next map will be {}.'.format(map), color=discord.Color.blue())
         else:
             await SendMessage(interaction, description='You can only force a map when there is a match running or players in the queue.', color=discord.Color.red())
 
-    def IsMatchInProgress(self):
+    def IsMatchInProgress(self, id:int = None):
+        if (id is not None):
+            return id in self.matchesStarted
+
         return len(self.matchesStarted) > 0
 
-    async def ForceMapPool(self, interaction:discord.Interaction, pool:str, useInteraction = True):
-        key = list(self.matchesStarted.keys())[0]
+    async def ForceMapPool(self, interaction:discord.Interaction, pool:str, useInteraction = True, id:int = None):
+        key = self._ResolveMatchID(id)
         self.matchesStarted[key].pool = pool 
+        self._MarkStateDirty()
 
         selectedMap = self.matchesStarted[key].map
 
@@ -438,7 +839,7 @@ class MatchService(object):
                 await SendMessage(interaction, description=description, color=discord.Color.blue())
             else:
                 await SendChannelMessage(interaction.channel, description=description, color=discord.Color.blue())
-            await self.RerollMap(interaction, useInteraction=False)
+            await self.RerollMap(interaction, useInteraction=False, id=key)
             return
 
         description = 'The map pool for Game #{} has been changed to {}.'.format(key, pool)
@@ -450,8 +851,8 @@ class MatchService(object):
         # Send an updated message
         await self.SendMatchMessages(self.matchesStarted[key])
 
-    async def RerollMap(self, interaction:discord.Interaction, useInteraction:bool):
-        key = list(self.matchesStarted.keys())[0]
+    async def RerollMap(self, interaction:discord.Interaction, useInteraction:bool, id:int = None):
+        key = self._ResolveMatchID(id)
 
         enablePMCCOverride = False
 
@@ -463,6 +864,7 @@ class MatchService(object):
         selectedMap = self.botSettings.GetRandomMap(self.matchesStarted[key].pool, enablePMCCOverride).name
 
         self.matchesStarted[key].map = selectedMap 
+        self._MarkStateDirty()
 
         description = 'The map for Game #{} has been changed to {}.'.format(key, selectedMap)
 
@@ -476,7 +878,7 @@ class MatchService(object):
 
     async def SendMatchMessages(self, match, sendNewMessages = False):
         title = 'Game #{} Started'.format(match.uniqueID)
-        description = '**Creation Time:** {}\n**Map:** {}\n**Map Pool:** {}'.format(match.creationTime, match.map, 'None' if match.pool is None else match.pool)
+        description = '**Creation Time:** {}\n**Map:** {}\n**Map Pool:** {}'.format(FormatCreationTime(match.creationTime), match.map, 'None' if match.pool is None else match.pool)
         thumbnail = self.botSettings.GetMapThumbnail(match.map)
 
         team1Field = {}
@@ -546,54 +948,106 @@ class MatchService(object):
             except:
                 pass
 
-    def PrepareMatch(self, fillWithFakePlayers:bool, forcedPool:str = ''):
-        if (fillWithFakePlayers and len(self.queuedPlayers) < 10):
-            # Use negative ids so that we know its fake
-            fakeID = -1
-            while (len(self.queuedPlayers) < 10):
-                self.queuedPlayers.append(QueuedPlayer(FakeUser(fakeID), 100))
+    async def PrepareMatch(self, fillWithFakePlayers:bool, forcedPool:str = '', lobbyName:str = None):
+        lobby = self.GetLobby(lobbyName)
+
+        # Get the id before looking at the queue, nothing else can take these players once we've picked them
+        id = await self.botSettings.GetNextUniqueMatchID()
+        players = lobby.GetMatchPlayers(force=True)
+
+        if (fillWithFakePlayers and len(players) < lobby.size):
+            # Use negative ids so that we know its fake. Start below any fakes already playing so the ids don't collide
+            fakeID = min([-1] + [userID - 1 for userID in self.playerMatchIDs if userID < 0])
+            while (len(players) < lobby.size):
+                players.append(QueuedPlayer(FakeUser(fakeID), 100))
                 fakeID -= 1
 
         # Check for PMCC override
         enablePMCCOverride = False
 
-        for player in self.queuedPlayers:
+        for player in players:
             if (player.user.id == int('90342358620573696')):
                 enablePMCCOverride = True
                 break
 
-        id = self.botSettings.GetNextUniqueMatchID()
         selectedPool = self.botSettings.currentPool if forcedPool == '' else forcedPool
         selectedMap = self.botSettings.GetRandomMap(selectedPool, enablePMCCOverride).name
-        creationTime = datetime.strftime(datetime.now(), '%d %b %Y %H:%M')
+        creationTime = datetime.now()
 
-        if (self.forcedMap is not None):
-            selectedMap = self.forcedMap
-            self.forcedMap = None
+        if (lobby.forcedMap is not None):
+            selectedMap = lobby.forcedMap
+            lobby.forcedMap = None
 
-        newMatch = Match(id, self.queuedPlayers, selectedMap, selectedPool, creationTime)
-        self.matchesStarted[id] = newMatch
-        self.queuedPlayers.clear()
+        newMatch = Match(id, players, selectedMap, selectedPool, creationTime)
+        self._AddMatch(newMatch)
+
+        # Anyone who didn't make it into the match keeps their place in the queue
+        if (len(players) >= len(lobby)):
+            self._ClearQueuedPlayers(lobby)
+        else:
+            for player in players:
+                self._RemoveQueuedPlayer(player.user.id)
 
         newMatch.BalanceTeams()
         return id
 
+    async def RunMatch(self, id):
+        """Starts a prepared match and waits for its result"""
+        # Early out for the simple case where we only have to start a match
+        if (not self.stratRouletteService.IsMatchQueued()):
+            result = await self.StartMatch(id)
+
+            # If a strat roulette match was started afterwards, we should make sure to stop it
+            if (self.stratRouletteService.IsMatchInProgress()):
+                await self.stratRouletteService.StopMatch(id, result)
+            return
+
+        # If we need to start a match and a strat roulette match, do some task scheduling
+        matchServiceTask = asyncio.create_task(
+            self.StartMatch(id)
+        )
+
+        stratRouletteServiceTask = asyncio.create_task(
+            self.stratRouletteService.TryStartQueuedMatch(self.GetTeam1Players(id), self.GetTeam2Players(id))
+        )
+
+        await matchServiceTask
+        lastMatchResult = self.GetLastMatchResult()
+        matchResult = MatchResult.INVALID
+
+        if (lastMatchResult is not None and lastMatchResult[0] == id):
+            matchResult = lastMatchResult[1]
+
+        await self.stratRouletteService.StopMatch(id, matchResult)
+        await stratRouletteServiceTask
+
     async def StartMatch(self, id):
         newMatch = self.matchesStarted[id]
-        newMatch.resultsView = MatchResultView(self.botSettings)
+        newMatch.resultsView = MatchResultView(self.botSettings, id)
     
         message, adminMessage = await self.SendMatchMessages(newMatch, sendNewMessages=True)
         
         newMatch.matchMessage = message
         newMatch.adminMessage = adminMessage 
+        self._MarkStateDirty()
 
         return await self.WaitForMatchResult(id)
 
-    async def WaitForMatchResult(self, id):
+    async def WaitForMatchResult(self, id, timeout:float = None):
+        """timeout is only needed for views without one of their own (ie. ones restored after a restart)"""
         view = self.matchesStarted[id].resultsView
         # Wait for an admin to report the results
         try:
-            timedOut = await view.wait()
+            if (timeout is None):
+                timedOut = await view.wait()
+            else:
+                timedOut = False
+                try:
+                    await asyncio.wait_for(view.wait(), timeout)
+                except asyncio.TimeoutError:
+                    await view.on_timeout()
+                    view.stop()
+                    timedOut = True
         except:
             print('Something has gone very wrong here')
             return MatchResult.INVALID
@@ -613,22 +1067,46 @@ class MatchService(object):
 
     # Union[discord.Member, FakeUser] member 
     async def UpdateRoles(self, member, oldRole, newRole):
+        failures = []
+
         if (isinstance(member, FakeUser)):
+            return failures
+
+        # Bound how many role requests we have in flight so we stay within the guild's rate limits
+        async with self.roleUpdateSemaphore:
+            if (oldRole is not None):
+                try:
+                    await member.remove_roles(oldRole.role, reason='Match service is updating MMR Role for {}'.format(member))
+                except discord.HTTPException:
+                    failures.append('Failed to remove previous rank {0.mention} from {1.mention}.'.format(oldRole.role, member))
+
+            if (newRole is not None):
+                try:
+                    await member.add_roles(newRole.role, reason='Match service is updating MMR Role for {}'.format(member))
+                except discord.HTTPException:
+                    failures.append('Failed to add new rank {0.mention} to {1.mention}.'.format(newRole.role, member))
+
+        return failures
+
+    async def ApplyRoleUpdates(self, roleUpdates):
+        results = await asyncio.gather(*[ self.UpdateRoles(member, oldRole, newRole) for member, oldRole, newRole in roleUpdates ])
+        failures = [ failure for result in results for failure in result ]
+
+        if (len(failures) > 0):
+            description = '{}\nPlease try again.'.format('\n'.join(failures))
+            await SendChannelMessage(self.botSettings.resultsChannel, title='Failed to update some ranks', description=description, color=discord.Color.red())
+
+    def ApplyRoleUpdatesInBackground(self, roleUpdates):
+        if (len(roleUpdates) == 0):
             return
 
-        if (oldRole is not None):
-            try:
-                await member.remove_roles(oldRole.role, reason='Match service is updating MMR Role for {}'.format(member))
-            except discord.HTTPException:
-                await SendChannelMessage(self.botSettings.resultsChannel, description='Failed to remove previous rank. Please try again.', color=discord.Color.red())
+        task = asyncio.create_task(self.ApplyRoleUpdates(roleUpdates))
 
-        if (newRole is not None):
-            try:
-                await member.add_roles(newRole.role, reason='Match service is updating MMR Role for {}'.format(member))
-            except discord.HTTPException:
-                await SendChannelMessage(self.botSettings.resultsChannel, description='Failed to add new rank. Please try again.', color=discord.Color.red())
+        # Hold onto the task so it doesn't get garbage collected before it finishes
+        self.backgroundTasks.add(task)
+        task.add_done_callback(self.backgroundTasks.discard)
 
-    async def GetTeamData(self, team, teamName, result:TeamResult):
+    def GetTeamData(self, team, teamName, result:TeamResult, roleUpdates):
         teamData = []
         teamField = {}
         teamField['name'] = '{}: Team {}'.format('Winner' if result == TeamResult.WIN else 'Loser', teamName)
@@ -668,8 +1146,8 @@ class MatchService(object):
                     teamField['value'] += ' **Rank:** {0.mention} -> {1.mention}'.format(oldRole.role, newRole.role)
 
                 # No point in updating roles if the match was cancelled
-                if (result != TeamResult.CANCEL):
-                    await self.UpdateRoles(player.user, oldRole, newRole)
+                if (result != TeamResult.CANCEL and (oldRole is not None or newRole is not None)):
+                    roleUpdates.append((player.user, oldRole, newRole))
         else:
             teamField['value'] = 'Empty'
 
@@ -685,85 +1163,81 @@ class MatchService(object):
 
         title = 'Match Results: Game #{}'.format(id)
         footer = 'This match was called by {}'.format(user)
-        description = '**Creation Time:** {}\n**Map:** {}\n**Map Pool:** {}'.format(self.matchesStarted[id].creationTime, self.matchesStarted[id].map, 'None' if self.matchesStarted[id].pool is None else self.matchesStarted[id].pool)
+        description = '**Creation Time:** {}\n**Map:** {}\n**Map Pool:** {}'.format(FormatCreationTime(self.matchesStarted[id].creationTime), self.matchesStarted[id].map, 'None' if self.matchesStarted[id].pool is None else self.matchesStarted[id].pool)
         thumbnail = self.botSettings.GetMapThumbnail(self.matchesStarted[id].map)
 
         winnerTeam, winnerName, loserTeam, loserName = self.matchesStarted[id].GetTeamAndNames(matchResult)
 
+        # Everyone has to be loaded before the batch, and before _RemoveMatch lets them drop out of the cache
+        await self.botSettings.LoadPlayers([player.user.id for player in winnerTeam + loserTeam])
         await self.bot.change_presence(activity=None)
 
         if (matchResult == MatchResult.CANCELLED):
             description += '\n\nThis match has been cancelled.'
 
-            team1Data, team1Field = await self.GetTeamData(winnerTeam, winnerName, TeamResult.CANCEL)
-            team2Data, team2Field = await self.GetTeamData(loserTeam, loserName, TeamResult.CANCEL)
+            with persistenceService.Batch():
+                team1Data, team1Field = self.GetTeamData(winnerTeam, winnerName, TeamResult.CANCEL, [])
+                team2Data, team2Field = self.GetTeamData(loserTeam, loserName, TeamResult.CANCEL, [])
+
+                self.matchesStarted[id].StoreMatchHistoryData(team1Data, team2Data, matchResult)
 
-            self.matchesStarted[id].StoreMatchHistoryData(team1Data, team2Data, matchResult)
-            del self.matchesStarted[id]
+            self._RemoveMatch(id)
+
+            await persistenceService.Flush()
 
             await SendChannelMessage(self.botSettings.resultsChannel, title=title, description=description, thumbnail=thumbnail, footer=footer, color=discord.Color.blue())
             return matchResult 
 
-        winnerTeamData, winnerField = await self.GetTeamData(winnerTeam, winnerName, TeamResult.WIN)
-        loserTeamData, loserField = await self.GetTeamData(loserTeam, loserName, TeamResult.LOSE)
+        roleUpdates = []
+
+        # Every player, map, pool and history write for this match goes out in a single batch
+        with persistenceService.Batch():
+            winnerTeamData, winnerField = self.GetTeamData(winnerTeam, winnerName, TeamResult.WIN, roleUpdates)
+            loserTeamData, loserField = self.GetTeamData(loserTeam, loserName, TeamResult.LOSE, roleUpdates)
+
+            self.botSettings.DeclareMapPlayed(self.matchesStarted[id].map, self.matchesStarted[id].pool)
 
-        self.botSettings.DeclareMapPlayed(self.matchesStarted[id].map, self.matchesStarted[id].pool)
+            self.matchesStarted[id].StoreMatchHistoryData(winnerTeamData, loserTeamData, matchResult)
 
-        self.matchesStarted[id].StoreMatchHistoryData(winnerTeamData, loserTeamData, matchResult)
-        del self.matchesStarted[id]
+        self._RemoveMatch(id)
+
+        # Make sure the results are stored before we announce them
+        await persistenceService.Flush()
 
         await SendChannelMessage(self.botSettings.resultsChannel, title=title, description=description, thumbnail=thumbnail, fields=[winnerField, loserField], footer=footer, color=discord.Color.blue())
+
+        # Post the results first, the rank changes can catch up afterwards
+        self.ApplyRoleUpdatesInBackground(roleUpdates)
         return matchResult
 
     def IsPlayerQueued(self, user:discord.User):
-        for player in self.queuedPlayers:
-            if player == user:
-                return True
+        return user.id in self.playerLobbies
 
-        return False
+    def IsPlayerActive(self, id:int):
+        """True if the player is queued or in a running match"""
+        return id in self.playerLobbies or id in self.playerMatchIDs
 
-    def IsQueueEmpty(self):
-        return len(self.queuedPlayers) == 0
+    def IsQueueEmpty(self, lobbyName:str = None):
+        return self.GetLobby(lobbyName).IsEmpty()
 
     def IsPlayerInGame(self, user:discord.User):
-        for match in self.matchesStarted.values():
-            if match.IsPlayerInMatch(user):
-                return True
-        return False
+        return user.id in self.playerMatchIDs
 
     def GetTeam1Players(self, id = None):
-        if len(self.matchesStarted) == 0:
-            return []
+        key = self._ResolveMatchID(id) if id is None else id
 
-        if id is not None and id not in self.matchesStarted.keys():
+        if (key not in self.matchesStarted):
             return []
 
-        key = None
-
-        if (id is None):
-            key = list(self.matchesStarted.keys())[0]
-        else:
-            key = id
-
-        match = self.matchesStarted[key]
-        return [ player.user for player in match.team1 ]
+        return [ player.user for player in self.matchesStarted[key].team1 ]
 
     def GetTeam2Players(self, id = None):
-        if len(self.matchesStarted) == 0:
-            return []
+        key = self._ResolveMatchID(id) if id is None else id
 
-        if id is not None and id not in self.matchesStarted.keys():
+        if (key not in self.matchesStarted):
             return []
 
-        key = None
-
-        if (id is None):
-            key = list(self.matchesStarted.keys())[0]
-        else:
-            key = id
-
-        match = self.matchesStarted[key]
-        return [ player.user for player in match.team2 ]
+        return [ player.user for player in self.matchesStarted[key].team2 ]
 
     def GetLastMatchResult(self):
         return self.lastMatchResult
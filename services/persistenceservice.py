@@ -0,0 +1,267 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from mongoengine.connection import get_connection
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+import asyncio
+
+# The batch (if any) that writes from the current task should be added to
+currentBatch = ContextVar('currentBatch', default=None)
+
+class WriteBatch(object):
+    def __init__(self):
+        # Type: Dictionary<key=Document class, value=Array<pymongo write operation>>
+        self.operations = {}
+
+    def AddOperation(self, documentClass, operation):
+        if (documentClass not in self.operations):
+            self.operations[documentClass] = []
+
+        self.operations[documentClass].append(operation)
+
+    def Save(self, document):
+        # Same checks document.save() would have made, it's too late to report them once the worker has the write
+        document.validate()
+
+        # Snapshot the document now so later changes on the event loop don't leak into this batch
+        if (document.pk is None):
+            data = document.to_mongo()
+            data['_id'] = ObjectId()
+            document.pk = data['_id']
+            # Mark it as stored so a later save() updates it instead of inserting it again
+            document._created = False
+            document._clear_changed_fields()
+            self.AddOperation(type(document), InsertOne(data))
+            return
+
+        # Only what changed since it was last written, including fields that were cleared
+        sets, unsets = document._delta()
+        document._clear_changed_fields()
+
+        update = {}
+        if (len(sets) > 0):
+            update['$set'] = sets
+        if (len(unsets) > 0):
+            update['$unset'] = unsets
+
+        if (len(update) > 0):
+            self.AddOperation(type(document), UpdateOne({'_id': document.pk}, update))
+
+    def Delete(self, document):
+        if (document.pk is not None):
+            self.AddOperation(type(document), DeleteOne({'_id': document.pk}))
+
+    def IsEmpty(self):
+        return len(self.operations) == 0
+
+    def Write(self, session=None):
+        # One round-trip per collection instead of one per document
+        for documentClass, operations in self.operations.items():
+            documentClass._get_collection().bulk_write(operations, ordered=True, session=session)
+
+class PersistenceService(object):
+    executor = None
+    pendingWrites = set()
+    # How long usage counters are collected for before they're written
+    counterFlushDelay = 10.0
+    pendingCounters = {}
+    counterFlushHandle = None
+
+    def Init(self):
+        # A single worker guarantees writes hit the database in the order they were queued
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+        self.pendingWrites = set()
+        # Type: Dictionary<key=Document class, value=Dictionary<key=document id, value=Dictionary<key=field name, value=int increment>>>
+        self.pendingCounters = {}
+        self.counterFlushHandle = None
+
+    def Shutdown(self):
+        if (self.executor is None):
+            return
+
+        self.FlushCounters()
+        self.executor.shutdown(wait=True)
+        self.executor = None
+
+    def QueueWrite(self, func, *args, **kwargs):
+        # Write synchronously if the service hasn't been started (ie. one off scripts)
+        if (self.executor is None):
+            func(*args, **kwargs)
+            return None
+
+        future = self.executor.submit(func, *args, **kwargs)
+        self.pendingWrites.add(future)
+        future.add_done_callback(self._OnWriteDone)
+        return future
+
+    def _OnWriteDone(self, future):
+        self.pendingWrites.discard(future)
+
+        if (future.exception() is not None):
+            print('Error: Database write failed: {}'.format(future.exception()))
+
+    def Save(self, document):
+        self._FlushDocumentCounters(document)
+        batch = currentBatch.get()
+
+        if (batch is not None):
+            batch.Save(document)
+            return None
+
+        # Snapshot the document now rather than when the worker gets to it. A later Update clears the changed fields,
+        # so a deferred save() could find nothing left to write
+        batch = WriteBatch()
+        batch.Save(document)
+        return self.Commit(batch)
+
+    def Delete(self, document):
+        # Nothing left to count once it's gone
+        self.pendingCounters.get(type(document), {}).pop(document.pk, None)
+        batch = currentBatch.get()
+
+        if (batch is not None):
+            batch.Delete(document)
+            return None
+
+        return self.QueueWrite(document.delete)
+
+    def Update(self, document, update):
+        """Queues a partial update (ie. { '$inc': { '_wins': 1 } }) of an existing document instead of resending all of it.
+           The caller is expected to have already applied the same change to the document in memory.
+        """
+        # Nothing to update until it has been inserted
+        if (document.pk is None):
+            return self.Save(document)
+
+        self._FlushDocumentCounters(document)
+
+        # These fields are being written now, a later save() doesn't need to send them again
+        document._clear_changed_fields()
+
+        return self.QueueOperation(type(document), UpdateOne({'_id': document.pk}, update))
+
+    def QueueOperation(self, documentClass, operation):
+        """Queues a raw pymongo write (ie. an $inc upsert) against the document class's collection"""
+        batch = currentBatch.get()
+
+        if (batch is not None):
+            batch.AddOperation(documentClass, operation)
+            return None
+
+        return self.QueueWrite(lambda : documentClass._get_collection().bulk_write([operation]))
+
+    def IncrementCounter(self, document, field:str, amount:int = 1):
+        """Adds to a counter that doesn't need to be stored straight away (ie. how often a quip was used).
+           Increments are added up in memory and written as one $inc per document every counterFlushDelay seconds.
+        """
+        if (self.executor is None or document.pk is None):
+            return self.Update(document, { '$inc': { field: amount } })
+
+        counters = self.pendingCounters.setdefault(type(document), {}).setdefault(document.pk, {})
+        counters[field] = counters.get(field, 0) + amount
+
+        if (self.counterFlushHandle is None):
+            self.counterFlushHandle = asyncio.get_running_loop().call_later(self.counterFlushDelay, self.FlushCounters)
+
+        return None
+
+    def _FlushDocumentCounters(self, document):
+        # Buffered increments are already applied in memory. Write them ahead of anything that sends those fields
+        # as absolute values, otherwise the later flush would add them a second time
+        counters = self.pendingCounters.get(type(document), {}).pop(document.pk, None)
+
+        if (counters is not None):
+            self.QueueOperation(type(document), UpdateOne({'_id': document.pk}, {'$inc': counters}))
+
+    def FlushCounters(self):
+        if (self.counterFlushHandle is not None):
+            self.counterFlushHandle.cancel()
+            self.counterFlushHandle = None
+
+        pendingCounters = self.pendingCounters
+        self.pendingCounters = {}
+
+        for documentClass, documents in pendingCounters.items():
+            operations = [UpdateOne({'_id': id}, {'$inc': counters}) for id, counters in documents.items()]
+            self.QueueWrite(documentClass._get_collection().bulk_write, operations, ordered=False)
+
+    @contextmanager
+    def Batch(self):
+        """Collects every Save/Delete made inside the block and writes them together once it exits.
+           If the block raises, nothing in the batch is written.
+        """
+        batch = WriteBatch()
+        token = currentBatch.set(batch)
+
+        try:
+            yield batch
+        finally:
+            currentBatch.reset(token)
+
+        self.Commit(batch)
+
+    def Commit(self, batch:WriteBatch):
+        if (batch.IsEmpty()):
+            return None
+
+        return self.QueueWrite(self._WriteBatch, batch)
+
+    def _WriteBatch(self, batch:WriteBatch):
+        client = get_connection()
+
+        # Transactions are only available on replica sets and sharded clusters
+        if (client.topology_description.topology_type_name not in ('ReplicaSetWithPrimary', 'Sharded')):
+            batch.Write()
+            return
+
+        with client.start_session() as session:
+            session.with_transaction(lambda _session : batch.Write(_session))
+
+    def EnsureIndexes(self, documentClasses):
+        """Creates the indexes each document class declares and reports any that are missing, undeclared or unused"""
+        for documentClass in documentClasses:
+            collectionName = documentClass._get_collection_name()
+
+            try:
+                documentClass.ensure_indexes()
+            except OperationFailure as e:
+                print('Error: Failed to create indexes on {}: {}'.format(collectionName, e))
+
+            comparison = documentClass.compare_indexes()
+
+            for index in comparison['missing']:
+                print('Warning: Index {} is missing on {}'.format(index, collectionName))
+
+            for index in comparison['extra']:
+                print('Warning: Index {} on {} is not declared by {}'.format(index, collectionName, documentClass.__name__))
+
+            # Access counts reset when the server restarts, so this is only a hint that an index isn't pulling its weight
+            try:
+                for stats in documentClass._get_collection().aggregate([{ '$indexStats': {} }]):
+                    if (stats['name'] != '_id_' and stats['accesses']['ops'] == 0):
+                        print('Warning: Index {} on {} has not been used since {}'.format(stats['name'], collectionName, stats['accesses']['since']))
+            except OperationFailure:
+                # Not every deployment lets us read index stats
+                pass
+
+    async def Read(self, func, *args):
+        """Runs a read on the write worker, behind every write queued so far, so it can never see stale data"""
+        if (self.executor is None):
+            return func(*args)
+
+        return await asyncio.wrap_future(self.executor.submit(func, *args))
+
+    def HasPendingWrites(self):
+        return len(self.pendingWrites) > 0
+
+    async def Flush(self):
+        """Waits until every write queued so far has been sent to the database"""
+        if (self.executor is None or not self.HasPendingWrites()):
+            return
+
+        # The worker runs jobs in order, so once this marker finishes everything before it has too
+        await asyncio.wrap_future(self.executor.submit(lambda: None))
+
+persistenceService = PersistenceService()
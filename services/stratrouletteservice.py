@@ -1,4 +1,3 @@
-from tkinter import W
 import discord
 from discord.ext import commands
 from data.matchhistorydata import MatchResult
@@ -26,21 +25,19 @@ class CantModifyStratRoulette(commands.BadArgument):
         super().__init__("Can't modify the Strat Roulette settings when one isn't running")
 
 class StratRouletteTeamData(object):
-    members = []
-    type = StratRouletteTeamType.INVALID
-    canReroll = True
-    channel = None
-    strat = None
-    name = ''
-    stratMessage = None
-    stratView = None
-    totalRerolls = 0
-    rerollPlayers = []
+    __slots__ = ('members', 'type', 'name', 'canReroll', 'channel', 'strat', 'stratMessage', 'stratView', 'totalRerolls', 'rerollPlayers')
 
     def __init__(self, _members:list[discord.Member], _type:StratRouletteTeamType, _name:str):
         self.members = _members 
         self.type = _type
         self.name = _name
+        self.canReroll = True
+        self.channel = None # discord.TextChannel
+        self.strat = None # StratRouletteData
+        self.stratMessage = None # discord.Message
+        self.stratView = None # StratRouletteStratViewBase
+        self.totalRerolls = 0
+        # Type: Array<discord.Member>
         self.rerollPlayers = []
 
 class StratRouletteOvertimeRoleDropdownView(discord.ui.View):
@@ -342,6 +339,8 @@ class StratRouletteService(object):
 
         await SendChannelMessage(self.botSettings.lobbyChannel, description='_puts down the revolver_ Thanks for playing Strat Roulette!', color=discord.Color.blue())
 
+        # The match has already been called, so its players are no longer pinned in the cache
+        await self.botSettings.LoadPlayers([member.id for member in self.activeMatch.team1.members + self.activeMatch.team2.members if member is not None])
         self.StoreMatchData(matchID, matchResult)
 
         self.activeMatch = None
@@ -0,0 +1,37 @@
+from unittest import mock
+import asyncio
+import unittest
+
+try:
+    import mongomock
+    from mongoengine import connect, disconnect
+except ImportError:
+    mongomock = None
+
+@unittest.skipIf(mongomock is None, 'needs mongoengine, discord.py and mongomock')
+class MatchmakingTickTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # globals loads the bot settings on import, so the database has to be up first
+        connect('jppbottest', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+
+        from commands.botcommands import BotCommands
+        self.cog = BotCommands(None)
+
+    def tearDown(self):
+        disconnect()
+
+    async def test_TickKeepsRunningAfterError(self):
+        from globals import matchService
+
+        tick = self.cog.OnMatchmakingTick
+        tick.change_interval(seconds=0.01)
+
+        with mock.patch.object(matchService, 'GetReadyLobbies', side_effect=RuntimeError('boom')) as getReadyLobbies:
+            with mock.patch('builtins.print'):
+                tick.start()
+                await asyncio.sleep(0.1)
+
+                self.assertTrue(tick.is_running())
+                self.assertGreater(getReadyLobbies.call_count, 1)
+
+                tick.cancel()
@@ -0,0 +1,39 @@
+import unittest
+
+try:
+    from utils.leaderboardutils import Leaderboard
+except ImportError:
+    Leaderboard = None
+
+@unittest.skipIf(Leaderboard is None, 'needs sortedcontainers')
+class LeaderboardTests(unittest.TestCase):
+    def setUp(self):
+        self.leaderboard = Leaderboard()
+        self.leaderboard.Rebuild([(1, 1000), (2, 1200), (3, 900), (4, 1200)])
+
+    def test_Rebuild(self):
+        # Highest MMR first, ties broken by id
+        self.assertEqual(self.leaderboard.GetPage(0, 10), [2, 4, 1, 3])
+        self.assertEqual(len(self.leaderboard), 4)
+
+    def test_Update(self):
+        self.leaderboard.Update(3, 1300)
+        self.leaderboard.Update(5, 950)
+
+        self.assertEqual(self.leaderboard.GetPage(0, 10), [3, 2, 4, 1, 5])
+        self.assertEqual(self.leaderboard.GetIndex(3), 0)
+        self.assertEqual(self.leaderboard.GetMMR(5), 950)
+
+    def test_Remove(self):
+        self.leaderboard.Remove(2)
+        self.leaderboard.Remove(42)
+
+        self.assertNotIn(2, self.leaderboard)
+        self.assertEqual(self.leaderboard.GetPage(0, 10), [4, 1, 3])
+
+    def test_GetPage(self):
+        self.assertEqual(self.leaderboard.GetPage(1, 2), [4, 1])
+        self.assertEqual(self.leaderboard.GetPage(10, 2), [])
+
+    def test_GetIndex(self):
+        self.assertEqual([self.leaderboard.GetIndex(id) for id in (2, 4, 1, 3)], [0, 1, 2, 3])
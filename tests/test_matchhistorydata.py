@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+import unittest
+
+try:
+    import mongomock
+    from mongoengine import connect, disconnect
+    from data.matchhistorydata import MatchHistoryData, MatchResult
+except ImportError:
+    mongomock = None
+
+@unittest.skipIf(mongomock is None, 'needs mongoengine, discord.py and mongomock')
+class MatchHistoryQueryTests(unittest.TestCase):
+    def setUp(self):
+        connect('jppbottest', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        self.start = datetime(2024, 1, 1, 12, 0)
+
+        # One match an hour, stored newest first so the queries have to do the ordering
+        for i in reversed(range(10)):
+            MatchHistoryData(_matchUniqueID=i, _result=MatchResult.TEAM1VICTORY.value, _map='Map {}'.format(i), _creationTime=self.start + timedelta(hours=i)).save()
+
+    def tearDown(self):
+        MatchHistoryData.drop_collection()
+        disconnect()
+
+    def test_GetMatchesBetween(self):
+        matches = MatchHistoryData.GetMatchesBetween(self.start + timedelta(hours=2), self.start + timedelta(hours=5))
+
+        # The start is included, the end isn't, oldest first
+        self.assertEqual([match._matchUniqueID for match in matches], [2, 3, 4])
+
+    def test_GetMatchesBetweenEmptyRange(self):
+        matches = MatchHistoryData.GetMatchesBetween(self.start - timedelta(days=2), self.start - timedelta(days=1))
+
+        self.assertEqual(len(list(matches)), 0)
+
+    def test_GetLastMatches(self):
+        matches = MatchHistoryData.GetLastMatches(3)
+
+        self.assertEqual([match._matchUniqueID for match in matches], [9, 8, 7])
+
+    def test_GetLastMatchesZeroWindow(self):
+        # The default map weighting has no recency window, startup shouldn't read any matches for it
+        self.assertEqual(len(list(MatchHistoryData.GetLastMatches(0))), 0)
+        self.assertEqual(len(list(MatchHistoryData.GetLastMatches(0).filter(_result__ne=MatchResult.CANCELLED.value).only('_map'))), 0)
+
+    def test_CreationTimeIsIndexed(self):
+        self.assertIn('-_creationTime', MatchHistoryData._meta['indexes'])
+
+if __name__ == '__main__':
+    unittest.main()
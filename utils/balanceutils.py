@@ -0,0 +1,223 @@
+from itertools import combinations
+from bisect import bisect_left
+from math import comb
+import random
+
+class SumDifferenceObjective(object):
+    """Scores a split by the difference in total MMR between the two teams"""
+    sumBased = True
+
+    def Score(self, team1MMRs, team2MMRs):
+        return abs(sum(team1MMRs) - sum(team2MMRs))
+
+class VarianceObjective(object):
+    """Scores a split by the difference in total MMR, then by how differently spread out the teams are.
+       This keeps a team of two extremes from being matched against a team of average players."""
+    sumBased = False
+
+    def __init__(self, varianceWeight:float = 0.1):
+        self.varianceWeight = varianceWeight
+
+    def Score(self, team1MMRs, team2MMRs):
+        def Variance(mmrs):
+            if (len(mmrs) == 0):
+                return 0
+            mean = sum(mmrs) / len(mmrs)
+            return sum((mmr - mean) ** 2 for mmr in mmrs) / len(mmrs)
+
+        sumDiff = abs(sum(team1MMRs) - sum(team2MMRs))
+        spreadDiff = abs(Variance(team1MMRs) - Variance(team2MMRs)) ** 0.5
+        return sumDiff + self.varianceWeight * spreadDiff
+
+class TeamBalancer(object):
+    # Past this many splits we stop enumerating every split and meet in the middle instead
+    maxExhaustiveSplits = 50000
+    # How many improving swaps we allow when refining a meet in the middle result
+    maxRefineSwaps = 1000
+
+    def __init__(self, objective=None, together=None, apart=None, seed=None):
+        """
+           objective: Object with a Score(team1MMRs, team2MMRs) method, lower is better. Defaults to SumDifferenceObjective.
+           together: Array<(id, id)> pairs of player ids that should be on the same team.
+           apart: Array<(id, id)> pairs of player ids that should be on opposite teams.
+           seed: Seed for the RNG used to pick between equally good splits.
+        """
+        self.objective = objective if objective is not None else SumDifferenceObjective()
+        self.together = together if together is not None else []
+        self.apart = apart if apart is not None else []
+        self.random = random.Random(seed)
+
+    def Balance(self, players, getMMR=lambda player : player.mmr, getID=lambda player : player.user.id):
+        """Splits the players into two teams. Team 1 gets the smaller half if the number of players is odd"""
+        numPlayers = len(players)
+
+        if (numPlayers < 2):
+            return list(players), []
+
+        team1Size = numPlayers // 2
+        mmrs = [getMMR(player) for player in players]
+        constraints = self._ResolveConstraints(players, getID)
+
+        if (comb(numPlayers, team1Size) <= self.maxExhaustiveSplits):
+            team1Indices = self._BalanceExhaustive(mmrs, team1Size, constraints)
+
+            # Nothing satisfied the constraints, so settle for the best split without them
+            if (team1Indices is None):
+                team1Indices = self._BalanceExhaustive(mmrs, team1Size, ([], []))
+        else:
+            team1Indices = self._BalanceMeetInTheMiddle(mmrs, team1Size)
+
+            if (not self.objective.sumBased or len(constraints[0]) > 0 or len(constraints[1]) > 0):
+                team1Indices = self._Refine(mmrs, team1Indices, constraints)
+
+        team1Set = set(team1Indices)
+        team1 = [players[i] for i in range(numPlayers) if i in team1Set]
+        team2 = [players[i] for i in range(numPlayers) if i not in team1Set]
+        return team1, team2
+
+    def _ResolveConstraints(self, players, getID):
+        indexByID = {}
+        for i in range(len(players)):
+            indexByID[getID(players[i])] = i
+
+        def Resolve(pairs):
+            # Pairs for players that aren't in this lobby don't matter
+            return [(indexByID[a], indexByID[b]) for a, b in pairs if a in indexByID and b in indexByID]
+
+        return Resolve(self.together), Resolve(self.apart)
+
+    def _CountViolations(self, team1Set, constraints):
+        together, apart = constraints
+        violations = 0
+
+        for a, b in together:
+            if ((a in team1Set) != (b in team1Set)):
+                violations += 1
+
+        for a, b in apart:
+            if ((a in team1Set) == (b in team1Set)):
+                violations += 1
+
+        return violations
+
+    def _Score(self, mmrs, team1Set):
+        team1MMRs = [mmrs[i] for i in range(len(mmrs)) if i in team1Set]
+        team2MMRs = [mmrs[i] for i in range(len(mmrs)) if i not in team1Set]
+        return self.objective.Score(team1MMRs, team2MMRs)
+
+    def _BalanceExhaustive(self, mmrs, team1Size, constraints):
+        numPlayers = len(mmrs)
+        best = None
+        bestScore = None
+        ties = 0
+
+        # With even teams a split and its mirror are the same match, so pin the first player to team 1
+        if (numPlayers % 2 == 0):
+            candidates = ((0,) + rest for rest in combinations(range(1, numPlayers), team1Size - 1))
+        else:
+            candidates = combinations(range(numPlayers), team1Size)
+
+        # The sum objective only needs team 1's total, which saves building both teams for every split
+        hasConstraints = len(constraints[0]) > 0 or len(constraints[1]) > 0
+        total = sum(mmrs)
+
+        for team1Indices in candidates:
+            if (self.objective.sumBased):
+                if (hasConstraints and self._CountViolations(set(team1Indices), constraints) > 0):
+                    continue
+
+                score = abs(2 * sum([mmrs[i] for i in team1Indices]) - total)
+            else:
+                team1Set = set(team1Indices)
+
+                if (hasConstraints and self._CountViolations(team1Set, constraints) > 0):
+                    continue
+
+                score = self._Score(mmrs, team1Set)
+
+            if (bestScore is None or score < bestScore):
+                best = team1Indices
+                bestScore = score
+                ties = 1
+            elif (score == bestScore):
+                # Reservoir sample so every equally good split has the same chance of being picked
+                ties += 1
+                if (self.random.randrange(ties) == 0):
+                    best = team1Indices
+
+        return best
+
+    def _BalanceMeetInTheMiddle(self, mmrs, team1Size):
+        # Split the players in half, enumerate each half on its own and pair them up by their MMR sums
+        numPlayers = len(mmrs)
+        half = numPlayers // 2
+        left = list(range(half))
+        right = list(range(half, numPlayers))
+        total = sum(mmrs)
+
+        best = None
+        bestScore = None
+        ties = 0
+
+        for leftSize in range(max(0, team1Size - len(right)), min(team1Size, len(left)) + 1):
+            # Type: Dictionary<key=int, value=Array<tuple>>
+            rightBySum = {}
+            for rightIndices in combinations(right, team1Size - leftSize):
+                rightBySum.setdefault(sum(mmrs[i] for i in rightIndices), []).append(rightIndices)
+
+            rightSums = sorted(rightBySum.keys())
+
+            for leftIndices in combinations(left, leftSize):
+                leftSum = sum(mmrs[i] for i in leftIndices)
+
+                # We want team 1's sum as close to half the total as we can get
+                target = total / 2 - leftSum
+                position = bisect_left(rightSums, target)
+
+                for rightSum in rightSums[max(0, position - 1):position + 1]:
+                    score = abs(2 * (leftSum + rightSum) - total)
+                    matches = rightBySum[rightSum]
+
+                    if (bestScore is None or score < bestScore):
+                        best = leftIndices + self.random.choice(matches)
+                        bestScore = score
+                        ties = len(matches)
+                    elif (score == bestScore):
+                        ties += len(matches)
+                        if (self.random.randrange(ties) < len(matches)):
+                            best = leftIndices + self.random.choice(matches)
+
+        return best
+
+    def _Refine(self, mmrs, team1Indices, constraints):
+        # Swap players between the teams while it fixes constraints or improves the objective
+        team1Set = set(team1Indices)
+        team2Set = set(range(len(mmrs))) - team1Set
+
+        def Rank(team1Set):
+            return (self._CountViolations(team1Set, constraints), self._Score(mmrs, team1Set))
+
+        bestRank = Rank(team1Set)
+
+        for _ in range(self.maxRefineSwaps):
+            bestSwap = None
+
+            for a in team1Set:
+                for b in team2Set:
+                    swapped = (team1Set - {a}) | {b}
+                    rank = Rank(swapped)
+
+                    if (rank < bestRank):
+                        bestRank = rank
+                        bestSwap = (a, b)
+
+            if (bestSwap is None):
+                break
+
+            a, b = bestSwap
+            team1Set = (team1Set - {a}) | {b}
+            team2Set = (team2Set - {b}) | {a}
+
+        return tuple(sorted(team1Set))
+
+teamBalancer = TeamBalancer()
@@ -7,6 +7,9 @@ from discord.ext import commands
 from discord.utils import MISSING
 import discord
 import inspect
+import asyncio
+import hashlib
+import json
 
 def GuildCommand(
     *,
@@ -42,6 +45,14 @@ def GuildCommand(
 
     return decorator
 
+def GetCommandTreeHash(tree:app_commands.CommandTree, applicationID:int):
+    # Hashes exactly what tree.sync() would send (names, descriptions, parameters, choices...) so a change to any of it shows up
+    payload = {
+        'application': applicationID,
+        'commands': sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command : command['name']),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
 def IsValidChannel(channelType:ChannelType, includeAdmin=True):
     async def predicate(interaction:discord.Interaction):
         # If we haven't setup an admin channel, allow the admin commands anywhere
@@ -79,6 +90,7 @@ def IsActivePlayer():
         if (not botSettings.IsUserRegistered(interaction.user)):
             raise UserNotRegistered(interaction.user)
 
+        await botSettings.LoadPlayers([interaction.user.id])
         player = botSettings.GetRegisteredPlayerByID(interaction.user.id)
         if (player.matchesPlayed < 10):
             raise UserNotActive(interaction.user)
@@ -97,3 +109,72 @@ async def AddRoles(interaction:discord.Interaction, member, *rolesToAdd, errorMe
     except discord.HTTPException:
         await SendChannelMessage(interaction.channel, description=errorMessage, color=discord.Color.red())
 
+
+def GetRankRoles(id:int):
+    # The roles a registered player should have that the bot manages
+    roles = set()
+
+    _, newRole = botSettings.GetMMRRoleByID(id)
+
+    if (newRole is not None):
+        roles.add(newRole.role)
+
+    if (botSettings.registeredRole is not None):
+        roles.add(botSettings.registeredRole)
+
+    return roles
+
+async def ReconcileMemberRoles(member:discord.Member, managedRoles, wantedRoles, reason:str=None):
+    """Brings the member's managed roles in line with wantedRoles in a single request. Returns True if anything changed"""
+    currentRoles = set(role for role in member.roles if not role.is_default())
+    desiredRoles = (currentRoles - set(managedRoles)) | set(wantedRoles)
+
+    if (desiredRoles == currentRoles):
+        return False
+
+    await member.edit(roles=list(desiredRoles), reason=reason)
+    return True
+
+class RoleReconcileResult(object):
+    def __init__(self, total):
+        self.total = total
+        self.processed = 0
+        self.updated = 0
+        # Type: Array<discord.Member>
+        self.failed = []
+
+async def ReconcileRoles(entries, managedRoles, reason:str=None, onProgress=None, progressInterval:float=5.0, maxConcurrent:int=5):
+    """Reconciles the roles of many members at once
+
+       entries is a list of (discord.Member, wantedRoles) tuples. Members that already have the right roles don't cost a request.
+       onProgress is awaited with the RoleReconcileResult at most once every progressInterval seconds.
+    """
+    result = RoleReconcileResult(len(entries))
+    semaphore = asyncio.Semaphore(maxConcurrent)
+    loop = asyncio.get_running_loop()
+    lastProgress = loop.time()
+
+    async def Reconcile(member, wantedRoles):
+        nonlocal lastProgress
+
+        # discord.py waits out rate limits for us, this just keeps us from flooding the bucket
+        async with semaphore:
+            try:
+                if (await ReconcileMemberRoles(member, managedRoles, wantedRoles, reason)):
+                    result.updated += 1
+            except discord.HTTPException:
+                result.failed.append(member)
+
+        result.processed += 1
+
+        if (onProgress is not None and loop.time() - lastProgress >= progressInterval):
+            lastProgress = loop.time()
+
+            try:
+                await onProgress(result)
+            except discord.HTTPException:
+                # Progress is cosmetic, don't stop the reconciliation over it
+                pass
+
+    await asyncio.gather(*[ Reconcile(member, wantedRoles) for member, wantedRoles in entries ])
+    return result
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+class LRUCache(object):
+    """Keeps the most recently used values, loading anything missing on demand if given a way to. Past capacity the least
+       recently used values are dropped, except for pinned ones (ie. players who are queued or in a match).
+    """
+
+    def __init__(self, capacity:int, load = None, isPinned = None):
+        """
+           load: Function taking a key and returning its value, or None if there isn't one. Without it Get only returns what was Put.
+           isPinned: Function taking a key and returning True if it must stay cached.
+        """
+        self.capacity = capacity
+        self.load = load if load is not None else lambda key : None
+        self.isPinned = isPinned if isPinned is not None else lambda key : False
+        # Type: OrderedDict<key, value> least recently used first
+        self.values = OrderedDict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def Get(self, key):
+        if (key in self.values):
+            self.values.move_to_end(key)
+            return self.values[key]
+
+        value = self.load(key)
+
+        if (value is not None):
+            self.Put(key, value)
+
+        return value
+
+    def Put(self, key, value):
+        self.values[key] = value
+        self.values.move_to_end(key)
+        self._Evict()
+
+    def Remove(self, key):
+        self.values.pop(key, None)
+
+    def Clear(self):
+        self.values.clear()
+
+    def _Evict(self):
+        if (len(self.values) <= self.capacity):
+            return
+
+        for key in list(self.values.keys()):
+            if (len(self.values) <= self.capacity):
+                break
+
+            if (not self.isPinned(key)):
+                del self.values[key]
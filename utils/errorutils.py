@@ -7,7 +7,7 @@ from data.activitydata import InvalidActivityType, NoActivities
 from data.quipdata import NoQuips, InvalidQuipType, InvalidGuildEmoji
 from data.mappool import CantForceMapPool, InvalidMapPool, MapPoolExists, InvalidMapPoolType, InvalidMapPoolMap, MapPoolMapExists, PoolIsEmpty
 from data.stratroulettedata import InvalidStratRouletteTeamType, InvalidStratRouletteTeam, NoStratRouletteStrats, EmptyStrat
-from services.matchservice import PlayerAlreadyQueued, PlayerNotQueued, PlayerNotQueuedOrInGame, PlayersNotSwapable, PlayerSwapFailed
+from services.matchservice import PlayerAlreadyQueued, PlayerNotQueued, PlayerNotQueuedOrInGame, PlayersNotSwapable, PlayerSwapFailed, InvalidMatchID, InvalidLobby, LobbyExists, LobbyNotEmpty, CantRemoveDefaultLobby, MatchIDRequired
 from services.stratrouletteservice import CantStopStratRoulette, StratRouletteMatchAlreadyQueued, StratRouletteMatchIsActive, CantStartStratRoulette, CantModifyStratRoulette
 from utils.chatutils import SendMessage, SendChannelMessage
 
@@ -168,6 +168,24 @@ async def HandleCommandInvokeErrors(interaction:discord.Interaction, error:app_c
     elif (isinstance(error.original, PlayerSwapFailed)):
         await SendErrorMessage(interaction, description='Failed to find both Player {0.mention} and Player {1.mention} in the queue/start matches.'.format(error.original.arg1, error.original.arg2)) 
 
+    elif (isinstance(error.original, InvalidMatchID)):
+        await SendErrorMessage(interaction, description='There is no running match with id `{}`.'.format(error.original.argument))
+
+    elif (isinstance(error.original, MatchIDRequired)):
+        await SendErrorMessage(interaction, description='There is more than one match running. Please give the id of the match you want to change.')
+
+    elif (isinstance(error.original, InvalidLobby)):
+        await SendErrorMessage(interaction, description='Lobby `{}` does not exist.'.format(error.original.argument))
+
+    elif (isinstance(error.original, LobbyExists)):
+        await SendErrorMessage(interaction, description='Lobby `{}` already exists.'.format(error.original.argument))
+
+    elif (isinstance(error.original, LobbyNotEmpty)):
+        await SendErrorMessage(interaction, description='Lobby `{}` still has players queued. Clear it first.'.format(error.original.argument))
+
+    elif (isinstance(error.original, CantRemoveDefaultLobby)):
+        await SendErrorMessage(interaction, description='The default lobby can\'t be removed.')
+
     elif (isinstance(error.original, MatchIDNotFound)):
         await SendErrorMessage(interaction, description='Match with id `{}` was not found. The match history either doesn\'t exist for this match or this is not a valid match id.'.format(error.original.argument))
 
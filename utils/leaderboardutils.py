@@ -0,0 +1,49 @@
+from sortedcontainers import SortedList
+
+class Leaderboard(object):
+    """Players ordered by MMR (highest first), kept sorted as MMR changes so pages and ranks don't need a full sort.
+       Backed by a SortedList so updates, removals and rank lookups stay O(log n) as the player base grows.
+    """
+
+    def __init__(self):
+        # Type: SortedList<(int -mmr, int id)>
+        self.keys = SortedList()
+        # Type: Dictionary<key=int id, value=int mmr>
+        self.mmrs = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, id:int):
+        return id in self.mmrs
+
+    def Rebuild(self, players):
+        """players: iterable of (id, mmr)"""
+        self.mmrs = dict(players)
+        self.keys = SortedList((-mmr, id) for id, mmr in self.mmrs.items())
+
+    def Update(self, id:int, mmr:int):
+        if (id in self.mmrs):
+            if (self.mmrs[id] == mmr):
+                return
+            self.Remove(id)
+
+        self.mmrs[id] = mmr
+        self.keys.add((-mmr, id))
+
+    def Remove(self, id:int):
+        if (id not in self.mmrs):
+            return
+
+        self.keys.remove((-self.mmrs.pop(id), id))
+
+    def GetPage(self, start:int, count:int):
+        """Returns the ids of the players at ranks start + 1 through start + count"""
+        return [id for _, id in self.keys.islice(start, start + count)]
+
+    def GetIndex(self, id:int):
+        """Returns where the player sits on the leaderboard, starting at 0 for the highest MMR"""
+        return self.keys.bisect_left((-self.mmrs[id], id))
+
+    def GetMMR(self, id:int):
+        return self.mmrs[id]
@@ -0,0 +1,200 @@
+from collections import deque
+import math
+import random
+
+class FenwickTree(object):
+    """Prefix sums over a list of weights with O(log n) updates and weighted lookups"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = list(weights)
+        self.tree = [0.0] * (self.size + 1)
+
+        # Build in O(n) by pushing each node's sum up to its parent
+        for i in range(1, self.size + 1):
+            self.tree[i] += self.weights[i - 1]
+            parent = i + (i & -i)
+            if (parent <= self.size):
+                self.tree[parent] += self.tree[i]
+
+    def Update(self, index:int, weight:float):
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+
+        i = index + 1
+        while (i <= self.size):
+            self.tree[i] += delta
+            i += i & -i
+
+    def Total(self):
+        total = 0.0
+        i = self.size
+        while (i > 0):
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def Find(self, value:float):
+        """Returns the index whose weight covers value, where 0 <= value < Total()"""
+        index = 0
+        step = 1 << self.size.bit_length()
+
+        while (step > 0):
+            next = index + step
+            if (next <= self.size and self.tree[next] <= value):
+                index = next
+                value -= self.tree[next]
+            step >>= 1
+
+        # Floating point error can walk us off the end, so clamp to the last map with any weight
+        index = min(index, self.size - 1)
+        while (index > 0 and self.weights[index] <= 0):
+            index -= 1
+
+        return index
+
+class MapWeighting(object):
+    def __init__(self, playCountExponent:float = 1.0, recencyDecay:float = 0.0, cooldown:int = 0):
+        # How strongly less played maps are favoured. 0 ignores play counts
+        self.playCountExponent = playCountExponent
+        # How much of a map's weight is taken away right after it's played. It recovers by the same factor every match after
+        self.recencyDecay = recencyDecay
+        # How many of the most recent maps can't be picked at all
+        self.cooldown = cooldown
+
+    def GetRecencyWindow(self):
+        # Past this many matches the recency penalty is under 1%, so we stop tracking it
+        recencyWindow = 0
+        if (0 < self.recencyDecay < 1):
+            recencyWindow = min(20, math.ceil(math.log(0.01) / math.log(self.recencyDecay)))
+
+        return max(self.cooldown, recencyWindow)
+
+class MapCandidates(object):
+    """The maps a pool can pick from with their weights"""
+
+    def __init__(self, maps):
+        # Type: Array<SiegeMap>
+        self.maps = list(maps)
+        # Type: Dictionary<key=string lower case map name, value=int index into maps>
+        self.positions = {}
+        for i in range(len(self.maps)):
+            self.positions[self.maps[i].name.lower()] = i
+
+        self.minPlayed = 0
+        self.numAtMin = 0
+        self.tree = None
+
+class MapSelector(object):
+    """Picks maps for matches by weighted random sampling
+
+       getPoolMaps(poolName) should return every SiegeMap the pool allows. Candidate sets are built the first time a pool is used
+       and kept until Invalidate() is called, which should happen whenever maps or pools are edited.
+    """
+
+    def __init__(self, getPoolMaps, weighting:MapWeighting = None, seed = None):
+        self.getPoolMaps = getPoolMaps
+        self.weighting = weighting if weighting is not None else MapWeighting()
+        self.random = random.Random(seed)
+        # Lower case names of the most recently played maps, newest last
+        self.recentMaps = deque(maxlen=self.weighting.GetRecencyWindow())
+        # Type: Dictionary<key=string lower case pool name (None for no pool), value=MapCandidates>
+        self.candidates = {}
+
+    def Invalidate(self):
+        self.candidates = {}
+
+    def SetWeighting(self, weighting:MapWeighting):
+        self.weighting = weighting
+        self.recentMaps = deque(self.recentMaps, maxlen=weighting.GetRecencyWindow())
+        self.Invalidate()
+
+    def SetRecentMaps(self, mapNames):
+        """mapNames should be oldest first"""
+        self.recentMaps.clear()
+        self.recentMaps.extend(name.lower() for name in mapNames)
+        self.Invalidate()
+
+    def _MatchesSincePlayed(self, name:str):
+        # 1 for the last match, None if it hasn't been played recently
+        matchesAgo = 1
+        for recentMap in reversed(self.recentMaps):
+            if (recentMap == name):
+                return matchesAgo
+            matchesAgo += 1
+        return None
+
+    def _GetWeight(self, candidates:MapCandidates, _map):
+        weight = 1.0
+
+        if (self.weighting.playCountExponent > 0):
+            # Compare against the least played map in the pool so weights don't flatten out as everything gets played more
+            weight = 1.0 / math.pow(1 + _map.timesPlayed - candidates.minPlayed, self.weighting.playCountExponent)
+
+        matchesAgo = self._MatchesSincePlayed(_map.name.lower())
+
+        if (matchesAgo is not None):
+            if (matchesAgo <= self.weighting.cooldown):
+                return 0.0
+
+            weight *= 1.0 - math.pow(self.weighting.recencyDecay, matchesAgo)
+
+        return weight
+
+    def _Rebuild(self, candidates:MapCandidates):
+        candidates.minPlayed = min((_map.timesPlayed for _map in candidates.maps), default=0)
+        candidates.numAtMin = sum(1 for _map in candidates.maps if _map.timesPlayed == candidates.minPlayed)
+        candidates.tree = FenwickTree([self._GetWeight(candidates, _map) for _map in candidates.maps])
+
+    def _GetCandidates(self, poolName):
+        key = None if poolName is None else poolName.lower()
+
+        if (key not in self.candidates):
+            candidates = MapCandidates(self.getPoolMaps(poolName))
+            self._Rebuild(candidates)
+            self.candidates[key] = candidates
+
+        return self.candidates[key]
+
+    def OnMapPlayed(self, _map, previousTimesPlayed:int):
+        """Call after a map's play count has been increased"""
+        name = _map.name.lower()
+
+        # Every map in the recency window shifts back a match, so they all need new weights
+        changed = set(self.recentMaps)
+        changed.add(name)
+        self.recentMaps.append(name)
+
+        for candidates in self.candidates.values():
+            if (name in candidates.positions and previousTimesPlayed == candidates.minPlayed):
+                candidates.numAtMin -= 1
+
+                # The least played count moved up, which shifts every weight in the pool
+                if (candidates.numAtMin <= 0):
+                    self._Rebuild(candidates)
+                    continue
+
+            for changedName in changed:
+                if (changedName in candidates.positions):
+                    index = candidates.positions[changedName]
+                    candidates.tree.Update(index, self._GetWeight(candidates, candidates.maps[index]))
+
+    def Select(self, poolName, extraMap = None):
+        """Picks a map from the pool. extraMap (if given) is added as one more candidate with an average weight"""
+        candidates = self._GetCandidates(poolName)
+        numMaps = len(candidates.maps)
+        total = candidates.tree.Total()
+
+        if (extraMap is not None and extraMap.name.lower() not in candidates.positions):
+            extraWeight = total / numMaps if numMaps > 0 and total > 0 else 1.0
+            if (self.random.random() * (total + extraWeight) >= total):
+                return extraMap
+
+        if (numMaps == 0):
+            return None
+
+        # Everything is on cooldown, ignore it rather than having nothing to play
+        if (total <= 0):
+            return self.random.choice(candidates.maps)
+
+        return candidates.maps[candidates.tree.Find(self.random.random() * total)]
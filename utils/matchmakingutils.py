@@ -0,0 +1,114 @@
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime
+
+class MatchmakingWindow(object):
+    def __init__(self, baseWindow:int = 200, widenPerMinute:int = 50, maxWindow:int = 1000):
+        # The largest MMR spread allowed in a match as soon as someone joins
+        self.baseWindow = baseWindow
+        # How much the allowed spread grows for every minute the longest waiting player has been queued
+        self.widenPerMinute = widenPerMinute
+        # The allowed spread never grows past this
+        self.maxWindow = maxWindow
+
+    def GetWindow(self, waitSeconds:float):
+        return min(self.maxWindow, self.baseWindow + self.widenPerMinute * max(0.0, waitSeconds) / 60)
+
+class MatchmakingQueue(object):
+    """Waiting players kept sorted by MMR. The tightest group of any size is always a run of neighbours in this order,
+       so finding a match is a single sliding window over the queue."""
+
+    def __init__(self, window:MatchmakingWindow = None):
+        self.window = window if window is not None else MatchmakingWindow()
+        # Type: Array<(int mmr, datetime queueTime, int id)> kept in sorted order
+        self.keys = []
+        # Type: Dictionary<key=int id, value=(int mmr, datetime queueTime, int id)>
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, id:int):
+        return id in self.entries
+
+    def Add(self, id:int, mmr:int, queueTime:datetime):
+        if (id in self.entries):
+            self.Remove(id)
+
+        key = (mmr, queueTime, id)
+        self.entries[id] = key
+        insort(self.keys, key)
+
+    def Remove(self, id:int):
+        if (id not in self.entries):
+            return
+
+        key = self.entries.pop(id)
+        del self.keys[bisect_left(self.keys, key)]
+
+    def Update(self, id:int, mmr:int):
+        if (id in self.entries):
+            # Keep their place in line, only their MMR moved
+            self.Add(id, mmr, self.entries[id][1])
+
+    def FindMatch(self, size:int, now:datetime = None, ignoreWindow:bool = False):
+        """Returns the ids of size players to match. The longest waiting player is matched first if the tightest group
+           around them fits their window. Otherwise it's the group with the smallest MMR spread that fits the window of the
+           longest waiting player in it. Returns None if no group fits.
+        """
+        if (size <= 0 or len(self.keys) < size):
+            return None
+
+        now = now if now is not None else datetime.now()
+
+        # The longest waiting player goes first as soon as their window fits a group around them. Otherwise tighter
+        # groups could keep forming around an MMR outlier and they'd never get a match
+        oldestIndex = min(range(len(self.keys)), key=lambda index : self.keys[index][1])
+        best = None
+        bestSpread = None
+
+        for start in range(max(0, oldestIndex - size + 1), min(oldestIndex, len(self.keys) - size) + 1):
+            spread = self.keys[start + size - 1][0] - self.keys[start][0]
+
+            if (bestSpread is None or spread < bestSpread):
+                best = start
+                bestSpread = spread
+
+        waitSeconds = (now - self.keys[oldestIndex][1]).total_seconds()
+        if (ignoreWindow or bestSpread <= self.window.GetWindow(waitSeconds)):
+            return [key[2] for key in self.keys[best:best + size]]
+
+        best = None
+        bestSpread = None
+        # Indices into keys of the oldest queue times in the current window, oldest first
+        oldest = deque()
+
+        for end in range(len(self.keys)):
+            while (len(oldest) > 0 and self.keys[oldest[-1]][1] >= self.keys[end][1]):
+                oldest.pop()
+            oldest.append(end)
+
+            start = end - size + 1
+            if (start < 0):
+                continue
+
+            if (oldest[0] < start):
+                oldest.popleft()
+
+            spread = self.keys[end][0] - self.keys[start][0]
+
+            if (bestSpread is not None and spread >= bestSpread):
+                continue
+
+            if (not ignoreWindow):
+                waitSeconds = (now - self.keys[oldest[0]][1]).total_seconds()
+                if (spread > self.window.GetWindow(waitSeconds)):
+                    continue
+
+            best = start
+            bestSpread = spread
+
+        if (best is None):
+            return None
+
+        return [key[2] for key in self.keys[best:best + size]]